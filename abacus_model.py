@@ -31,6 +31,7 @@ interstitial_group = ui.Group('Interstitial Formation Energy', 'Interstitial For
 vacancy_group = ui.Group('Vacancy Formation Energy', 'Vacancy Formation Energy')
 gamma_group = ui.Group('GSFE Curve (Gamma Line)', 'GSFE Curve (Gamma Line)')
 phonon_group = ui.Group('Phonon Spectra', 'Phonon Spectra')
+sweep_group = ui.Group('Parameter Sweep', 'Evaluate properties over a grid of settings')
 
 
 class InjectConfig(BaseModel):
@@ -63,9 +64,9 @@ class UploadFiles(BaseModel):
     deepks: List[InputFilePath] = \
         Field(None, description='DeepKS model', )
     parameter_files: List[InputFilePath] = \
-        Field(None, ftypes=['json'], max_file_count=2,
-            description='(Optional) Specify parameter `JSON` files for APEX to override the default settings,\
-               (Do not upload if want to do setting manually in the later UI page)',
+        Field(None, ftypes=['json'],
+            description='(Optional) Specify parameter `JSON` files for APEX to override the settings of the later UI page,\
+               (files are merged in upload order, later files take precedence)',
         )
 
 
@@ -86,6 +87,10 @@ class GlobalConfig(BaseModel):
         default="c16_m32_cpu", 
         description='Bohrium machine node type for ABACUS calculation'
     )
+    auto_parallel: Boolean = Field(
+        default=False,
+        description='Set the MPI/OpenMP split of `abacus_run_command` from `scass_type` and the basis type, and `kpar`/`bndpar` of each property from its k-points'
+    )
     group_size: Int = Field(
         default=1,
         ge=1,
@@ -96,6 +101,23 @@ class GlobalConfig(BaseModel):
         ge=1,
         description='For multi tasks per parallel group, the pool size of multiprocessing pool to handle each task (1 for serial, -1 for infinity)'
     )
+    pack_workdir: Boolean = Field(
+        default=False,
+        description='Pack the staged workdir into one compressed archive with an index before submission, and copy out only the files written after it'
+    )
+    max_workflow_nodes: Int = Field(
+        default=5000,
+        ge=0,
+        description='Split configurations into several concurrently submitted workflows once the estimated node count of one workflow exceeds this (0 to disable)'
+    )
+    submission_targets: List[String] = Field(
+        default=None,
+        description='(Optional) Spread workflows over several Bohrium targets, one `project_id:platform:scass_type[:weight]` per entry'
+    )
+    quota_ledger: InputFilePath = Field(
+        default=None,
+        description='(Optional) JSON ledger of remaining quota per Bohrium project to balance `submission_targets` against, the updated ledger is written to `workdir/quota_ledger.json`'
+    )
 
 
 
@@ -138,6 +160,11 @@ class RelaxationParameters(BaseModel):
         default=None,
         description='K-point mesh for relaxation'
     )
+    kpoint_spacing: Float = Field(
+        default=None,
+        gt=0,
+        description='(Optional) K-point spacing in 1/Angstrom (2*pi included, as VASP KSPACING); computes the K_POINTS grid of every configuration and derived supercell/slab cell from its reciprocal lattice, with one k-point along vacuum, where no grid is given'
+    )
 
 
 class CalTypeOptions(String, Enum):
@@ -613,6 +640,14 @@ class PhononAdvance(BaseModel):
     )
 
 
+@sweep_group
+class SweepOptions(BaseModel):
+    sweep: Dict[String, String] = Field(
+        default=None,
+        description='(Optional) Property fields to sweep, field name -> JSON list of values, e.g. `vol_step`: `[0.02, 0.05]`; the relaxation runs once and every combination becomes a property variant of the same workflow'
+    )
+
+
 class AbacusModel(
     InjectConfig, 
     UploadFiles, 
@@ -640,6 +675,7 @@ class AbacusModel(
     PhononOptions,
     PhononParameters,
     PhononAdvance,
+    SweepOptions,
     BaseModel
 ):
     output_directory: OutputDirectory = Field(default='./outputs')
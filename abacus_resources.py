@@ -0,0 +1,161 @@
+from pathlib import Path
+import argparse
+import json
+import re
+import sys
+
+from machine import node_cores, set_mpi_ranks
+
+REPORT_FILE = 'parallel_settings.json'
+TIMINGS_FILE = 'task_timings.json'
+# LCAO diagonalization (ScaLAPACK/ELPA) scales with threads, PW runs best as pure MPI
+LCAO_THREADS = 2
+# band groups only pay off for PW with this many ranks per k-point pool
+MIN_RANKS_FOR_BNDPAR = 16
+TOTAL_TIME = re.compile(r'Total\s+Time\s*:\s*(\d+)\s*h\s*(\d+)\s*mins?\s*(\d+)\s*secs?')
+
+
+def read_input(text):
+    tags = {}
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line or line.upper() == 'INPUT_PARAMETERS':
+            continue
+        key, _, value = line.partition(' ')
+        tags[key.strip().lower()] = value.strip()
+    return tags
+
+
+def kpoint_count(k_points):
+    # irreducible upper bound of a Monkhorst-Pack grid with time reversal, Gamma only without a grid
+    if not k_points:
+        return 1
+    grid = [int(ii) for ii in list(k_points)[:3]]
+    product = grid[0] * grid[1] * grid[2]
+    return (product + 1) // 2
+
+
+def basis_of(input_file):
+    return read_input(Path(input_file).read_text()).get("basis_type", "pw").lower()
+
+
+def split_node(opts):
+    """MPI ranks and OpenMP threads per rank on the node of `opts`, for the basis of its INPUT.
+
+    Reads the INPUT copied into the work dir, where the interaction refers to it by name.
+    """
+    cores = node_cores(opts.scass_type, opts.submission_targets)
+    basis_type = basis_of(Path(opts.input).name)
+    threads = LCAO_THREADS if basis_type == 'lcao' and cores >= 4 * LCAO_THREADS else 1
+    return {"ranks": cores // threads, "threads": threads}
+
+
+def decompose(ranks, nkpts, basis_type):
+    kpar = max(ii for ii in range(1, ranks + 1) if ranks % ii == 0 and ii <= nkpts)
+    per_pool = ranks // kpar
+    bndpar = 2 if basis_type == 'pw' and per_pool >= MIN_RANKS_FOR_BNDPAR and per_pool % 2 == 0 else 1
+    return {"kpar": kpar, "bndpar": bndpar}
+
+
+def run_command(command, split):
+    return f'export OMP_NUM_THREADS={split["threads"]}; {set_mpi_ranks(command, split["ranks"])}'
+
+
+def apply_parallel_settings(parameter_dict, split, report_file=REPORT_FILE):
+    """Put kpar/bndpar into the cal_setting of the relaxation and of every property.
+
+    Values set in the INPUT file, `specify_*_input` or uploaded parameter files are kept.
+    Returns {"relaxation" or "<type>[_<suffix>]": settings} for the log.
+    """
+    base = read_input(Path(parameter_dict["interaction"]["incar"]).read_text())
+    basis_type = base.get("basis_type", "pw").lower()
+    ranks = split["ranks"]
+    report = {}
+
+    def inject(cal_setting, name):
+        nkpts = kpoint_count(cal_setting.get("K_POINTS"))
+        settings = decompose(ranks, nkpts, basis_type)
+        for key, value in settings.items():
+            # 1 is the ABACUS default
+            if value > 1 and key not in base and key not in cal_setting:
+                cal_setting[key] = value
+        report[name] = {"kpoints": nkpts, "kpar": cal_setting.get("kpar", base.get("kpar", 1)),
+                        "bndpar": cal_setting.get("bndpar", base.get("bndpar", 1))}
+
+    inject(parameter_dict.setdefault("relaxation", {}).setdefault("cal_setting", {}), 'relaxation')
+    for prop in parameter_dict.get("properties", []):
+        name = prop["type"] + (f'_{prop["suffix"]}' if prop.get("suffix") else '')
+        inject(prop.setdefault("cal_setting", {}), name)
+    with open(report_file, 'w') as f:
+        json.dump({"basis_type": basis_type, "ranks": ranks, "threads": split["threads"], "tasks": report},
+                  f, indent=2)
+    return report
+
+
+def format_report(report, split):
+    lines = []
+    for name, entry in report.items():
+        lines.append(f'{name}: {entry["kpoints"]} k-points on {split["ranks"]} ranks x {split["threads"]} '
+                     f'threads -> kpar {entry["kpar"]}, bndpar {entry["bndpar"]}')
+    return '\n'.join(lines)
+
+
+def task_seconds(task_dir):
+    for log in sorted(Path(task_dir).glob('OUT.*/running_*.log')):
+        match = None
+        for match in TOTAL_TIME.finditer(log.read_text(errors='replace')):
+            pass
+        if match:
+            hours, minutes, seconds = map(int, match.groups())
+            return hours * 3600 + minutes * 60 + seconds
+    return None
+
+
+def collect_timings(workdir):
+    """Measured wall time of every downloaded task next to the parallel settings it ran with.
+
+    Returns None, and writes nothing, while no task log has been downloaded.
+    """
+    workdir = Path(workdir)
+    if next(workdir.glob('**/returns/conf.*/**/OUT.*/running_*.log'), None) is None:
+        return None
+    reports = {}
+    timings = []
+    for conf_dir in sorted(workdir.glob('**/returns/conf.*')):
+        # every work dir (shard, k-point group) keeps the report it was planned with
+        report_file = conf_dir.parent.parent / REPORT_FILE
+        if report_file not in reports:
+            reports[report_file] = {}
+            if report_file.exists():
+                with open(report_file, 'r') as f:
+                    reports[report_file] = json.load(f)["tasks"]
+        settings = reports[report_file]
+        task_dirs = [conf_dir / 'relaxation' / 'relax_task'] + sorted(conf_dir.glob('*/task.*'))
+        for task_dir in task_dirs:
+            seconds = task_seconds(task_dir)
+            if seconds is None:
+                continue
+            prop_dir = task_dir.parent.name
+            # `eos_00` is the default suffix of an unswept property
+            name = 'relaxation' if prop_dir == 'relaxation' else \
+                prop_dir if prop_dir in settings else prop_dir.split('_')[0]
+            timings.append(dict(settings.get(name, {}), task=str(task_dir.relative_to(workdir)), seconds=seconds))
+    with open(workdir / TIMINGS_FILE, 'w') as f:
+        json.dump(timings, f, indent=2)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Collect ABACUS task timings of a downloaded work dir')
+    parser.add_argument('workdir', nargs='?', default='workdir')
+    args = parser.parse_args(argv)
+    timings = collect_timings(args.workdir)
+    if timings is None:
+        print(f'no ABACUS task logs in {args.workdir}, download the results first')
+        return 1
+    print(f'{len(timings)} task timings written to {Path(args.workdir) / TIMINGS_FILE}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,18 @@ import shutil
 import json
 from monty.serialization import loadfn
 from apex.submit import submit_workflow
+from tracing import Tracer
+from parameters import layer_parameter_files, dump_parameters
+from sharding import shard_workdir, record_submissions
+from targets import LEDGER_FILE, QuotaLedger, parse_targets, plan_submissions, plan_subdirs, target_config
+from checkpoint import Checkpoint, input_hash
+from archive import pack_workdir, copy_unpacked
+from validation import check_consistency
+from property_registry import build_relaxation, build_properties
+from sweep import sweep_properties
+from staging import prune_files, format_bytes
+from abacus_resources import REPORT_FILE, split_node, run_command, apply_parallel_settings, format_report, collect_timings
+from kpoints import stage_kpoint_groups
 from abacus_model import AbacusModel
 
 
@@ -43,7 +55,8 @@ def get_global_config(opts: AbacusModel):
         "run_image_name": opts.abacus_image_name,
         "group_size": opts.group_size,
         "pool_size": opts.pool_size,
-        "run_command": opts.abacus_run_command,
+        "run_command": run_command(opts.abacus_run_command, split_node(opts)) if opts.auto_parallel \
+            else opts.abacus_run_command,
         "is_bohrium_dflow": True,
     }
     json.dump(global_config, open('global_config_tmp.json', 'w'), indent=2)
@@ -66,247 +79,13 @@ def get_interaction(opts: AbacusModel):
 
 
 def get_relaxation(opts: AbacusModel):
-    relaxation = {}
-    relaxation["cal_setting"] = {
-        "relax_pos": opts.relax_pos,
-        "relax_shape": opts.relax_shape,
-        "relax_vol": opts.relax_vol,
-    }
-    if opts.specify_relax_input:
-        for k, v in opts.relax_input.items():
-            relaxation["cal_setting"][k] = v
-    if opts.k_points:
-        relaxation["cal_setting"]["K_POINTS"] = opts.k_points
-    return relaxation
+    return build_relaxation(opts, 'abacus')
 
 
 def get_properties(opts: AbacusModel):
-    properties = []
-    #EOS
-    if opts.select_eos:
-        eos_params = {
-            "type": "eos",
-            "skip": False,
-            "vol_start": opts.vol_start,
-            "vol_end": opts.vol_end,
-            "vol_step": opts.vol_step,
-            "vol_abs": opts.vol_abs,
-            "cal_type": opts.eos_cal_type
-        }
-        if opts.custom_eos_calc:
-            eos_params["cal_setting"] = {
-                "relax_pos": opts.eos_relax_pos,
-                "relax_shape": opts.eos_relax_shape,
-                "relax_vol": opts.eos_relax_vol,
-            }
-            if opts.eos_k_points:
-                eos_params["cal_setting"]["K_POINTS"] = opts.eos_k_points
-            if opts.specify_eos_input:
-                for k, v in opts.eos_input.items():
-                    eos_params["cal_setting"][k] = v
-            if opts.eos_input:
-                with open('INPUT.eos', 'w') as f:
-                    f.write(opts.eos_input)
-                eos_params["cal_setting"]["input_prop"] = "INPUT.eos"
-        properties.append(eos_params)
-
-    # Elasitc
-    if opts.select_elastic:
-        elastic_params = {
-            "type": "elastic",
-            "skip": False,
-            "norm_deform": opts.norm_deform,
-            "shear_deform": opts.shear_deform,
-            "cal_type": opts.elastic_cal_type,
-            "conventional": opts.conventional,
-            "ieee": opts.ieee,
-            "modulus_type": opts.modulus_type
-        }
-        if opts.custom_elastic_calc:
-            elastic_params["cal_setting"] = {
-                "relax_pos": opts.eos_relax_pos,
-                "relax_shape": opts.eos_relax_shape,
-                "relax_vol": opts.eos_relax_vol,
-            }
-            if opts.elastic_ediff:
-                elastic_params["cal_setting"]["ediff"] = opts.elastic_ediff
-            if opts.elastic_ediffg:
-                elastic_params["cal_setting"]["ediffg"] = opts.elastic_ediffg
-            if opts.elastic_encut:
-                elastic_params["cal_setting"]["encut"] = opts.elastic_encut
-            if opts.elastic_kspacing:
-                elastic_params["cal_setting"]["kspacing"] = opts.elastic_kspacing
-            if opts.elastic_k_points:
-                elastic_params["cal_setting"]["K_POINTS"] = opts.elastic_k_points
-            
-            
-            if opts.elastic_input:
-                with open('INPUT.elastic', 'w') as f:
-                    f.write(opts.elastic_input)
-                elastic_params["cal_setting"]["input_prop"] = "INPUT.elastic"
-        properties.append(elastic_params)
-    
-    # Surface
-    if opts.select_surface:
-        surface_params = {
-            "type": "surface",
-            "skip": False,
-            "max_miller": opts.max_miller,
-            "min_slab_size": opts.min_slab_size,
-            "min_vacuum_size": opts.min_vacuum_size,
-            "pert_xz": opts.pert_xz,
-            "cal_type": opts.surface_cal_type,
-        }
-        if opts.custom_surface_calc:
-            surface_params["cal_setting"] = {
-                "relax_pos": opts.surface_relax_pos,
-                "relax_shape": opts.surface_relax_shape,
-                "relax_vol": opts.surface_relax_vol,
-            }
-            if opts.surface_ediff:
-                surface_params["cal_setting"]["ediff"] = opts.surface_ediff
-            if opts.surface_ediffg:
-                surface_params["cal_setting"]["ediffg"] = opts.surface_ediffg
-            if opts.surface_encut:
-                surface_params["cal_setting"]["encut"] = opts.surface_encut
-            if opts.surface_kspacing:
-                surface_params["cal_setting"]["kspacing"] = opts.surface_kspacing
-            if opts.surface_k_points:
-                surface_params["cal_setting"]["K_POINTS"] = opts.surface_k_points
-            
-            if opts.surface_input:
-                with open('INPUT.surface', 'w') as f:
-                    f.write(opts.surface_input)
-                surface_params["cal_setting"]["input_prop"] = "INPUT.surface"
-        properties.append(surface_params)
-
-    # Interstitial
-    if opts.select_interstitial:
-        interstitial_params = {
-            "type": "interstitial",
-            "skip": False,
-            "supercell_size": opts.interstitial_supercell_size,
-            "insert_ele": opts.insert_ele,
-            "cal_type": opts.interstitial_cal_type,
-        }
-        if opts.custom_interstitial_calc:
-            interstitial_params["cal_setting"] = {
-                "relax_pos": opts.interstitial_relax_pos,
-                "relax_shape": opts.interstitial_relax_shape,
-                "relax_vol": opts.interstitial_relax_vol,
-            }
-            if opts.interstitial_ediff:
-                interstitial_params["cal_setting"]["ediff"] = opts.interstitial_ediff
-            if opts.interstitial_ediffg:
-                interstitial_params["cal_setting"]["ediffg"] = opts.interstitial_ediffg
-            if opts.interstitial_encut:
-                interstitial_params["cal_setting"]["encut"] = opts.interstitial_encut
-            if opts.interstitial_kspacing:
-                interstitial_params["cal_setting"]["kspacing"] = opts.interstitial_kspacing
-            if opts.interstitial_k_points:
-                interstitial_params["cal_setting"]["K_POINTS"] = opts.interstitial_k_points
-            
-            if opts.interstitial_input:
-                with open('INPUT.interstitial', 'w') as f:
-                    f.write(opts.interstitial_input)
-                interstitial_params["cal_setting"]["input_prop"] = "INPUT.interstitial"
-        properties.append(interstitial_params)
-
-    # Vacancy
-    if opts.select_vacancy:
-        vacancy_params = {
-            "type": "vacancy",
-            "skip": False,
-            "supercell_size": opts.vacancy_supercell_size,
-            "cal_type": opts.vacancy_cal_type,
-        }
-        if opts.custom_vacancy_calc:
-            vacancy_params["cal_setting"] = {
-                "relax_pos": opts.vacancy_relax_pos,
-                "relax_shape": opts.vacancy_relax_shape,
-                "relax_vol": opts.vacancy_relax_vol,
-            }
-            if opts.vacancy_ediff:
-                vacancy_params["cal_setting"]["ediff"] = opts.vacancy_ediff
-            if opts.vacancy_ediffg:
-                vacancy_params["cal_setting"]["ediffg"] = opts.vacancy_ediffg
-            if opts.vacancy_encut:
-                vacancy_params["cal_setting"]["encut"] = opts.vacancy_encut
-            if opts.vacancy_kspacing:
-                vacancy_params["cal_setting"]["kspacing"] = opts.vacancy_kspacing
-            if opts.vacancy_k_points:
-                vacancy_params["cal_setting"]["K_POINTS"] = opts.vacancy_k_points
-            
-            if opts.vacancy_input:
-                with open('INPUT.vacancy', 'w') as f:
-                    f.write(opts.vacancy_input)
-                vacancy_params["cal_setting"]["input_prop"] = "INPUT.vacancy"
-        properties.append(vacancy_params)
-    
-    # Vacancy
-    if opts.select_gamma:
-        gamma_params = {
-            "type": "gamma",
-            "skip": False,
-            "plane_miller": opts.plane_miller,
-            "slip_direction": opts.slip_direction,
-            "slip_length": opts.slip_length,
-            "plane_shift": opts.plane_shift,
-            "n_steps": opts.gamma_n_steps,
-            "supercell_size": opts.gamma_supercell_size,
-            "vacuum_size": opts.gamma_vacuum_size,
-            "add_fix": [
-                "true" if opts.add_fix_x else "false", 
-                "true" if opts.add_fix_y else "false", 
-                "true" if opts.add_fix_z else "false"
-                ],
-            "cal_type": opts.gamma_cal_type,
-        }
-        if opts.custom_gamma_calc:
-            gamma_params["cal_setting"] = {
-                "relax_pos": opts.gamma_relax_pos,
-                "relax_shape": opts.gamma_relax_shape,
-                "relax_vol": opts.gamma_relax_vol,
-            }
-            if opts.gamma_ediff:
-                gamma_params["cal_setting"]["ediff"] = opts.gamma_ediff
-            if opts.gamma_ediffg:
-                gamma_params["cal_setting"]["ediffg"] = opts.gamma_ediffg
-            if opts.gamma_encut:
-                gamma_params["cal_setting"]["encut"] = opts.gamma_encut
-            if opts.gamma_kspacing:
-                gamma_params["cal_setting"]["kspacing"] = opts.gamma_kspacing
-            if opts.gamma_k_points:
-                gamma_params["cal_setting"]["K_POINTS"] = opts.gamma_k_points
-            
-            if opts.gamma_input:
-                with open('INPUT.gamma', 'w') as f:
-                    f.write(opts.gamma_input)
-                gamma_params["cal_setting"]["input_prop"] = "INPUT.gamma"
-        properties.append(gamma_params)
-        
-    if opts.select_phonon:
-        phonon_params = {
-            "type": "phonon",
-            "skip": False,
-            "primitive_cell": opts.primitive_cell,
-            "supercell_size": opts.phonon_supercell_size,
-            "seekpath_from_original": opts.seekpath_from_original,
-            "BAND": opts.band,
-            "BAND_LABELS": opts.band_labels,
-            "MESH": opts.mesh,
-            "PRIMITIVE_AXES": opts.primitive_axes,
-            "BAND_POINTS": opts.band_points,
-            "BAND_CONNECTION": opts.band_connection,
-            "cal_setting": {}
-        }
-        if opts.phonon_input:
-            with open('INPUT.phonon', 'w') as f:
-                f.write(opts.phonon_input)
-            phonon_params["cal_setting"]["input_prop"] = "INPUT.phonon"
-        properties.append(phonon_params)
-
-    return properties
+    if opts.sweep:
+        return sweep_properties(opts, 'abacus', opts.sweep)
+    return build_properties(opts, 'abacus')
 
 
 def get_parameter_dict(opts: AbacusModel):
@@ -315,9 +94,9 @@ def get_parameter_dict(opts: AbacusModel):
         "interaction": get_interaction(opts),
         "relaxation": get_relaxation(opts)
     }
-    if get_properties(opts):
-        parameter_dict["properties"] = get_properties(opts)
-        
+    properties = get_properties(opts)
+    if properties:
+        parameter_dict["properties"] = properties
     return parameter_dict
 
 
@@ -325,69 +104,156 @@ def abacus_runner(opts: AbacusModel):
     cwd = Path.cwd()
     parameter_dicts = []
     print('start running....')
+    tracer = Tracer('abacus_runner')
+    trace_file = cwd / opts.output_directory / 'runner_trace.json'
+
+    # fail fast on inconsistent inputs before anything is staged or submitted
+    with tracer.span('consistency_check', files=len(opts.configurations)):
+        species_report = check_consistency(opts, 'abacus')
+
     workdir = cwd / 'workdir'
     returns_dir = workdir / 'returns'
-    if os.path.exists(workdir):
-        shutil.rmtree(workdir)
-    workdir.mkdir()
-    returns_dir.mkdir()
+    # a retry picks up after the last completed phase instead of restaging
+    checkpoint = Checkpoint.resume(workdir, input_hash(opts))
+    count = len(opts.configurations)
+
+    try:
+        if not checkpoint.reached('staged'):
+            # papare input POSCAR
+            with tracer.span('input_staging') as span:
+                count = 0
+                for ii in opts.configurations:
+                    conf_dir = returns_dir / ("conf.%06d" % count)
+                    conf_dir.mkdir()
+                    span.copy(ii, conf_dir/'POSCAR')
+                    count += 1
+
+            # papare INPUT, potential, orb and deepks files
+            with tracer.span('model_staging') as span:
+                span.copy(opts.input, workdir)
+                # only stage files of elements present in the configurations
+                pruned_files = 0
+                pruned_bytes = 0
+                for files, map_name in [
+                    (opts.potentials, "potential_map"),
+                    (opts.orbfiles, "orbfile_map"),
+                    (opts.deepks, "deepks_map"),
+                ]:
+                    kept, saved = prune_files(
+                        files, species_report["maps"][map_name], species_report["elements"])
+                    for ii in kept:
+                        span.copy(ii, workdir)
+                    pruned_files += len(files or []) - len(kept)
+                    pruned_bytes += saved
+                span.set(pruned_files=pruned_files, pruned_bytes=pruned_bytes)
+                print(f'skip {pruned_files} unused potential/orbital/DeepKS files ({format_bytes(pruned_bytes)})')
+
+            checkpoint.complete('staged')
 
-    # papare input POSCAR
-    count = 0
-    for ii in opts.configurations:
         os.chdir(workdir)
-        conf_dir = returns_dir / ("conf.%06d" % count)
-        conf_dir.mkdir()
-        os.chdir(cwd)
-        shutil.copy(ii, conf_dir/'POSCAR')
-        count += 1
+        # papare global config
+        with tracer.span('config_build'):
+            config_dict = get_global_config(opts)
+
+        if not checkpoint.reached('planned'):
+            # papare parameter files, uploaded files are layered over the UI settings
+            with tracer.span('property_build'):
+                parameter_dict = get_parameter_dict(opts)
+            with tracer.span('parameter_files') as span:
+                parameter_files = [cwd / ii for ii in opts.parameter_files or []]
+                parameter_dict = layer_parameter_files(parameter_dict, parameter_files)
+                parameter_dicts.append(dump_parameters(parameter_dict, 'parameter_tmp.json'))
+                span.set(layers=len(parameter_files))
+                span.count('parameter_tmp.json')
 
-    # papare INPUT
-    shutil.copy(opts.input, workdir)
+            # one K_POINTS grid per configuration and derived cell, configurations sharing them grouped
+            groups = [('./', parameter_dicts[0])]
+            if opts.kpoint_spacing:
+                with tracer.span('kpoint_grids') as span:
+                    groups = stage_kpoint_groups(workdir, parameter_dicts[0], opts.kpoint_spacing)
+                    span.set(groups=len(groups))
 
-    # papare potential files
-    for ii in opts.potentials:
-        shutil.copy(ii, workdir)
+            if opts.auto_parallel:
+                # after layering, uploaded files may set k-points or kpar themselves
+                with tracer.span('parallel_settings') as span:
+                    split = split_node(opts)
+                    for work_dir, parameters in groups:
+                        report = apply_parallel_settings(parameters, split, Path(work_dir) / REPORT_FILE)
+                        print(format_report(report, split))
+                    span.set(ranks=split["ranks"], threads=split["threads"])
+            groups = [(work_dir, dump_parameters(parameters, Path(work_dir) / 'parameter_tmp.json'))
+                      for work_dir, parameters in groups]
 
-    # papare orb files
-    for ii in opts.orbfiles:
-        shutil.copy(ii, workdir)
-    
-    # papare deepks files
-    if opts.deepks:
-        for ii in opts.deepks:
-            shutil.copy(ii, workdir)
+            # split oversized studies into concurrently submitted workflows,
+            # spread over the submission targets if there are several
+            targets = parse_targets(opts.submission_targets)
+            ledger = QuotaLedger(cwd / opts.quota_ledger if opts.quota_ledger else None, workdir / LEDGER_FILE)
+            with tracer.span('sharding') as span:
+                if len(groups) > 1:
+                    # every k-point group is sharded and planned like a study of its own
+                    submissions, shards, nodes = plan_subdirs(
+                        workdir, groups, config_dict, targets, ledger, opts.max_workflow_nodes, opts.group_size)
+                else:
+                    parameter_dicts[0] = groups[0][1]
+                    work_dirs, nodes = shard_workdir(
+                        workdir, parameter_dicts[0], count, opts.max_workflow_nodes, opts.group_size,
+                        min_shards=len(targets))
+                    submissions = plan_submissions(workdir, work_dirs, config_dict, targets, ledger)
+                    shards = len(work_dirs)
+                span.set(shards=shards, estimated_nodes=nodes, targets=len(submissions))
+            checkpoint.plan(parameter_dicts, config_dict, submissions)
+        else:
+            parameter_dicts = checkpoint.data["parameters"]
+            if checkpoint.config_changed(config_dict):
+                print('global config changed since the checkpoint, pending workflows use the new one')
 
-    os.chdir(workdir)
-    # papare global config
-    config_dict = get_global_config(opts)
-    
-    # papare parameter files
-    if opts.parameter_files:
-        for ii in opts.parameter_files:
-            os.chdir(cwd)
-            with open(ii, 'r') as f:
-                j = json.load(f)
-                j["structures"] = ["returns/conf.*"]
-            with open(ii, 'w') as r:
-                json.dump(j, r, indent=2)
-            shutil.copy(ii, workdir)
-            parameter_dicts.append(loadfn(ii))
-            os.chdir(workdir)
-    else:
-        parsed_parameter_dict = get_parameter_dict(opts)
-        json.dump(parsed_parameter_dict, open('parameter_tmp.json', 'w'), indent=2)
-        parsed_parameter_dict = loadfn('parameter_tmp.json')
-        parameter_dicts.append(parsed_parameter_dict)
-    
-    # submit APEX workflow
-    submit_workflow(
-        parameter_dicts=parameter_dicts,
-        config_dict=config_dict,
-        work_dirs=['./'],
-        indicated_flow_type=None,
-        labels=opts.dflow_labels
-    )
+        if opts.pack_workdir:
+            # the staged and planned tree, packed before APEX adds its records to the work dirs
+            with tracer.span('pack_workdir') as span:
+                archive, index = pack_workdir(workdir, cwd / opts.output_directory)
+                span.set(files=len(index["members"]), bytes=index["archive_bytes"], raw_bytes=index["raw_bytes"])
+                print(f'staged workdir packed into {archive}')
 
-    os.chdir(cwd)
-    shutil.copytree(workdir, Path(opts.output_directory)/'workdir', dirs_exist_ok = True)
+        # submit APEX workflow, work dirs Argo already accepted are never resubmitted
+        with tracer.span('submit_workflow') as span:
+            submitted = 0
+            for group in checkpoint.data["groups"]:
+                pending = checkpoint.pending(group["work_dirs"])
+                if pending:
+                    submit_workflow(
+                        parameter_dicts=group.get("parameters", parameter_dicts),
+                        config_dict=target_config(config_dict, group["target"]),
+                        work_dirs=pending,
+                        indicated_flow_type=None,
+                        labels=opts.dflow_labels
+                    )
+                    submitted += len(pending)
+                checkpoint.record(group)
+            record_submissions(workdir, [ii for gg in checkpoint.data["groups"] for ii in gg["work_dirs"]])
+            checkpoint.complete('submitted')
+            span.set(workflows=submitted)
+
+        if opts.auto_parallel:
+            # measured task times next to the settings they ran with, to check the heuristic
+            with tracer.span('task_timings') as span:
+                timings = collect_timings(workdir)
+                if timings is None:
+                    # submit_workflow returns once Argo accepts the workflows, the logs come with the results
+                    print('no task logs yet, run `python abacus_resources.py <downloaded workdir>` '
+                          'once the results are downloaded')
+                else:
+                    span.set(tasks=len(timings))
+                    print(f'{len(timings)} task timings written to task_timings.json')
+
+        os.chdir(cwd)
+        with tracer.span('copy_out') as span:
+            if opts.pack_workdir:
+                copied = copy_unpacked(workdir, Path(opts.output_directory)/'workdir', index, copy_function=span.copy)
+                span.set(files=len(copied))
+            else:
+                shutil.copytree(workdir, Path(opts.output_directory)/'workdir',
+                                copy_function=span.copy, dirs_exist_ok=True)
+    finally:
+        os.chdir(cwd)
+        tracer.dump(trace_file)
+        print(f'phase timings (ms): {tracer.summary()}')
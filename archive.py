@@ -0,0 +1,205 @@
+from fnmatch import fnmatch
+from pathlib import Path
+import argparse
+import gzip
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAME_SIZE = 4 * 2**20
+CHUNK_SIZE = 2**20
+# refuse absolute paths and links escaping the destination where supported
+EXTRACT_KWARGS = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+
+def archive_suffix():
+    return '.tar.zst' if zstandard else '.tar.gz'
+
+
+def index_path(archive):
+    return Path(str(archive) + '.index.json')
+
+
+def _compress(data, level):
+    if zstandard:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=min(level, 9))
+
+
+def _frame_writer(out, level):
+    # one independently compressed frame, streamed so a large member never sits in memory
+    if zstandard:
+        return zstandard.ZstdCompressor(level=level).stream_writer(out, closefd=False)
+    return gzip.GzipFile(fileobj=out, mode='wb', compresslevel=min(level, 9))
+
+
+class _Slice(io.RawIOBase):
+    # the next `length` bytes of `f`, so a decompressor never reads into the following frame
+    def __init__(self, f, length):
+        self.f = f
+        self.left = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.f.read(min(len(b), self.left))
+        self.left -= len(data)
+        b[:len(data)] = data
+        return len(data)
+
+
+def _frame_reader(f, length, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('`zstandard` is required to read zstd archives')
+        return zstandard.ZstdDecompressor().stream_reader(_Slice(f, length))
+    return gzip.GzipFile(fileobj=_Slice(f, length), mode='rb')
+
+
+def _walk(src):
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            yield Path(root) / name
+
+
+def pack_directory(src, archive, level=3, frame_size=FRAME_SIZE):
+    # Members are packed into independently compressed frames of about
+    # `frame_size` bytes. Concatenated frames still form one valid
+    # .tar.zst/.tar.gz stream, and the index lets a task decompress only
+    # the frames holding the members it needs. Members larger than a frame
+    # get a frame of their own and are streamed through the compressor.
+    src = Path(src)
+    index = {
+        "codec": "zstd" if zstandard else "gzip",
+        "frames": [],
+        "members": {},
+        # files modified later are not in the archive, see `copy_unpacked`
+        "time_ns": time.time_ns(),
+    }
+    buf = io.BytesIO()
+    raw_bytes = 0
+    with open(archive, 'wb') as out:
+        def flush_frame():
+            data = buf.getvalue()
+            if not data:
+                return
+            comp = _compress(data, level)
+            index["frames"].append([out.tell(), len(comp)])
+            out.write(comp)
+            buf.seek(0)
+            buf.truncate()
+
+        def stream_member(info, path):
+            flush_frame()
+            start = out.tell()
+            with _frame_writer(out, level) as writer:
+                writer.write(info.tobuf(tarfile.PAX_FORMAT, tar.encoding, tar.errors))
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        writer.write(chunk)
+                writer.write(tarfile.NUL * (-info.size % tarfile.BLOCKSIZE))
+            index["frames"].append([start, out.tell() - start])
+
+        tar = tarfile.open(fileobj=buf, mode='w', format=tarfile.PAX_FORMAT)
+        for path in _walk(src):
+            arcname = path.relative_to(src).as_posix()
+            info = tar.gettarinfo(path, arcname)
+            if info.isreg() and info.size >= frame_size:
+                stream_member(info, path)
+                index["members"][arcname] = len(index["frames"]) - 1
+            else:
+                tar.add(path, arcname, recursive=False)
+                index["members"][arcname] = len(index["frames"])
+            raw_bytes += info.size if info.isreg() else 0
+            if buf.tell() >= frame_size:
+                flush_frame()
+        tar.close()
+        flush_frame()
+        index["archive_bytes"] = out.tell()
+    index["raw_bytes"] = raw_bytes
+    with open(index_path(archive), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def load_index(archive):
+    with open(index_path(archive), 'r') as f:
+        return json.load(f)
+
+
+def extract_members(archive, patterns, dest='.'):
+    index = load_index(archive)
+    wanted = {name for name in index["members"] if any(fnmatch(name, pp) for pp in patterns)}
+    frames = sorted({index["members"][name] for name in wanted})
+    extracted = []
+    with open(archive, 'rb') as f:
+        for ii in frames:
+            offset, length = index["frames"][ii]
+            f.seek(offset)
+            # a frame holds whole members but no end-of-archive marker
+            reader = _frame_reader(f, length, index["codec"])
+            with tarfile.open(fileobj=reader, mode='r|', ignore_zeros=True) as tar:
+                try:
+                    for member in tar:
+                        if member.name in wanted:
+                            tar.extract(member, dest, **EXTRACT_KWARGS)
+                            extracted.append(member.name)
+                except tarfile.ReadError:
+                    pass
+    return extracted
+
+
+def pack_workdir(workdir, output_directory):
+    archive = Path(output_directory) / ('workdir' + archive_suffix())
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    return archive, pack_directory(workdir, archive)
+
+
+def copy_unpacked(src, dest, index, copy_function=shutil.copy2):
+    # records written after packing, e.g. `.workflow.log`, go next to the archive
+    src = Path(src)
+    copied = []
+    for path in _walk(src):
+        arcname = path.relative_to(src).as_posix()
+        if not path.is_file() or (arcname in index["members"] and path.stat().st_mtime_ns < index["time_ns"]):
+            continue
+        target = Path(dest) / arcname
+        target.parent.mkdir(parents=True, exist_ok=True)
+        copy_function(path, target)
+        copied.append(arcname)
+    return copied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack or partially extract a staged APEX workdir')
+    sub = parser.add_subparsers(dest='command', required=True)
+    pack = sub.add_parser('pack')
+    pack.add_argument('src')
+    pack.add_argument('archive')
+    pack.add_argument('--level', type=int, default=3)
+    extract = sub.add_parser('extract')
+    extract.add_argument('archive')
+    extract.add_argument('patterns', nargs='+', help='glob patterns of members to extract')
+    extract.add_argument('-C', '--directory', default='.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        index = pack_directory(args.src, args.archive, level=args.level)
+        print(f'{len(index["members"])} members, {index["raw_bytes"]} -> {index["archive_bytes"]} bytes')
+    else:
+        extracted = extract_members(args.archive, args.patterns, args.directory)
+        print(f'extracted {len(extracted)} members')
+
+
+if __name__ == '__main__':
+    main()
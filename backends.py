@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from lmp_model import LammpsModel
+from lmp_runner import lmp_runner
+from vasp_model import VaspModel
+from vasp_runner import vasp_runner
+from abacus_model import AbacusModel
+from abacus_runner import abacus_runner
+
+BACKENDS = {
+    "lammps": (LammpsModel, lmp_runner),
+    "vasp": (VaspModel, vasp_runner),
+    "abacus": (AbacusModel, abacus_runner),
+}
+# field types holding uploaded files, read by the runners relative to the directory they start in
+FILE_TYPES = ("InputFilePath", "InputMaterialFilePath")
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name.lower()]
+    except KeyError:
+        raise ValueError(f'unknown backend `{name}`, choose from {", ".join(BACKENDS)}')
+
+
+def load_options(backend, options):
+    model, _ = get_backend(backend)
+    return model.parse_obj(options)
+
+
+def resolve_paths(backend, options, base_dir):
+    """Copy of `options` with relative input file paths made absolute against `base_dir`.
+
+    The runners start in the job's work dir, a spec written next to its inputs names them
+    relative to itself.
+    """
+    model, _ = get_backend(backend)
+    resolved = dict(options)
+    for name, field in model.__fields__.items():
+        value = resolved.get(name)
+        if not value or getattr(field.type_, '__name__', None) not in FILE_TYPES:
+            continue
+        if isinstance(value, (list, tuple)):
+            resolved[name] = [str(Path(base_dir) / ii) for ii in value]
+        else:
+            resolved[name] = str(Path(base_dir) / value)
+    return resolved
@@ -0,0 +1,464 @@
+from pathlib import Path
+from queue import Empty
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from unittest import mock
+
+BASELINE_FILE = Path(__file__).parent / 'benchmark_baseline.json'
+# the 5 GiB runner cases take a few minutes on a laptop
+CASE_TIMEOUT = 1800
+# allowed relative slowdown, and wall times below MIN_WALL (s) are noise
+TOLERANCE = 0.25
+MIN_WALL = 0.05
+
+POSCAR_TEMPLATE = """Al{index}
+4.04
+1.0 0.0 0.0
+0.0 1.0 0.0
+0.0 0.0 1.0
+Al
+4
+Direct
+0.0 0.0 0.0
+0.0 0.5 0.5
+0.5 0.0 0.5
+0.5 0.5 0.0
+"""
+
+# (number of POSCARs, model file size in bytes)
+RUNNER_CASES = [
+    (1, 10 * 2**20),
+    (1000, 10 * 2**20),
+    (20000, 10 * 2**20),
+    (1, 5 * 2**30),
+]
+QUICK_RUNNER_CASES = [
+    (1, 10 * 2**20),
+    (1000, 10 * 2**20),
+]
+
+
+class BenchLabels:
+    def get_value(self):
+        return {}
+
+
+def make_inputs(root, n_confs, model_size):
+    conf_dir = root / 'inputs' / 'confs'
+    conf_dir.mkdir(parents=True)
+    confs = []
+    for ii in range(n_confs):
+        conf = conf_dir / f'POSCAR.{ii}'
+        conf.write_text(POSCAR_TEMPLATE.format(index=ii))
+        confs.append(str(conf))
+    model = root / 'inputs' / 'model.bin'
+    # an unwritten, sparse source file; copies of it are still written in full
+    with open(model, 'wb') as f:
+        f.truncate(model_size)
+    small = root / 'inputs' / 'INPUT'
+    small.write_text('ENCUT = 520\n')
+    return confs, str(model), str(small)
+
+
+def inject_fields():
+    return dict(
+        bohrium_username='bench@example.com',
+        bohrium_ticket='ticket',
+        bohrium_project_id='0',
+        bohrium_job_type='container',
+        bohrium_platform='ali',
+        dflow_labels=BenchLabels(),
+        dflow_argo_api_server='https://argo.invalid',
+        dflow_k8s_api_server='https://k8s.invalid',
+        dflow_access_token='token',
+        dflow_storage_endpoint='storage.invalid',
+        dflow_storage_repository='repo',
+        output_directory='./outputs',
+    )
+
+
+def make_lammps_opts(confs, model, small):
+    from lmp_model import LammpsModel
+    return LammpsModel.construct(
+        configurations=confs, potential_models=[model], parameter_files=None,
+        type_map={'Al': 0}, select_eos=True, select_elastic=True, **inject_fields())
+
+
+def make_vasp_opts(confs, model, small):
+    from vasp_model import VaspModel
+    return VaspModel.construct(
+        configurations=confs, incar=small, potcar=[model], parameter_files=None,
+        potcar_map={'Al': Path(model).name}, select_eos=True, select_elastic=True, **inject_fields())
+
+
+def make_abacus_opts(confs, model, small):
+    from abacus_model import AbacusModel
+    return AbacusModel.construct(
+        configurations=confs, input=small, potentials=[model], orbfiles=[small], deepks=None,
+        parameter_files=None, potential_map={'Al': Path(model).name}, orbfile_map={'Al': 'INPUT'},
+        select_eos=True, select_elastic=True, **inject_fields())
+
+
+RUNNERS = {
+    'lammps': ('lmp_runner', 'lmp_runner', make_lammps_opts),
+    'vasp': ('vasp_runner', 'vasp_runner', make_vasp_opts),
+    'abacus': ('abacus_runner', 'abacus_runner', make_abacus_opts),
+}
+
+
+def run_runner_case(backend, n_confs, model_size, queue):
+    module_name, func_name, make_opts = RUNNERS[backend]
+    sys.path.insert(0, str(Path(__file__).parent))
+    module = __import__(module_name)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        confs, model, small = make_inputs(root, n_confs, model_size)
+        opts = make_opts(confs, model, small)
+        os.chdir(root)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        with mock.patch.object(module, 'submit_workflow') as stub:
+            getattr(module, func_name)(opts)
+        wall = time.perf_counter() - start
+        with open(root / 'outputs' / 'runner_trace.json') as f:
+            trace = json.load(f)
+        queue.put({
+            "wall": wall,
+            # ru_maxrss is in KiB on Linux
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "rss_growth": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024,
+            "bytes_written": sum(ee["args"].get("bytes", 0) for ee in trace["traceEvents"]),
+            "submit_calls": stub.call_count,
+            "phases": {ee["name"]: ee["dur"] / 1e6 for ee in trace["traceEvents"]},
+        })
+
+
+def run_isolated(target, *args, timeout=CASE_TIMEOUT):
+    # a fresh interpreter per case keeps peak RSS attributable to that case
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            pass
+        # a case that crashed never puts its result
+        if not proc.is_alive() and queue.empty():
+            raise RuntimeError(f'{target.__name__}{args}: exited with code {proc.exitcode} without a result')
+        if time.monotonic() > deadline:
+            proc.terminate()
+            proc.join()
+            raise RuntimeError(f'{target.__name__}{args}: no result after {timeout} s')
+    proc.join()
+    return result
+
+
+def bench_runners(args):
+    cases = QUICK_RUNNER_CASES if args.quick else RUNNER_CASES
+    results = {}
+    for backend in args.backends:
+        for n_confs, model_size in cases:
+            name = f'runner/{backend}/confs={n_confs}/model={model_size // 2**20}MiB'
+            results[name] = run_isolated(run_runner_case, backend, n_confs, model_size)
+            print(f'{name}: {format_result(results[name])}', flush=True)
+    return results
+
+
+def write_large_poscar(path, natoms, seed=0):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    with open(path, 'w') as f:
+        f.write(f'Al{natoms}\n1.0\n100 0 0\n0 100 0\n0 0 100\nAl\n{natoms}\nDirect\n')
+        np.savetxt(f, rng.random((natoms, 3)), fmt='%.10f')
+
+
+def time_call(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_poscar(args):
+    from poscar import read_poscar, read_poscars
+    try:
+        from pymatgen.io.vasp import Poscar
+    except ImportError:
+        Poscar = None
+    n_files = 1000 if args.quick else 10000
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        large = root / 'POSCAR.large'
+        write_large_poscar(large, 100000)
+        confs, _, _ = make_inputs(root, n_files, 0)
+
+        cases = {
+            'poscar/large_100k_atoms': {
+                'numpy': lambda: read_poscar(large),
+                'numpy_mmap': lambda: read_poscar(large, use_mmap=True),
+                'pymatgen': Poscar and (lambda: Poscar.from_file(large)),
+            },
+            f'poscar/batch_{n_files}_files': {
+                'numpy': lambda: read_poscars(confs),
+                'pymatgen': Poscar and (lambda: [Poscar.from_file(ii) for ii in confs]),
+            },
+        }
+        for name, funcs in cases.items():
+            results[name] = {k: time_call(v, repeat=1 if k == 'pymatgen' else 3)
+                             for k, v in funcs.items() if v}
+            if 'pymatgen' in results[name]:
+                results[name]['speedup'] = results[name]['pymatgen'] / results[name]['numpy']
+            print(f'{name}: {format_result(results[name])}', flush=True)
+    return results
+
+
+class LocalObjectStore:
+    # stand-in for an S3-like store: every PUT pays a fixed request latency
+    def __init__(self, root, latency=0.005, bandwidth=200 * 2**20):
+        self.root = Path(root)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+
+    def put_file(self, key, path):
+        self.requests += 1
+        size = os.path.getsize(path)
+        time.sleep(self.latency + size / self.bandwidth)
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'rb') as src, open(target, 'wb') as dst:
+            dst.write(src.read())
+
+
+def upload_tree(store, workdir, tmp):
+    for root, _, files in os.walk(workdir):
+        for name in files:
+            path = Path(root) / name
+            store.put_file(path.relative_to(workdir).as_posix(), path)
+
+
+def upload_archive(store, workdir, tmp):
+    from archive import pack_workdir, index_path
+    start = time.perf_counter()
+    archive, _ = pack_workdir(workdir, tmp)
+    pack = time.perf_counter() - start
+    store.put_file(archive.name, archive)
+    store.put_file(index_path(archive).name, index_path(archive))
+    return {"pack": pack}
+
+
+def extract_task(store, tmp):
+    # task side: one configuration and the model out of the uploaded archive
+    from archive import extract_members, archive_suffix
+    archive = store.root / ('workdir' + archive_suffix())
+    start = time.perf_counter()
+    extracted = extract_members(archive, ['returns/conf.000000/*', 'model.bin'], Path(tmp) / 'task')
+    return time.perf_counter() - start, len(extracted)
+
+
+def bench_upload(args):
+    n_confs = 1000 if args.quick else 20000
+    name = f'upload/confs={n_confs}'
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        confs, model, _ = make_inputs(root, n_confs, 10 * 2**20)
+        workdir = root / 'workdir'
+        for ii, conf in enumerate(confs):
+            conf_dir = workdir / 'returns' / ('conf.%06d' % ii)
+            conf_dir.mkdir(parents=True)
+            os.link(conf, conf_dir / 'POSCAR')
+        os.link(model, workdir / 'model.bin')
+
+        # end to end: packing counts against the archive upload
+        for method, func in [('tree', upload_tree), ('archive', upload_archive)]:
+            store = LocalObjectStore(root / f'store_{method}', latency=args.store_latency)
+            start = time.perf_counter()
+            result.update(func(store, workdir, root / f'pack_{method}') or {})
+            result[method] = time.perf_counter() - start
+            result[f'{method}_requests'] = store.requests
+        result['extract'], result['extracted'] = extract_task(store, root)
+        result['speedup'] = result['tree'] / result['archive']
+        print(f'{name}: {format_result(result)}', flush=True)
+    return {name: result}
+
+
+MODELS = {
+    'lammps': ('lmp_model', 'LammpsModel'),
+    'vasp': ('vasp_model', 'VaspModel'),
+    'abacus': ('abacus_model', 'AbacusModel'),
+}
+# fields varied across the generated parameter variants
+VARIANT_FIELDS = {
+    'vol_step': [0.01, 0.02, 0.05, 0.1],
+    'norm_deform': [0.005, 0.01, 0.02],
+    'shear_deform': [0.005, 0.01, 0.02],
+    'max_miller': [1, 2, 3],
+    'gamma_n_steps': [5, 10, 20],
+    'pert_xz': [0.0, 0.01],
+}
+
+
+def make_variants(base, n_variants):
+    import itertools
+    combos = itertools.cycle(itertools.product(*VARIANT_FIELDS.values()))
+    return [dict(base, **dict(zip(VARIANT_FIELDS, next(combos)))) for _ in range(n_variants)]
+
+
+def bench_registry(args):
+    import importlib
+    from property_registry import PROPERTY_ORDER, build_properties, build_relaxation, check_registry
+    n_variants = 1000 if args.quick else 10000
+    results = {}
+    for backend in args.backends:
+        module_name, class_name = MODELS[backend]
+        model = getattr(importlib.import_module(module_name), class_name)
+        check_registry(model, backend)
+        flags = {f'select_{ii}': True for ii in PROPERTY_ORDER}
+        flags.update({f'custom_{ii}_calc': True for ii in PROPERTY_ORDER if ii != 'phonon'})
+        variants = make_variants(model.construct(**flags).dict(), n_variants)
+
+        def build():
+            files = {}
+            return [{"relaxation": build_relaxation(vv, backend),
+                     "properties": build_properties(vv, backend, files)} for vv in variants]
+        built = build()
+        name = f'registry/{backend}/variants={n_variants}'
+        results[name] = {
+            'build': time_call(build),
+            'dump': time_call(lambda: [json.dumps(ii, default=str) for ii in built]),
+        }
+        print(f'{name}: {format_result(results[name])}', flush=True)
+    return results
+
+
+def run_models_case(backend, queue):
+    import importlib
+    sys.path.insert(0, str(Path(__file__).parent))
+    start = time.perf_counter()
+    module_name, class_name = MODELS[backend]
+    model = getattr(importlib.import_module(module_name), class_name)
+    result = {"import": time.perf_counter() - start}
+    from schema_cache import load_schema
+    with tempfile.TemporaryDirectory() as tmp:
+        model.__schema_cache__.clear()
+        start = time.perf_counter()
+        model.schema()
+        result["schema"] = time.perf_counter() - start
+        load_schema(model, tmp)
+        model.__schema_cache__.clear()
+        start = time.perf_counter()
+        load_schema(model, tmp)
+        model.schema()
+        result["schema_cached"] = time.perf_counter() - start
+    values = model.construct(**inject_fields()).dict()
+    result["construct"] = time_call(lambda: model.construct(**values))
+    try:
+        model.parse_obj(values)
+    except Exception as e:
+        # the injected stand-ins are not valid for every launching type
+        print(f'skip validation timing of {class_name}: {type(e).__name__}')
+    else:
+        result["parse"] = time_call(lambda: model.parse_obj(values))
+    queue.put(result)
+
+
+def bench_models(args):
+    results = {}
+    for backend in args.backends:
+        name = f'models/{backend}'
+        results[name] = run_isolated(run_models_case, backend)
+        results[name]["speedup"] = results[name]["schema"] / results[name]["schema_cached"]
+        print(f'{name}: {format_result(results[name])}', flush=True)
+    return results
+
+
+SUITES = {
+    'runners': bench_runners,
+    'poscar': bench_poscar,
+    'upload': bench_upload,
+    'registry': bench_registry,
+    'models': bench_models,
+}
+
+
+# reference timings and ratios are reported but never fail the run
+UNGATED_METRICS = ('pymatgen', 'speedup', 'submit_calls', 'tree', 'tree_requests', 'archive_requests', 'extracted')
+SIZE_METRICS = ('peak_rss', 'rss_growth', 'bytes_written')
+
+
+def format_result(result):
+    return ', '.join(f'{k}={v:.4g}' for k, v in result.items() if isinstance(v, (int, float)))
+
+
+def check_regressions(results, baseline, tolerance, min_wall):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in result.items():
+            old = baseline[name].get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            if metric in UNGATED_METRICS:
+                continue
+            # sub-`min_wall` timings are dominated by noise
+            if metric not in SIZE_METRICS and max(value, old) < min_wall:
+                continue
+            if old > 0 and value > old * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {old:.4g} -> {value:.4g}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='APEX app benchmark suite')
+    parser.add_argument('suites', nargs='*', default=list(SUITES), choices=list(SUITES))
+    parser.add_argument('--backends', nargs='+', default=list(RUNNERS), choices=list(RUNNERS))
+    parser.add_argument('--quick', action='store_true', help='skip the largest cases')
+    parser.add_argument('--store-latency', type=float, default=0.005,
+                        help='per-request latency (s) of the local object-store stand-in')
+    parser.add_argument('--baseline', default=str(BASELINE_FILE))
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed relative slowdown')
+    parser.add_argument('--min-wall', type=float, default=MIN_WALL, help='ignore wall times below this (s)')
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for suite in args.suites:
+        results.update(SUITES[suite](args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline_file = Path(args.baseline)
+    baseline = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+    missing = [ii for ii in results if ii not in baseline]
+    if missing and not args.update_baseline:
+        print(f'no baseline in {baseline_file} for {", ".join(missing)}, run with --update-baseline to record it')
+    if args.update_baseline:
+        baseline.update(results)
+        baseline_file.write_text(json.dumps(baseline, indent=2))
+        print(f'baseline updated: {baseline_file}')
+        return 0
+    regressions = check_regressions(results, baseline, args.tolerance, args.min_wall)
+    for ii in regressions:
+        print(f'REGRESSION {ii}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
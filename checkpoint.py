@@ -0,0 +1,171 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from sharding import read_workflow_log
+
+CHECKPOINT_FILE = 'checkpoint.json'
+PHASES = ("staged", "planned", "submitted")
+# written by APEX, rewritten on every launch or after submission, not part of the planned tree
+VOLATILE_FILES = {CHECKPOINT_FILE, '.workflow.log', 'shards.json', 'global_config_tmp.json',
+                  'task_timings.json', 'comparison.json', 'comparison.txt'}
+CHUNK_SIZE = 1 << 20
+# credentials are injected afresh on every launch and must not invalidate a checkpoint
+VOLATILE_FIELDS = ('dflow_', 'bohrium_ticket', 'bohrium_username', 'output_directory')
+
+
+def _digest(obj):
+    text = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _file_stats(value, stats):
+    if isinstance(value, (list, tuple)):
+        for ii in value:
+            _file_stats(ii, stats)
+    elif isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+        stats[os.fspath(value)] = (os.path.getsize(value), file_digest(value))
+
+
+def input_hash(opts):
+    fields = {k: v for k, v in opts.dict().items() if not k.startswith(VOLATILE_FIELDS)}
+    # uploaded files by size and content, a relaunch downloads them again with fresh mtimes
+    stats = {}
+    _file_stats(list(fields.values()), stats)
+    return _digest([fields, stats])
+
+
+def staged_names(workdir):
+    return sorted(ii.name for ii in Path(workdir).iterdir() if ii.name not in VOLATILE_FILES)
+
+
+def manifest_hash(workdir, names=None):
+    # relative paths and sizes of the files, under the top-level entries `names` if given
+    workdir = Path(workdir)
+    tops = [workdir] if names is None else [workdir / ii for ii in names]
+    entries = []
+    for top in tops:
+        if top.is_file() or top.is_symlink():
+            walk = [(str(top.parent), [], [top.name])]
+        else:
+            walk = os.walk(top)
+        for root, dirs, files in walk:
+            dirs.sort()
+            for name in sorted(files):
+                if name in VOLATILE_FILES:
+                    continue
+                path = Path(root) / name
+                rel = path.relative_to(workdir).as_posix()
+                if path.is_symlink():
+                    entries.append((rel, 'link', os.readlink(path)))
+                else:
+                    entries.append((rel, path.stat().st_size))
+    return _digest(entries)
+
+
+class Checkpoint:
+    def __init__(self, workdir, input_hash, data=None):
+        self.workdir = Path(workdir)
+        self.path = self.workdir / CHECKPOINT_FILE
+        self.data = data or {"input_hash": input_hash, "phases": {}, "groups": []}
+
+    @classmethod
+    def resume(cls, workdir, input_hash):
+        workdir = Path(workdir)
+        data = None
+        if (workdir / CHECKPOINT_FILE).exists():
+            with open(workdir / CHECKPOINT_FILE, 'r') as f:
+                data = json.load(f)
+        if data and data["phases"]:
+            checkpoint = cls(workdir, input_hash, data)
+            last = checkpoint.phase
+            names = data["phases"][last].get("names")
+            if data["input_hash"] == input_hash and data["phases"][last]["manifest"] == manifest_hash(workdir, names):
+                if names is not None:
+                    checkpoint.discard_unstaged(names)
+                print(f'resuming from checkpoint, phase `{last}` already completed')
+                return checkpoint
+            if checkpoint.workflow_ids():
+                raise RuntimeError(
+                    f'{workdir} holds submitted workflows {checkpoint.workflow_ids()} but its inputs '
+                    f'or staged files changed; remove it to start over')
+            print('checkpoint does not match the inputs, restaging')
+        if workdir.exists():
+            shutil.rmtree(workdir)
+        (workdir / 'returns').mkdir(parents=True)
+        return cls(workdir, input_hash)
+
+    @property
+    def phase(self):
+        done = [ii for ii in PHASES if ii in self.data["phases"]]
+        return done[-1] if done else None
+
+    def reached(self, phase):
+        return phase in self.data["phases"]
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def complete(self, phase, **data):
+        self.data.update(data)
+        record = {"time": time.time()}
+        if phase == "staged":
+            # the runner writes its configs and inputs next to the staged tree before planning,
+            # only what was staged decides whether staging can be skipped
+            record["names"] = staged_names(self.workdir)
+        record["manifest"] = manifest_hash(self.workdir, record.get("names"))
+        self.data["phases"][phase] = record
+        self.save()
+
+    def discard_unstaged(self, names):
+        # leftovers of an interrupted planning, planned again from the staged tree
+        for path in self.workdir.iterdir():
+            if path.name in names or path.name in VOLATILE_FILES:
+                continue
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+
+    def plan(self, parameter_dicts, config_dict, submissions):
+        groups = []
+        for submission in submissions:
+            target, _, dirs = submission[:3]
+            group = {"target": target, "work_dirs": list(dirs), "workflow_ids": {}}
+            if len(submission) > 3:
+                # per-group parameters, e.g. one interaction per compared potential
+                group["parameters"] = submission[3]
+            groups.append(group)
+        self.complete("planned", parameters=parameter_dicts, config_hash=_digest(config_dict), groups=groups)
+
+    def config_changed(self, config_dict):
+        return self.data.get("config_hash") != _digest(config_dict)
+
+    def pending(self, work_dirs):
+        # a work dir whose `.workflow.log` names a workflow was accepted by Argo already
+        return [ii for ii in work_dirs if not read_workflow_log(self.workdir / ii)]
+
+    def record(self, group):
+        for ii in group["work_dirs"]:
+            group["workflow_ids"][ii] = read_workflow_log(self.workdir / ii)
+        # whatever APEX left in the work dirs belongs to the checkpointed tree
+        self.data["phases"][self.phase]["manifest"] = manifest_hash(self.workdir)
+        self.save()
+
+    def workflow_ids(self):
+        return [jj for gg in self.data["groups"] for ii in gg["work_dirs"]
+                for jj in read_workflow_log(self.workdir / ii)]
@@ -0,0 +1,84 @@
+from pathlib import Path
+import copy
+import json
+import shutil
+
+from parameters import dump_parameters
+from property_results import collect_metrics, format_table
+from sharding import _link_or_copy
+
+RECORD_FILE = 'comparison.json'
+# written per potential, or not part of the staged inputs
+UNSHARED = {'parameter_tmp.json', 'checkpoint.json', '.workflow.log', RECORD_FILE}
+
+
+def parse_comparisons(specs, potential_models):
+    names = [Path(ii).name for ii in potential_models]
+    comparisons = []
+    for spec in specs:
+        inter_type, _, files = spec.partition(':')
+        files = [ii.strip() for ii in files.split(',') if ii.strip()]
+        if not inter_type.strip() or not files:
+            raise ValueError(f'invalid potential `{spec}`, expect `inter_type:file[,file...]`')
+        missing = [ii for ii in files if ii not in names]
+        if missing:
+            raise ValueError(f'potential `{spec}` uses files not in `potential_models`: {missing}')
+        comparisons.append({"label": spec.strip(), "inter_type": inter_type.strip(), "models": files})
+    return comparisons
+
+
+def _link_entry(src, dst):
+    if src.is_dir() and not src.is_symlink():
+        shutil.copytree(src, dst, symlinks=True, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(src, dst)
+
+
+def stage_comparisons(workdir, parameter_dict, comparisons, model_names, render=None):
+    """One work dir per potential, hard-linked to the configurations staged in `workdir`.
+
+    The links only save local disk, every potential's workflow uploads its own copy.
+
+    `render(inter_type)` gives the custom inputs ({filename: text}) filled for a potential.
+    Returns [(work_dir, parameter_dict)], one per potential.
+    """
+    workdir = Path(workdir)
+    shared = [ii for ii in workdir.iterdir() if ii.name not in UNSHARED and ii.name not in model_names]
+    staged = []
+    record = {"potentials": []}
+    for ii, entry in enumerate(comparisons):
+        pot_dir = workdir / ('pot.%03d' % ii)
+        pot_dir.mkdir()
+        for src in shared:
+            _link_entry(src, pot_dir / src.name)
+        for name in entry["models"]:
+            _link_or_copy(workdir / name, pot_dir / name)
+        for name, text in (render(entry["inter_type"]) if render else {}).items():
+            # a hard link, writing through it would change every potential's input
+            (pot_dir / name).unlink(missing_ok=True)
+            (pot_dir / name).write_text(text)
+        parameters = copy.deepcopy(parameter_dict)
+        parameters["interaction"]["type"] = entry["inter_type"]
+        parameters["interaction"]["model"] = entry["models"][0] if len(entry["models"]) == 1 else entry["models"]
+        parameters = dump_parameters(parameters, pot_dir / 'parameter_tmp.json')
+        staged.append(('./' + pot_dir.name, parameters))
+        record["potentials"].append(dict(entry, work_dir=pot_dir.name))
+    with open(workdir / RECORD_FILE, 'w') as f:
+        json.dump(record, f, indent=2)
+    print(f'comparing {len(comparisons)} potentials on the same configurations')
+    return staged
+
+
+def write_comparison(workdir):
+    workdir = Path(workdir)
+    with open(workdir / RECORD_FILE, 'r') as f:
+        record = json.load(f)
+    columns = {pp["label"]: collect_metrics(workdir / pp["work_dir"]) for pp in record["potentials"]}
+    record["metrics"] = columns
+    with open(workdir / RECORD_FILE, 'w') as f:
+        json.dump(record, f, indent=2)
+    table = format_table(columns)
+    with open(workdir / 'comparison.txt', 'w') as f:
+        f.write(table + '\n')
+    print(table)
+    return columns
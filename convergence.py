@@ -0,0 +1,245 @@
+from pathlib import Path
+import glob
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+from apex.submit import submit_workflow
+
+from parameters import dump_parameters, validate_parameters
+from convergence_model import VaspConvergenceModel, AbacusConvergenceModel
+import vasp_runner
+import abacus_runner
+
+NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+FORCE_ROW = re.compile(rf'^\s*[A-Z][a-z]?\d*\s+({NUMBER})\s+({NUMBER})\s+({NUMBER})\s*$')
+
+
+def _numbers(line):
+    return [float(ii) for ii in re.findall(NUMBER, line)]
+
+
+def parse_outcar(path):
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    natoms = energy = stress = forces = None
+    for ii, line in enumerate(lines):
+        if 'NIONS =' in line:
+            natoms = int(line.split('NIONS =')[1].split()[0])
+        elif 'free  energy   TOTEN' in line:
+            energy = _numbers(line.split('=')[1])[0]
+        elif line.lstrip().startswith('in kB'):
+            stress = _numbers(line)[:6]
+        elif 'TOTAL-FORCE' in line and natoms:
+            rows = lines[ii + 2:ii + 2 + natoms]
+            forces = [_numbers(row)[3:6] for row in rows]
+    return _result(path, natoms, energy, stress, forces)
+
+
+def parse_abacus_log(path):
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    energy = stress = forces = None
+    for ii, line in enumerate(lines):
+        if '!FINAL_ETOT_IS' in line:
+            energy = _numbers(line)[0]
+        elif 'TOTAL-STRESS' in line:
+            rows = [_numbers(row) for row in lines[ii + 1:ii + 8]]
+            rows = [row for row in rows if len(row) == 3]
+            stress = [rows[0][0], rows[1][1], rows[2][2], rows[0][1], rows[1][2], rows[0][2]]
+        elif 'TOTAL-FORCE' in line:
+            forces = []
+            for row in lines[ii + 1:]:
+                match = FORCE_ROW.match(row)
+                if match:
+                    forces.append([float(jj) for jj in match.groups()])
+                elif forces:
+                    break
+    return _result(path, len(forces or []), energy, stress, forces)
+
+
+def _result(path, natoms, energy, stress, forces):
+    if energy is None or not natoms:
+        raise RuntimeError(f'no converged energy found in {path}')
+    return {"natoms": natoms, "energy": energy, "stress": stress, "forces": forces}
+
+
+def compare(result, reference):
+    diff = {"energy": abs(result["energy"] - reference["energy"]) / result["natoms"]}
+    if result["stress"] and reference["stress"]:
+        diff["stress"] = float(np.max(np.abs(np.subtract(result["stress"], reference["stress"]))))
+    if result["forces"] and reference["forces"]:
+        diff["force"] = float(np.max(np.abs(np.subtract(result["forces"], reference["forces"]))))
+    return diff
+
+
+def is_converged(diff, opts):
+    return (diff["energy"] < opts.energy_tol
+            and diff.get("stress", 0.0) < opts.stress_tol
+            and diff.get("force", 0.0) < opts.force_tol)
+
+
+def parse_ladder(text, name):
+    try:
+        ladder = json.loads(text)
+    except json.JSONDecodeError:
+        raise ValueError(f'`{name}` must be a JSON list, got {text!r}')
+    if not isinstance(ladder, list) or len(ladder) < 2:
+        raise ValueError(f'`{name}` needs at least two values, got {text!r}')
+    return ladder
+
+
+def point_property(suffix, cal_setting):
+    # a single static point at the uploaded geometry
+    return {
+        "type": "eos",
+        "skip": False,
+        "vol_start": 1.0,
+        "vol_end": 1.01,
+        "vol_step": 0.02,
+        "vol_abs": False,
+        "cal_type": "static",
+        "suffix": suffix,
+        "cal_setting": cal_setting,
+    }
+
+
+def stage_inputs(stage_dir, conf, model_files):
+    conf_dir = stage_dir / 'returns' / 'conf.000000'
+    relax_dir = conf_dir / 'relaxation' / 'relax_task'
+    relax_dir.mkdir(parents=True)
+    shutil.copy(conf, conf_dir / 'POSCAR')
+    # the property flow starts from the relaxed structure, here the uploaded one
+    shutil.copy(conf, relax_dir / 'CONTCAR')
+    for ii in model_files:
+        shutil.copy(ii, stage_dir)
+
+
+def run_ladder(opts, ctx, name, ladder, make_setting, root):
+    """Submit `ladder` in stages, stop after the first stage where two neighbours agree."""
+    points = []
+    converged = None
+    step = opts.points_per_stage
+    for ii in range(0, len(ladder), step):
+        stage = ladder[ii:ii + step]
+        stage_dir = root / ('%s.stage%02d' % (name, ii // step))
+        stage_inputs(stage_dir, ctx["conf"], ctx["model_files"])
+        suffixes = [ctx["suffix"](name, value) for value in stage]
+        parameters = {
+            "structures": ["returns/conf.*"],
+            "interaction": ctx["interaction"],
+            "properties": [point_property(ss, make_setting(value)) for ss, value in zip(suffixes, stage)],
+        }
+        print(f'{name}: submitting {stage}')
+        cwd = Path.cwd()
+        os.chdir(stage_dir)
+        try:
+            parameters = dump_parameters(validate_parameters(parameters), 'parameter_tmp.json')
+            submit_workflow(
+                parameter_dicts=[parameters],
+                config_dict=ctx["config"],
+                work_dirs=['./'],
+                indicated_flow_type='props',
+                labels=opts.dflow_labels
+            )
+        finally:
+            os.chdir(cwd)
+        for value, suffix in zip(stage, suffixes):
+            task_dir = stage_dir / 'returns' / 'conf.000000' / f'eos_{suffix}' / 'task.000000'
+            points.append({"value": value, "result": ctx["parse"](task_dir)})
+        for prev, point in zip(points, points[1:]):
+            if "diff" not in point:
+                point["diff"] = compare(point["result"], prev["result"])
+                print(f'{name} {prev["value"]} -> {point["value"]}: {point["diff"]}')
+            if converged is None and is_converged(point["diff"], opts):
+                converged = prev["value"]
+        if converged is not None:
+            break
+    if converged is None:
+        converged = ladder[-1]
+        print(f'warning: {name} did not converge within {ladder}, using {converged}')
+    return {"converged": converged, "tested": len(points), "ladder": ladder, "points": points}
+
+
+def write_outputs(opts, root, cal_setting, report):
+    out = Path(opts.output_directory)
+    out.mkdir(parents=True, exist_ok=True)
+    parameters = validate_parameters({"relaxation": {"cal_setting": cal_setting}})
+    dump_parameters(parameters, out / opts.parameter_file_name)
+    with open(out / 'convergence_report.json', 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    shutil.copytree(root, out / root.name, dirs_exist_ok=True)
+    print(f'converged settings {cal_setting} written to {out / opts.parameter_file_name}')
+
+
+def _context(opts, runner, model_files, parse, suffix):
+    cwd = Path.cwd()
+    root = cwd / 'convergence'
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir()
+    os.chdir(root)
+    try:
+        config = runner.get_global_config(opts)
+        interaction = runner.get_interaction(opts)
+    finally:
+        os.chdir(cwd)
+    ctx = {
+        "conf": opts.configurations[opts.representative],
+        "model_files": model_files,
+        "config": config,
+        "interaction": interaction,
+        "parse": parse,
+        "suffix": suffix,
+    }
+    return root, ctx
+
+
+def _vasp_task(task_dir):
+    return parse_outcar(Path(task_dir) / 'OUTCAR')
+
+
+def _abacus_task(task_dir):
+    logs = sorted(glob.glob(str(Path(task_dir) / 'OUT.*' / 'running_*.log')))
+    if not logs:
+        raise RuntimeError(f'no ABACUS log found in {task_dir}')
+    return parse_abacus_log(logs[-1])
+
+
+def vasp_convergence_runner(opts: VaspConvergenceModel):
+    encut_ladder = parse_ladder(opts.encut_ladder, 'encut_ladder')
+    kspacing_ladder = parse_ladder(opts.kspacing_ladder, 'kspacing_ladder')
+    root, ctx = _context(
+        opts, vasp_runner, [opts.incar] + list(opts.potcar), _vasp_task,
+        lambda name, value: f'{name}{value}')
+    # ENCUT at the user's k density (or the finest tested), then KSPACING at the converged ENCUT
+    kspacing = float(opts.kspacing) if opts.kspacing else min(kspacing_ladder)
+    base = {"kgamma": opts.kgamma, "relax_pos": False, "relax_shape": False, "relax_vol": False}
+    report = {"encut": run_ladder(
+        opts, ctx, 'encut', encut_ladder, lambda value: dict(base, encut=value, kspacing=kspacing), root)}
+    encut = report["encut"]["converged"]
+    report["kspacing"] = run_ladder(
+        opts, ctx, 'kspacing', kspacing_ladder, lambda value: dict(base, encut=encut, kspacing=value), root)
+    write_outputs(opts, root, {"encut": encut, "kspacing": report["kspacing"]["converged"]}, report)
+    return report
+
+
+def abacus_convergence_runner(opts: AbacusConvergenceModel):
+    ecutwfc_ladder = parse_ladder(opts.ecutwfc_ladder, 'ecutwfc_ladder')
+    k_points_ladder = parse_ladder(opts.k_points_ladder, 'k_points_ladder')
+    model_files = [opts.input] + list(opts.potentials) + list(opts.orbfiles or []) + list(opts.deepks or [])
+    root, ctx = _context(
+        opts, abacus_runner, model_files, _abacus_task,
+        lambda name, value: f'{name}{"x".join(map(str, value)) if isinstance(value, list) else value}')
+    k_points = list(opts.k_points) if opts.k_points else k_points_ladder[-1]
+    base = dict(opts.specify_relax_input or {})
+    base.update({"relax_pos": False, "relax_shape": False, "relax_vol": False, "cal_force": 1, "cal_stress": 1})
+    report = {"ecutwfc": run_ladder(
+        opts, ctx, 'ecutwfc', ecutwfc_ladder, lambda value: dict(base, ecutwfc=value, K_POINTS=k_points), root)}
+    ecutwfc = report["ecutwfc"]["converged"]
+    report["k_points"] = run_ladder(
+        opts, ctx, 'k_points', k_points_ladder, lambda value: dict(base, ecutwfc=ecutwfc, K_POINTS=value), root)
+    write_outputs(opts, root, {"ecutwfc": ecutwfc, "K_POINTS": report["k_points"]["converged"]}, report)
+    return report
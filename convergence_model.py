@@ -0,0 +1,92 @@
+from dp.launching.typing import BaseModel, Field
+from dp.launching.typing import OutputDirectory
+from dp.launching.typing import Int, Float, String
+import dp.launching.typing.addon.ui as ui
+
+import vasp_model
+import abacus_model
+
+convergence_group = ui.Group('Convergence Test', 'Ladder of settings and convergence criteria')
+
+
+@convergence_group
+class ConvergenceCriteria(BaseModel):
+    representative: Int = Field(
+        default=0,
+        ge=0,
+        description='Index of the uploaded configuration to run the convergence test on'
+    )
+    points_per_stage: Int = Field(
+        default=3,
+        ge=2,
+        description='Ladder points submitted together per stage; the test stops after the first stage that converges'
+    )
+    energy_tol: Float = Field(
+        default=1e-3,
+        gt=0,
+        description='Converged once the energy changes less than this to the next ladder point (eV/atom)'
+    )
+    stress_tol: Float = Field(
+        default=1.0,
+        gt=0,
+        description='Converged once no stress component changes more than this to the next ladder point (kBar)'
+    )
+    force_tol: Float = Field(
+        default=1e-2,
+        gt=0,
+        description='Converged once no force component changes more than this to the next ladder point (eV/Angstrom)'
+    )
+    parameter_file_name: String = Field(
+        default='convergence_parameters.json',
+        description='Name of the parameter file with the converged settings, reusable as `parameter_files`'
+    )
+
+
+@convergence_group
+class VaspLadder(BaseModel):
+    encut_ladder: String = Field(
+        default='[300, 350, 400, 450, 500, 600]',
+        description='JSON list of ENCUT values to test (eV), cheapest first'
+    )
+    kspacing_ladder: String = Field(
+        default='[0.5, 0.4, 0.3, 0.25, 0.2, 0.15]',
+        description='JSON list of KSPACING values to test (1/Angstrom), cheapest first; tested at the converged ENCUT'
+    )
+
+
+@convergence_group
+class AbacusLadder(BaseModel):
+    ecutwfc_ladder: String = Field(
+        default='[50, 60, 80, 100, 120]',
+        description='JSON list of ecutwfc values to test (Ry), cheapest first'
+    )
+    k_points_ladder: String = Field(
+        default='[[2, 2, 2], [4, 4, 4], [6, 6, 6], [8, 8, 8], [10, 10, 10]]',
+        description='JSON list of k-point grids to test, cheapest first; tested at the converged ecutwfc'
+    )
+
+
+class VaspConvergenceModel(
+    vasp_model.InjectConfig,
+    vasp_model.UploadFiles,
+    vasp_model.GlobalConfig,
+    vasp_model.InterOptions,
+    vasp_model.RelaxationParameters,
+    ConvergenceCriteria,
+    VaspLadder,
+    BaseModel
+):
+    output_directory: OutputDirectory = Field(default='./outputs')
+
+
+class AbacusConvergenceModel(
+    abacus_model.InjectConfig,
+    abacus_model.UploadFiles,
+    abacus_model.GlobalConfig,
+    abacus_model.InterOptions,
+    abacus_model.RelaxationParameters,
+    ConvergenceCriteria,
+    AbacusLadder,
+    BaseModel
+):
+    output_directory: OutputDirectory = Field(default='./outputs')
@@ -0,0 +1,83 @@
+from pathlib import Path
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import traceback
+
+from backends import get_backend, load_options, resolve_paths
+
+
+def read_specs(stream, fmt='jsonl'):
+    if fmt == 'yaml':
+        import yaml
+        # documents are yielded as they arrive, separated by `---`
+        for spec in yaml.safe_load_all(stream):
+            if spec is not None:
+                yield spec
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                # a broken line fails its own job, not the stream
+                yield {"invalid": f'{e}: {line.strip()[:80]}'}
+
+
+def run_spec(spec):
+    """Run one job spec: {"backend": ..., "work_dir": ..., "options": {model fields}}."""
+    backend = spec["backend"]
+    _, runner = get_backend(backend)
+    cwd = Path.cwd()
+    # file paths are relative to where headless runs, not to the job's work dir
+    opts = load_options(backend, resolve_paths(backend, spec["options"], cwd))
+    work_dir = Path(spec.get("work_dir", '.'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    os.chdir(work_dir)
+    try:
+        return runner(opts)
+    finally:
+        os.chdir(cwd)
+
+
+def serve(stream, out, fmt='jsonl', keep_going=True):
+    failures = 0
+    for index, spec in enumerate(read_specs(stream, fmt)):
+        start = time.perf_counter()
+        record = {"job": spec.get("name", index), "backend": spec.get("backend")}
+        try:
+            # runner chatter goes to stderr, stdout carries one result line per job
+            if "invalid" in spec:
+                raise ValueError(f'invalid job spec, {spec["invalid"]}')
+            with contextlib.redirect_stdout(sys.stderr):
+                run_spec(spec)
+            record["status"] = "ok"
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            record["status"] = "error"
+            record["error"] = f'{type(e).__name__}: {e}'
+            failures += 1
+        record["elapsed"] = round(time.perf_counter() - start, 4)
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+        if failures and not keep_going:
+            break
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='headless', description='Run APEX job specs read from stdin without the launching UI parser')
+    parser.add_argument('--format', choices=['jsonl', 'yaml'], default='jsonl',
+                        help='one JSON spec per line, or `---` separated YAML documents')
+    parser.add_argument('--fail-fast', action='store_true', help='stop at the first failing job')
+    args = parser.parse_args(argv)
+    failures = serve(sys.stdin, sys.stdout, args.format, keep_going=not args.fail_fast)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
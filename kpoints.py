@@ -0,0 +1,162 @@
+from pathlib import Path
+import copy
+import itertools
+import json
+
+import numpy as np
+
+from poscar import read_poscars
+from sharding import SLAB_PROPERTIES, has_vacuum, stage_subdir
+
+RECORD_FILE = 'kpoint_groups.json'
+# written per group, or not part of the staged inputs
+UNSHARED = {'returns', 'parameter_tmp.json', 'checkpoint.json', '.workflow.log', RECORD_FILE}
+
+# this much empty space along a lattice vector makes it a vacuum direction
+VACUUM_GAP = 6.0
+
+
+def reciprocal_lengths(lattices):
+    """Lengths of the reciprocal vectors (2*pi included) of a stack of lattices, shape (n, 3)."""
+    lattices = np.asarray(lattices, dtype=float).reshape(-1, 3, 3)
+    return 2 * np.pi * np.linalg.norm(np.linalg.inv(lattices), axis=1)
+
+
+def vacuum_axes(structure, gap=VACUUM_GAP):
+    """Lattice directions of `structure` crossed by at least `gap` Angstrom of empty space."""
+    frac = np.sort(np.mod(structure.frac_coords(), 1.0), axis=0)
+    # widest empty interval per axis, the periodic wrap included
+    gaps = np.vstack([np.diff(frac, axis=0), frac[:1] + 1 - frac[-1:]]).max(axis=0)
+    spacing = 2 * np.pi / reciprocal_lengths(structure.lattice)[0]
+    return gaps * spacing >= gap
+
+
+def miller_indices(max_miller):
+    """Primitive Miller indices up to `max_miller`, one of each +/- pair."""
+    indices = []
+    for hkl in itertools.product(range(-max_miller, max_miller + 1), repeat=3):
+        if hkl > (0, 0, 0) and np.gcd.reduce(hkl) == 1:
+            indices.append(hkl)
+    return np.array(indices)
+
+
+def slab_lengths(lattices, max_miller):
+    """Largest in-plane reciprocal length over the slabs up to `max_miller` of each lattice, shape (n,).
+
+    The in-plane cell of a (hkl) slab is spanned by the two shortest independent lattice
+    vectors in the plane. Its area is V |G_hkl| / 2pi, so the reciprocal vector across the
+    longer one has length 2pi |v| / area.
+    """
+    lattices = np.asarray(lattices, dtype=float).reshape(-1, 3, 3)
+    volumes = np.abs(np.linalg.det(lattices))
+    reciprocal = 2 * np.pi * np.linalg.inv(lattices).transpose(0, 2, 1)
+    span = np.arange(-max_miller - 1, max_miller + 2)
+    candidates = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+    candidates = candidates[np.any(candidates, axis=1)]
+    longest = np.zeros(len(lattices))
+    for hkl in miller_indices(max_miller):
+        in_plane = candidates[candidates @ hkl == 0]
+        norms = np.linalg.norm(np.einsum('ni,cij->cnj', in_plane, lattices), axis=-1)
+        first = in_plane[np.argmin(norms, axis=1)]
+        parallel = ~np.any(np.cross(first[:, None, :], in_plane[None, :, :]), axis=-1)
+        second = np.where(parallel, np.inf, norms).min(axis=1)
+        area = volumes * np.linalg.norm(hkl @ reciprocal, axis=-1) / (2 * np.pi)
+        longest = np.maximum(longest, 2 * np.pi * second / area)
+    return longest
+
+
+def derived_cell(prop):
+    """Supercell scale and vacuum axes of the largest cell APEX derives for `prop`, relative to the bulk.
+
+    The in-plane cell of a slab follows its Miller plane instead, see `slab_lengths`.
+    """
+    scale = np.ones(3)
+    vacuum = np.zeros(3, dtype=bool)
+    supercell = prop.get("supercell_size")
+    if supercell:
+        scale[:len(supercell[:3])] = supercell[:3]
+    if has_vacuum(prop):
+        # APEX stacks slabs along the third axis
+        vacuum[2] = True
+    return scale, vacuum
+
+
+def kpoint_grids(structures, props, kspacing):
+    """K-point grids of every configuration in every derived cell, shape (configurations, props, 3).
+
+    A grid has `ceil(|b| / kspacing)` points along each reciprocal vector `b` of the
+    cell, and one point along vacuum of the configuration or of the derived cell.
+    Both in-plane axes of a slab get the grid of the densest Miller plane, as the
+    order of the slab's axes is up to APEX.
+    """
+    lattices = np.stack([ii.lattice for ii in structures])
+    cells = [derived_cell(prop) for prop in props]
+    scales = np.stack([ii[0] for ii in cells])
+    vacuum = np.stack([ii[1] for ii in cells])[None, :, :] | \
+        np.stack([vacuum_axes(ii) for ii in structures])[:, None, :]
+    lengths = reciprocal_lengths(lattices)[:, None, :] / scales[None, :, :]
+    for ii, prop in enumerate(props):
+        if prop.get("type") in SLAB_PROPERTIES:
+            lengths[:, ii, :2] = slab_lengths(lattices, prop.get("max_miller", 2))[:, None]
+    grids = np.maximum(1, np.ceil(lengths / kspacing - 1e-8))
+    grids[vacuum] = 1
+    return grids.astype(int)
+
+
+def irreducible_count(grids):
+    # upper bound with time reversal only, no symmetry analysis
+    return (np.prod(grids, axis=-1) + 1) // 2
+
+
+def group_by_grid(grids):
+    """{grids of every derived cell: [configuration indices]}, configurations sharing all grids together."""
+    groups = {}
+    for ii, conf_grids in enumerate(grids):
+        groups.setdefault(tuple(map(tuple, conf_grids.tolist())), []).append(ii)
+    return groups
+
+
+def assign_kpoints(parameter_dict, grids):
+    """Copy of `parameter_dict` with K_POINTS from `grids`, the relaxation first, then the properties."""
+    parameters = copy.deepcopy(parameter_dict)
+    entries = [parameters.setdefault("relaxation", {})] + parameters.get("properties", [])
+    for entry, grid in zip(entries, grids):
+        # grids given explicitly are kept
+        entry.setdefault("cal_setting", {}).setdefault("K_POINTS", [int(ii) for ii in grid] + [0, 0, 0])
+    return parameters
+
+
+def stage_kpoint_groups(workdir, parameter_dict, kspacing):
+    """Parameters per group of configurations sharing their k-point grids.
+
+    With a single group the configurations stay in `workdir`. Otherwise each group
+    moves to its own `kgrid.NNN` work dir. Returns [(work_dir, parameter_dict)].
+    """
+    workdir = Path(workdir)
+    conf_names = sorted(ii.name for ii in (workdir / 'returns').iterdir())
+    structures = read_poscars([workdir / 'returns' / ii / 'POSCAR' for ii in conf_names])
+    props = [{"type": "relaxation"}] + parameter_dict.get("properties", [])
+    grids = kpoint_grids(structures, props, kspacing)
+    groups = group_by_grid(grids)
+    if len(groups) == 1:
+        return [('./', assign_kpoints(parameter_dict, grids[0]))]
+    shared = [ii for ii in workdir.iterdir() if ii.name not in UNSHARED]
+    staged = []
+    record = {"kspacing": kspacing, "groups": []}
+    for ii, indices in enumerate(groups.values()):
+        names = [conf_names[jj] for jj in indices]
+        group_dir = stage_subdir(workdir, shared, 'kgrid.%03d' % ii, names)
+        parameters = assign_kpoints(parameter_dict, grids[indices[0]])
+        staged.append(('./' + group_dir.name, parameters))
+        entries = [parameters["relaxation"]] + parameters.get("properties", [])
+        record["groups"].append({
+            "work_dir": group_dir.name,
+            "confs": names,
+            "k_points": {pp.get("type") + (f'_{pp["suffix"]}' if pp.get("suffix") else ''):
+                         ee["cal_setting"]["K_POINTS"] for pp, ee in zip(props, entries)},
+        })
+    (workdir / 'returns').rmdir()
+    with open(workdir / RECORD_FILE, 'w') as f:
+        json.dump(record, f, indent=2)
+    print(f'{len(conf_names)} configurations in {len(staged)} k-point grid groups')
+    return staged
@@ -31,6 +31,7 @@ interstitial_group = ui.Group('Interstitial Formation Energy', 'Interstitial For
 vacancy_group = ui.Group('Vacancy Formation Energy', 'Vacancy Formation Energy')
 gamma_group = ui.Group('GSFE Curve (Gamma Line)', 'GSFE Curve (Gamma Line)')
 phonon_group = ui.Group('Phonon Spectra', 'Phonon Spectra')
+sweep_group = ui.Group('Parameter Sweep', 'Evaluate properties over a grid of settings')
 
 
 class InjectConfig(BaseModel):
@@ -57,9 +58,9 @@ class UploadFiles(BaseModel):
     potential_models: List[InputFilePath] = \
         Field(..., description='Interatomic potential files required during test', )
     parameter_files: List[InputFilePath] = \
-        Field(None, ftypes=['json'], max_file_count=2,
-                description='(Optional) Specify parameter `JSON` files for APEX to override the default settings,\
-               (Do not upload if want to do setting manually in the later UI page)',
+        Field(None, ftypes=['json'],
+            description='(Optional) Specify parameter `JSON` files for APEX to override the settings of the later UI page,\
+               (files are merged in upload order, later files take precedence)',
         )
 
 
@@ -80,6 +81,10 @@ class GlobalConfig(BaseModel):
         default="1 * NVIDIA T4_16g", 
         description='Bohrium machine node type for MD simulation'
     )
+    auto_parallel: Boolean = Field(
+        default=False,
+        description='Derive the LAMMPS run command (MPI ranks, OpenMP threads, GPU/KOKKOS flags, DeePMD threads) from `scass_type` and `inter_type` instead of using `lammps_run_command`'
+    )
     group_size: Int = Field(
         default=1,
         ge=1,
@@ -90,6 +95,23 @@ class GlobalConfig(BaseModel):
         ge=1,
         description='For multi tasks per parallel group, the pool size of multiprocessing pool to handle each task (1 for serial, -1 for infinity)'
     )
+    pack_workdir: Boolean = Field(
+        default=False,
+        description='Pack the staged workdir into one compressed archive with an index before submission, and copy out only the files written after it'
+    )
+    max_workflow_nodes: Int = Field(
+        default=5000,
+        ge=0,
+        description='Split configurations into several concurrently submitted workflows once the estimated node count of one workflow exceeds this (0 to disable)'
+    )
+    submission_targets: List[String] = Field(
+        default=None,
+        description='(Optional) Spread workflows over several Bohrium targets, one `project_id:platform:scass_type[:weight]` per entry'
+    )
+    quota_ledger: InputFilePath = Field(
+        default=None,
+        description='(Optional) JSON ledger of remaining quota per Bohrium project to balance `submission_targets` against, the updated ledger is written to `workdir/quota_ledger.json`'
+    )
 
 
 class InterTypeOptions(String, Enum):
@@ -114,6 +136,10 @@ class InterOptions(BaseModel):
         default={'H': 0},
         description="Element type map (Key for element name (H, He ...); value for mapping order: 0, 1, 2 ...)"
     )
+    compare_potentials: List[String] = Field(
+        default=None,
+        description='(Optional) Compare several potentials on the same configurations, one `inter_type:file[,file...]` per potential using files from `potential_models`, e.g. `deepmd:old.pb`, `eam_alloy:Al.eam.alloy`'
+    )
 
 
 @inter_group
@@ -720,6 +746,14 @@ class PhononAdvance(BaseModel):
     )
 
 
+@sweep_group
+class SweepOptions(BaseModel):
+    sweep: Dict[String, String] = Field(
+        default=None,
+        description='(Optional) Property fields to sweep, field name -> JSON list of values, e.g. `vol_step`: `[0.02, 0.05]`; the relaxation runs once and every combination becomes a property variant of the same workflow'
+    )
+
+
 class LammpsModel(
     InjectConfig, 
     UploadFiles, 
@@ -749,6 +783,7 @@ class LammpsModel(
     PhononOptions,
     PhononParameters,
     PhononAdvance,
+    SweepOptions,
     BaseModel
 ):
     output_directory: OutputDirectory = Field(default='./outputs')
@@ -0,0 +1,201 @@
+from pathlib import Path
+import re
+import shlex
+
+from machine import check_node_types, parse_scass_type
+from poscar import read_poscars
+from sharding import estimate_atoms, has_vacuum, staged_confs
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+# pair styles with a GPU package variant, a KOKKOS variant and an OPENMP variant in the run image
+GPU_STYLES = ("eam_fs", "eam_alloy")
+KOKKOS_STYLES = ("snap",)
+OMP_STYLES = ("eam_fs", "eam_alloy", "meam_spline")
+# below this many atoms per rank the halo exchange outweighs the split
+ATOMS_PER_RANK = 200
+# `atom_modify map array` costs memory per atom ID, switch to a hash beyond this
+MAP_ARRAY_LIMIT = 1000000
+# dense or large systems overflow the default neighbor pages
+LARGE_SYSTEM = 100000
+LAMMPS_BINARY = re.compile(r'^(lmp|lammps)')
+MPI_LAUNCHERS = ("mpirun", "mpiexec")
+# flags of a user command that choose the accelerator themselves
+ACCELERATOR_FLAGS = ("-sf", "-suffix", "-pk", "-package", "-k", "-kokkos")
+
+
+def choose_accelerator(inter_type, resources):
+    if resources["gpus"]:
+        if inter_type in GPU_STYLES:
+            return "gpu"
+        if inter_type in KOKKOS_STYLES:
+            return "kokkos"
+    if resources["cores"] > 1 and inter_type in OMP_STYLES:
+        return "omp"
+    # DeePMD runs on the GPU, or threads on the CPU, by itself
+    return None
+
+
+def decompose(inter_type, resources, natoms):
+    """MPI ranks and threads per rank for `natoms` on the node described by `resources`."""
+    cores = resources["cores"]
+    accelerator = choose_accelerator(inter_type, resources)
+    threaded = accelerator == "omp" or inter_type == "deepmd"
+    if accelerator in ("gpu", "kokkos") or (inter_type == "deepmd" and resources["gpus"]):
+        # one rank per GPU, the remaining cores feed it
+        ranks = resources["gpus"]
+    elif threaded:
+        # ranks times threads fill the node, extra cores go to threads of small systems
+        limit = max(1, min(cores, natoms // ATOMS_PER_RANK))
+        ranks = max(ii for ii in range(1, limit + 1) if cores % ii == 0)
+    else:
+        ranks = max(1, min(cores, natoms // ATOMS_PER_RANK))
+    threads = max(1, cores // ranks) if threaded else 1
+    return {
+        "ranks": ranks,
+        "threads": threads,
+        "gpus": resources["gpus"],
+        "accelerator": accelerator,
+    }
+
+
+def package_lines(decomposition):
+    accelerator = decomposition["accelerator"]
+    if accelerator == "gpu":
+        return f'package gpu {decomposition["gpus"]} neigh yes\nsuffix gpu'
+    if accelerator == "kokkos":
+        return 'package kokkos neigh half newton on\nsuffix kk'
+    if accelerator == "omp":
+        # 0 takes the thread count from OMP_NUM_THREADS set by the run command
+        return 'package omp 0\nsuffix omp'
+    return ''
+
+
+def template_values(prop, inter_type, resources, natoms, cell_length, run_atoms=None):
+    atoms = estimate_atoms(prop, natoms, cell_length)
+    # an auto_parallel run command is split for the largest task, the threads must match it
+    decomposition = decompose(inter_type, resources, run_atoms or atoms)
+    return {
+        "package": package_lines(decomposition),
+        "neighbor": 'neigh_modify every 1 delay 0 check yes'
+                    + (' one 5000 page 100000' if atoms > LARGE_SYSTEM else ''),
+        # never split the box across the vacuum of a slab
+        "processors": 'processors * * 1' if has_vacuum(prop) else 'processors * * *',
+        "atom_modify": 'atom_modify map ' + ('array' if atoms <= MAP_ARRAY_LIMIT else 'hash'),
+        "natoms": str(atoms),
+        "threads": str(decomposition["threads"]),
+    }
+
+
+def render(text, values, filename='<input>'):
+    def fill(match):
+        name = match.group(1)
+        if name not in values:
+            raise ValueError(f'{filename}: unknown placeholder `{{{{{name}}}}}`, use one of {", ".join(values)}')
+        return values[name]
+    return PLACEHOLDER.sub(fill, text)
+
+
+def largest_task(parameter_dict, conf_files, size=None):
+    # `size` is the bulk_size of `conf_files` when the caller already has it
+    natoms, cell_length = size or bulk_size(conf_files)
+    props = [{"type": "relaxation"}] + parameter_dict.get("properties", [])
+    return max(estimate_atoms(prop, natoms, cell_length) for prop in props)
+
+
+def _deepmd_thread_vars(dpmd_version):
+    # DeePMD-kit 2.2 renamed the TensorFlow thread variables
+    try:
+        version = tuple(int(ii) for ii in str(dpmd_version).split('.')[:2])
+    except ValueError:
+        version = (2, 2)
+    return ('DP_INTRA_OP_PARALLELISM_THREADS', 'DP_INTER_OP_PARALLELISM_THREADS') if version >= (2, 2) \
+        else ('TF_INTRA_OP_PARALLELISM_THREADS', 'TF_INTER_OP_PARALLELISM_THREADS')
+
+
+def parse_run_command(command):
+    """Split a LAMMPS run command into (setup, launcher, executable, arguments).
+
+    `setup` is everything up to the last `;` or `&&`. `launcher` holds the tokens before
+    the LAMMPS binary, e.g. a `singularity exec` prefix, without `mpirun` and its rank count.
+    `arguments` follow the binary, without `-in`, which APEX fixes to `in.lammps`.
+    """
+    parts = re.split(r'(;|&&)', command)
+    setup = ''.join(parts[:-1]).strip()
+    tokens = shlex.split(parts[-1])
+    binary = next((ii for ii, tok in enumerate(tokens) if LAMMPS_BINARY.match(Path(tok).name)), None)
+    if binary is None:
+        # a wrapper script, the first token that is neither the launcher nor one of its options
+        skip = {ii + 1 for ii, tok in enumerate(tokens) if tok in ('-n', '-np')}
+        binary = next((ii for ii, tok in enumerate(tokens)
+                       if ii not in skip and not tok.startswith('-') and Path(tok).name not in MPI_LAUNCHERS), 0)
+    launcher = tokens[:binary]
+    if launcher and Path(launcher[0]).name in MPI_LAUNCHERS:
+        launcher = launcher[1:]
+        for ii, tok in enumerate(launcher):
+            if tok in ('-n', '-np'):
+                launcher = launcher[:ii] + launcher[ii + 2:]
+                break
+    arguments = []
+    rest = iter(tokens[binary + 1:])
+    for tok in rest:
+        if tok in ('-in', '-i'):
+            next(rest, None)
+        else:
+            arguments.append(tok)
+    return setup, launcher, tokens[binary] if tokens else 'lmp', arguments
+
+
+def run_command(inter_type, resources, natoms, dpmd_version=None, base_command='lmp -in in.lammps'):
+    """LAMMPS run command for the decomposition of `natoms` atoms on the node, and the decomposition.
+
+    The binary, wrapper and arguments of `base_command` are kept. Accelerator flags it
+    already gives win over the derived ones.
+    """
+    decomposition = decompose(inter_type, resources, natoms)
+    ranks, threads, gpus = decomposition["ranks"], decomposition["threads"], decomposition["gpus"]
+    env = [f'OMP_NUM_THREADS={threads}']
+    if inter_type == "deepmd":
+        intra, inter = _deepmd_thread_vars(dpmd_version)
+        env += [f'{intra}={threads}', f'{inter}=1']
+    setup, launcher, executable, arguments = parse_run_command(base_command)
+    tokens = (['mpirun', '-np', str(ranks)] if ranks > 1 else []) + launcher + [executable] + arguments
+    accelerator = decomposition["accelerator"]
+    if any(ii in ACCELERATOR_FLAGS for ii in arguments):
+        decomposition["accelerator"] = "from run command"
+    elif accelerator == "gpu":
+        tokens += ['-sf', 'gpu', '-pk', 'gpu', str(gpus)]
+    elif accelerator == "kokkos":
+        tokens += ['-k', 'on', 'g', str(gpus), '-sf', 'kk']
+    elif accelerator == "omp":
+        tokens += ['-sf', 'omp', '-pk', 'omp', str(threads)]
+    setup = f'{setup} ' if setup else ''
+    return f'{setup}export {" ".join(env)}; {shlex.join(tokens)} -in in.lammps', decomposition
+
+
+def bulk_size(conf_files):
+    # the largest configuration sets the size of every derived task
+    largest = max(read_poscars(list(conf_files)), key=lambda ii: ii.natoms)
+    return largest.natoms, largest.volume ** (1 / 3)
+
+
+def render_inputs(files, properties, opts, relaxation_file=None, inter_type=None):
+    """Fill the placeholders of the custom LAMMPS inputs in `files` ({filename: text}) per property.
+
+    The pair style is `inter_type`, by default the one of `opts`.
+    """
+    if not any(PLACEHOLDER.search(text) for text in files.values()):
+        return files
+    # the inputs are rendered once for every submission
+    check_node_types(opts.scass_type, opts.submission_targets, 'a LAMMPS input with placeholders')
+    resources = parse_scass_type(opts.scass_type)
+    natoms, cell_length = bulk_size(staged_confs())
+    run_atoms = largest_task({"properties": properties}, None, (natoms, cell_length)) if opts.auto_parallel else None
+    by_file = {prop.get("cal_setting", {}).get("input_prop"): prop for prop in properties}
+    if relaxation_file:
+        by_file[relaxation_file] = {"type": "relaxation"}
+    rendered = {}
+    for filename, text in files.items():
+        values = template_values(
+            by_file.get(filename, {}), inter_type or opts.inter_type, resources, natoms, cell_length, run_atoms)
+        rendered[filename] = render(text, values, filename)
+    return rendered
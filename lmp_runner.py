@@ -4,8 +4,22 @@ import shutil
 import json
 from monty.serialization import loadfn
 from apex.submit import submit_workflow
+from tracing import Tracer
+from parameters import layer_parameter_files, dump_parameters
+from sharding import shard_workdir, record_submissions, staged_confs
+from targets import LEDGER_FILE, QuotaLedger, parse_targets, plan_submissions, plan_subdirs, target_config
+from checkpoint import Checkpoint, input_hash
+from archive import pack_workdir, copy_unpacked
+from validation import check_consistency
+from property_registry import build_relaxation, build_properties, write_input_files
+from sweep import sweep_properties
+from comparison import parse_comparisons, stage_comparisons, write_comparison
+from machine import parse_scass_type
+from lmp_resources import render_inputs, largest_task, run_command
 from lmp_model import LammpsModel
 
+RELAX_INPUT = 'custom_relax_in.lammps'
+
 
 def get_global_config(opts: LammpsModel):
     global_config = {
@@ -52,7 +66,7 @@ def get_global_config(opts: LammpsModel):
     return global_config
 
 
-def get_interaction(opts: LammpsModel):
+def get_interaction(opts: LammpsModel, files=None):
 
     interaction = {
         "type": opts.inter_type,
@@ -62,280 +76,182 @@ def get_interaction(opts: LammpsModel):
         "deepmd_version": opts.dpmd_version,
     }
     if opts.relax_in_lmp:
-        with open('custom_relax_in.lammps', 'w') as f:
-            f.write(opts.relax_in_lmp)
-        interaction["in_lammps"] = "custom_relax_in.lammps"
+        if files is None:
+            write_input_files({RELAX_INPUT: opts.relax_in_lmp})
+        else:
+            files[RELAX_INPUT] = opts.relax_in_lmp
+        interaction["in_lammps"] = RELAX_INPUT
     return interaction
 
 
 def get_relaxation(opts: LammpsModel):
-    relaxation = {
-        "cal_setting": {
-            "etol": opts.etol,
-            "ftol": opts.ftol,
-            "maxiter": opts.maxiter,
-            "maxeval": opts.maxeval,
-            "relax_pos": opts.relax_pos,
-            "relax_shape": opts.relax_shape,
-            "relax_vol": opts.relax_vol,
-        }
-    }
-    return relaxation
-
-
-def get_properties(opts: LammpsModel):
-    properties = []
-    if opts.select_eos:
-        eos_params = {
-            "type": "eos",
-            "skip": False,
-            "vol_start": opts.vol_start,
-            "vol_end": opts.vol_end,
-            "vol_step": opts.vol_step,
-            "vol_abs": opts.vol_abs,
-            "cal_type": opts.eos_cal_type
-        }
-        if opts.custom_eos_calc:
-            eos_params["cal_setting"] = {
-                "etol": opts.eos_etol,
-                "ftol": opts.eos_ftol,
-                "maxiter": opts.eos_maxiter,
-                "maxeval": opts.eos_maxeval,
-                "relax_pos": opts.eos_relax_pos,
-                "relax_shape": opts.eos_relax_shape,
-                "relax_vol": opts.eos_relax_vol,
-            }
-            if opts.eos_in_lmp:
-                with open('custom_eos_in.lammps', 'w') as f:
-                    f.write(opts.eos_in_lmp)
-                eos_params["cal_setting"]["input_prop"] = "custom_eos_in.lammps"
-        properties.append(eos_params)
-
-    if opts.select_elastic:
-        elastic_params = {
-            "type": "elastic",
-            "skip": False,
-            "norm_deform": opts.norm_deform,
-            "shear_deform": opts.shear_deform,
-            "cal_type": opts.elastic_cal_type,
-            "conventional": opts.conventional,
-            "ieee": opts.ieee,
-            "modulus_type": opts.modulus_type
-        }
-        if opts.custom_elastic_calc:
-            elastic_params["cal_setting"] = {
-                "etol": opts.elastic_etol,
-                "ftol": opts.elastic_ftol,
-                "maxiter": opts.elastic_maxiter,
-                "maxeval": opts.elastic_maxeval,
-                "relax_pos": opts.elastic_relax_pos,
-                "relax_shape": opts.elastic_relax_shape,
-                "relax_vol": opts.elastic_relax_vol,
-            }
-            if opts.elastic_in_lmp:
-                with open('custom_elastic_in.lammps', 'w') as f:
-                    f.write(opts.elastic_in_lmp)
-                elastic_params["cal_setting"]["input_prop"] = "custom_elastic_in.lammps"
-        properties.append(elastic_params)
-    
-    if opts.select_surface:
-        surface_params = {
-            "type": "surface",
-            "skip": False,
-            "max_miller": opts.max_miller,
-            "min_slab_size": opts.min_slab_size,
-            "min_vacuum_size": opts.min_vacuum_size,
-            "pert_xz": opts.pert_xz,
-            "cal_type": opts.surface_cal_type
-        }
-        if opts.custom_surface_calc:
-            surface_params["cal_setting"] = {
-                "etol": opts.surface_etol,
-                "ftol": opts.surface_ftol,
-                "maxiter": opts.surface_maxiter,
-                "maxeval": opts.surface_maxeval,
-                "relax_pos": opts.surface_relax_pos,
-                "relax_shape": opts.surface_relax_shape,
-                "relax_vol": opts.surface_relax_vol,
-            }
-            if opts.surface_in_lmp:
-                with open('custom_surface_in.lammps', 'w') as f:
-                    f.write(opts.surface_in_lmp)
-                surface_params["cal_setting"]["input_prop"] = "custom_surface_in.lammps"
-        properties.append(surface_params)
+    return build_relaxation(opts, 'lammps')
 
-    if opts.select_interstitial:
-        interstitial_params = {
-            "type": "interstitial",
-            "skip": False,
-            "supercell_size": opts.interstitial_supercell_size,
-            "insert_ele": opts.insert_ele,
-            "cal_type": opts.interstitial_cal_type
-        }
-        if opts.custom_interstitial_calc:
-            interstitial_params["cal_setting"] = {
-                "etol": opts.interstitial_etol,
-                "ftol": opts.interstitial_ftol,
-                "maxiter": opts.interstitial_maxiter,
-                "maxeval": opts.interstitial_maxeval,
-                "relax_pos": opts.interstitial_relax_pos,
-                "relax_shape": opts.interstitial_relax_shape,
-                "relax_vol": opts.interstitial_relax_vol,
-            }
-            if opts.interstitial_in_lmp:
-                with open('custom_interstitial_in.lammps', 'w') as f:
-                    f.write(opts.interstitial_in_lmp)
-                interstitial_params["cal_setting"]["input_prop"] = "custom_interstitial_in.lammps"
-        properties.append(interstitial_params)
 
-    if opts.select_vacancy:
-        vacancy_params = {
-            "type": "vacancy",
-            "skip": False,
-            "supercell_size": opts.vacancy_supercell_size,
-            "cal_type": opts.vacancy_cal_type
-        }
-        if opts.custom_vacancy_calc:
-            vacancy_params["cal_setting"] = {
-                "etol": opts.vacancy_etol,
-                "ftol": opts.vacancy_ftol,
-                "maxiter": opts.vacancy_maxiter,
-                "maxeval": opts.vacancy_maxeval,
-                "relax_pos": opts.vacancy_relax_pos,
-                "relax_shape": opts.vacancy_relax_shape,
-                "relax_vol": opts.vacancy_relax_vol,
-            }
-            if opts.vacancy_in_lmp:
-                with open('custom_vacancy_in.lammps', 'w') as f:
-                    f.write(opts.vacancy_in_lmp)
-                vacancy_params["cal_setting"]["input_prop"] = "custom_vacancy_in.lammps"
-        properties.append(vacancy_params)
-        
-    if opts.select_gamma:
-        gamma_params = {
-            "type": "gamma",
-            "skip": False,
-            "plane_miller": opts.plane_miller,
-            "slip_direction": opts.slip_direction,
-            "slip_length": opts.slip_length,
-            "plane_shift": opts.plane_shift,
-            "n_steps": opts.gamma_n_steps,
-            "supercell_size": opts.gamma_supercell_size,
-            "vacuum_size": opts.gamma_vacuum_size,
-            "cal_type": opts.gamma_cal_type,
-            "add_fix": [
-                "true" if opts.add_fix_x else "false", 
-                "true" if opts.add_fix_y else "false", 
-                "true" if opts.add_fix_z else "false"
-                ]
-        }
-        if opts.custom_gamma_calc:
-            gamma_params["cal_setting"] = {
-                "etol": opts.gamma_etol,
-                "ftol": opts.gamma_ftol,
-                "maxiter": opts.gamma_maxiter,
-                "maxeval": opts.gamma_maxeval,
-                "relax_pos": opts.gamma_relax_pos,
-                "relax_shape": opts.gamma_relax_shape,
-                "relax_vol": opts.gamma_relax_vol,
-            }
-            if opts.gamma_in_lmp:
-                with open('custom_gamma_in.lammps', 'w') as f:
-                    f.write(opts.gamma_in_lmp)
-                gamma_params["cal_setting"]["input_prop"] = "custom_gamma_in.lammps"
-        properties.append(gamma_params)
-        
-    if opts.select_phonon:
-        phonon_params = {
-            "type": "phonon",
-            "skip": False,
-            "primitive_cell": opts.primitive_cell,
-            "supercell_size": opts.phonon_supercell_size,
-            "seekpath_from_original": opts.seekpath_from_original,
-            "BAND": opts.band,
-            "BAND_LABELS": opts.band_labels,
-            "MESH": opts.mesh,
-            "PRIMITIVE_AXES": opts.primitive_axes,
-            "BAND_POINTS": opts.band_points,
-            "BAND_CONNECTION": opts.band_connection,
-            "cal_setting": {}
-        }
-        if opts.phonon_in_lmp:
-            with open('custom_phonon_in.lammps', 'w') as f:
-                f.write(opts.phonon_in_lmp)
-            phonon_params["cal_setting"]["input_prop"] = "custom_phonon_in.lammps"
-        properties.append(phonon_params)
+def get_properties(opts: LammpsModel, files=None):
+    if opts.sweep:
+        return sweep_properties(opts, 'lammps', opts.sweep, files)
+    return build_properties(opts, 'lammps', files)
 
-    return properties
 
-
-def get_parameter_dict(opts: LammpsModel):
+def get_parameter_dict(opts: LammpsModel, templates=None):
+    # custom inputs are collected first, their placeholders depend on the property,
+    # and are kept unfilled in `templates` when given
+    files = {} if templates is None else templates
     parameter_dict = {
         "structures":  ["returns/conf.*"],
-        "interaction": get_interaction(opts),
+        "interaction": get_interaction(opts, files),
         "relaxation": get_relaxation(opts)
     }
-    if get_properties(opts):
-        parameter_dict["properties"] = get_properties(opts)
-        
+    properties = get_properties(opts, files)
+    write_input_files(render_inputs(files, properties, opts, RELAX_INPUT))
+    if properties:
+        parameter_dict["properties"] = properties
     return parameter_dict
 
 
+def get_run_config(opts: LammpsModel, config_dict, parameter_dict, work_dirs):
+    # with auto_parallel the run command follows the node of this submission and its pair style
+    if not opts.auto_parallel:
+        return config_dict, None
+    scass_type = config_dict["machine"]["remote_profile"]["input_data"]["scass_type"]
+    natoms = largest_task(parameter_dict, staged_confs(work_dirs))
+    command, decomposition = run_command(
+        parameter_dict["interaction"]["type"], parse_scass_type(scass_type), natoms, opts.dpmd_version,
+        opts.lammps_run_command)
+    decomposition.update(scass_type=scass_type, natoms=natoms, run_command=command)
+    return dict(config_dict, run_command=command), decomposition
+
+
 def lmp_runner(opts: LammpsModel):
     cwd = Path.cwd()
     parameter_dicts = []
     print('start running....')
+    tracer = Tracer('lmp_runner')
+    trace_file = cwd / opts.output_directory / 'runner_trace.json'
+
+    # fail fast on inconsistent inputs before anything is staged or submitted
+    with tracer.span('consistency_check', files=len(opts.configurations)):
+        check_consistency(opts, 'lammps')
+
     workdir = cwd / 'workdir'
     returns_dir = workdir / 'returns'
-    if os.path.exists(workdir):
-        shutil.rmtree(workdir)
-    workdir.mkdir()
-    returns_dir.mkdir()
+    # a retry picks up after the last completed phase instead of restaging
+    checkpoint = Checkpoint.resume(workdir, input_hash(opts))
+    count = len(opts.configurations)
+
+    try:
+        if not checkpoint.reached('staged'):
+            # papare input POSCAR
+            with tracer.span('input_staging') as span:
+                count = 0
+                for ii in opts.configurations:
+                    conf_dir = returns_dir / ("conf.%06d" % count)
+                    conf_dir.mkdir()
+                    span.copy(ii, conf_dir/'POSCAR')
+                    count += 1
+
+            # papare potential files
+            with tracer.span('model_staging') as span:
+                for ii in opts.potential_models:
+                    span.copy(ii, workdir)
+
+            checkpoint.complete('staged')
 
-    # papare input POSCAR
-    count = 0
-    for ii in opts.configurations:
         os.chdir(workdir)
-        conf_dir = returns_dir / ("conf.%06d" % count)
-        conf_dir.mkdir()
-        os.chdir(cwd)
-        shutil.copy(ii, conf_dir/'POSCAR')
-        count += 1
+        # papare global config
+        with tracer.span('config_build'):
+            config_dict = get_global_config(opts)
+
+        if not checkpoint.reached('planned'):
+            # papare parameter files, uploaded files are layered over the UI settings
+            templates = {}
+            with tracer.span('property_build'):
+                parameter_dict = get_parameter_dict(opts, templates)
+            with tracer.span('parameter_files') as span:
+                parameter_files = [cwd / ii for ii in opts.parameter_files or []]
+                parameter_dict = layer_parameter_files(parameter_dict, parameter_files)
+                parameter_dicts.append(dump_parameters(parameter_dict, 'parameter_tmp.json'))
+                span.set(layers=len(parameter_files))
+                span.count('parameter_tmp.json')
 
-    # papare potential files
-    for ii in opts.potential_models:
-        shutil.copy(ii, workdir)
+            # split oversized studies into concurrently submitted workflows,
+            # spread over the submission targets if there are several
+            targets = parse_targets(opts.submission_targets)
+            ledger = QuotaLedger(cwd / opts.quota_ledger if opts.quota_ledger else None, workdir / LEDGER_FILE)
+            if opts.compare_potentials:
+                # one work dir and interaction per compared potential, each uploads its own configurations
+                with tracer.span('comparison_staging') as span:
+                    comparisons = parse_comparisons(opts.compare_potentials, opts.potential_models)
+                    properties = parameter_dicts[0].get("properties", [])
+                    groups = stage_comparisons(
+                        workdir, parameter_dicts[0], comparisons, [Path(ii).name for ii in opts.potential_models],
+                        lambda inter_type: render_inputs(templates, properties, opts, RELAX_INPUT, inter_type))
+                    span.set(potentials=len(groups))
+                with tracer.span('sharding') as span:
+                    submissions, shards, nodes = plan_subdirs(
+                        workdir, groups, config_dict, targets, ledger, opts.max_workflow_nodes, opts.group_size)
+                    span.set(shards=shards, estimated_nodes=nodes, targets=len(submissions))
+            else:
+                with tracer.span('sharding') as span:
+                    work_dirs, nodes = shard_workdir(
+                        workdir, parameter_dicts[0], count, opts.max_workflow_nodes, opts.group_size,
+                        min_shards=len(targets))
+                    submissions = plan_submissions(workdir, work_dirs, config_dict, targets, ledger)
+                    span.set(shards=len(work_dirs), estimated_nodes=nodes, targets=len(submissions))
+            checkpoint.plan(parameter_dicts, config_dict, submissions)
+        else:
+            parameter_dicts = checkpoint.data["parameters"]
+            if checkpoint.config_changed(config_dict):
+                print('global config changed since the checkpoint, pending workflows use the new one')
 
-    os.chdir(workdir)
-    # papare global config
-    config_dict = get_global_config(opts)
-    
-    # papare parameter files
-    if opts.parameter_files:
-        for ii in opts.parameter_files:
-            os.chdir(cwd)
-            with open(ii, 'r') as f:
-                j = json.load(f)
-                j["structures"] = ["returns/conf.*"]
-            with open(ii, 'w') as r:
-                json.dump(j, r, indent=2)
-            shutil.copy(ii, workdir)
-            parameter_dicts.append(loadfn(ii))
-            os.chdir(workdir)
-    else:
-        parsed_parameter_dict = get_parameter_dict(opts)
-        json.dump(parsed_parameter_dict, open('parameter_tmp.json', 'w'), indent=2)
-        parsed_parameter_dict = loadfn('parameter_tmp.json')
-        parameter_dicts.append(parsed_parameter_dict)
-    
-    # submit APEX workflow
-    submit_workflow(
-        parameter_dicts=parameter_dicts,
-        config_dict=config_dict,
-        work_dirs=['./'],
-        indicated_flow_type=None,
-        labels=opts.dflow_labels
-    )
+        if opts.pack_workdir:
+            # the staged and planned tree, packed before APEX adds its records to the work dirs
+            with tracer.span('pack_workdir') as span:
+                archive, index = pack_workdir(workdir, cwd / opts.output_directory)
+                span.set(files=len(index["members"]), bytes=index["archive_bytes"], raw_bytes=index["raw_bytes"])
+                print(f'staged workdir packed into {archive}')
 
-    os.chdir(cwd)
-    shutil.copytree(workdir, Path(opts.output_directory)/'workdir', dirs_exist_ok = True)
\ No newline at end of file
+        # submit APEX workflow, work dirs Argo already accepted are never resubmitted
+        with tracer.span('submit_workflow') as span:
+            submitted = 0
+            for group in checkpoint.data["groups"]:
+                pending = checkpoint.pending(group["work_dirs"])
+                if pending:
+                    group_parameters = group.get("parameters", parameter_dicts)
+                    config, decomposition = get_run_config(
+                        opts, target_config(config_dict, group["target"]), group_parameters[0], pending)
+                    if decomposition:
+                        group["decomposition"] = decomposition
+                        print(f'{", ".join(pending)}: {decomposition["ranks"]} ranks x '
+                              f'{decomposition["threads"]} threads on {decomposition["scass_type"]} '
+                              f'for ~{decomposition["natoms"]} atoms, `{decomposition["run_command"]}`')
+                    submit_workflow(
+                        parameter_dicts=group_parameters,
+                        config_dict=config,
+                        work_dirs=pending,
+                        indicated_flow_type=None,
+                        labels=opts.dflow_labels
+                    )
+                    submitted += len(pending)
+                checkpoint.record(group)
+            record_submissions(workdir, [ii for gg in checkpoint.data["groups"] for ii in gg["work_dirs"]])
+            checkpoint.complete('submitted')
+            span.set(workflows=submitted)
+
+        if opts.compare_potentials:
+            with tracer.span('comparison_table'):
+                write_comparison(workdir)
+
+        os.chdir(cwd)
+        with tracer.span('copy_out') as span:
+            if opts.pack_workdir:
+                copied = copy_unpacked(workdir, Path(opts.output_directory)/'workdir', index, copy_function=span.copy)
+                span.set(files=len(copied))
+            else:
+                shutil.copytree(workdir, Path(opts.output_directory)/'workdir',
+                                copy_function=span.copy, dirs_exist_ok=True)
+    finally:
+        os.chdir(cwd)
+        tracer.dump(trace_file)
+        print(f'phase timings (ms): {tracer.summary()}')
@@ -0,0 +1,46 @@
+import re
+
+from targets import parse_targets
+
+MPI_RANKS = re.compile(r'\b(mpirun|mpiexec)(\s+)(-n|-np)\s+\d+')
+# Bohrium GPU node types such as "1 * NVIDIA T4_16g" do not spell out the CPU count
+CORES_PER_GPU = 8
+
+
+def parse_scass_type(scass_type):
+    scass_type = str(scass_type or '')
+    cpu = re.search(r'c(\d+)_m(\d+)', scass_type)
+    gpu = re.search(r'(\d+)\s*\*\s*NVIDIA\s*([^\s_]+)', scass_type)
+    gpus = int(gpu.group(1)) if gpu else 0
+    if cpu:
+        cores = int(cpu.group(1))
+    else:
+        cores = CORES_PER_GPU * gpus if gpus else 1
+    return {
+        "cores": cores,
+        "memory_gb": int(cpu.group(2)) if cpu else None,
+        "gpus": gpus,
+        "gpu_type": gpu.group(2) if gpu else None,
+    }
+
+
+def node_cores(scass_type, submission_targets=None):
+    # the smallest node among the submission targets, so every target can run the command
+    scass_types = [scass_type] + [ii["scass_type"] for ii in parse_targets(submission_targets)]
+    return min(parse_scass_type(ii)["cores"] for ii in scass_types)
+
+
+def check_node_types(scass_type, submission_targets, what):
+    # inputs sized for one node break on a target with other cores or GPUs
+    scass_types = [scass_type] + [ii["scass_type"] for ii in parse_targets(submission_targets)]
+    kinds = {(rr["cores"], rr["gpus"]) for rr in map(parse_scass_type, scass_types)}
+    if len(kinds) > 1:
+        raise ValueError(f'{what} is sized for one node type, but `scass_type` and `submission_targets` '
+                         f'mix {", ".join(dict.fromkeys(scass_types))}')
+
+
+def set_mpi_ranks(command, ranks):
+    if not MPI_RANKS.search(command):
+        print(f'warning: no `mpirun -n` in `{command}`, rank count left to the command')
+        return command
+    return MPI_RANKS.sub(lambda m: f'{m.group(1)}{m.group(2)}{m.group(3)} {ranks}', command)
@@ -1,3 +1,5 @@
+import sys
+
 from dp.launching.cli import (
     SubParser,
     run_sp_and_exit,
@@ -9,6 +11,19 @@ from vasp_model import VaspModel
 from vasp_runner import vasp_runner
 from abacus_model import AbacusModel
 from abacus_runner import abacus_runner
+from monitor_model import MonitorModel
+from convergence_model import VaspConvergenceModel, AbacusConvergenceModel
+from convergence import vasp_convergence_runner, abacus_convergence_runner
+import submit_queue
+import headless
+import regression
+from schema_cache import warm_models, prune_cache
+
+
+def monitor_runner(opts: MonitorModel):
+    # aiohttp is only needed to monitor
+    from monitor import monitor_runner as run
+    return run(opts)
 
 
 def to_parser():
@@ -16,6 +31,11 @@ def to_parser():
         "1-LAMMPS": SubParser(LammpsModel, lmp_runner, "Submit MD workflow using LAMMPS"),
         "2-VASP": SubParser(VaspModel, vasp_runner, "Submit DFT workflow using VASP"),
         "3-ABACUS": SubParser(AbacusModel, abacus_runner, "Submit DFT workflow using ABACUS"),
+        "4-Monitor": SubParser(MonitorModel, monitor_runner, "Monitor submitted APEX workflows"),
+        "5-Convergence-VASP": SubParser(
+            VaspConvergenceModel, vasp_convergence_runner, "Converge VASP ENCUT and KSPACING"),
+        "6-Convergence-ABACUS": SubParser(
+            AbacusConvergenceModel, abacus_convergence_runner, "Converge ABACUS ecutwfc and k-points"),
     }
 
 def error_handler(exc):
@@ -23,6 +43,19 @@ def error_handler(exc):
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "queue":
+        # local submission queue: enqueue / status / cancel / serve
+        sys.exit(submit_queue.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "headless":
+        # stream of JSON/YAML job specs on stdin, runners called directly
+        sys.exit(headless.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "regression":
+        # exits non-zero when a potential regresses on the reference set
+        sys.exit(regression.main(sys.argv[2:]))
+    # form schemas come from disk unless a model source changed
+    models = [LammpsModel, VaspModel, AbacusModel, MonitorModel, VaspConvergenceModel, AbacusConvergenceModel]
+    warm_models(models)
+    prune_cache(models)
     # excute APEX app main flow
     run_sp_and_exit(
         to_parser(),
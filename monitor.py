@@ -0,0 +1,236 @@
+from pathlib import Path
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+from monitor_model import MonitorModel
+from sharding import RECORD_FILE, aggregate_status
+
+TERMINAL_PHASES = ("Succeeded", "Failed", "Error", "NotFound")
+# only ask the Argo server for what the monitor shows, not the whole node tree
+STATUS_FIELDS = ",".join([
+    "metadata.name",
+    "metadata.resourceVersion",
+    "status.phase",
+    "status.progress",
+    "status.startedAt",
+    "status.finishedAt",
+    "status.message",
+])
+
+
+def read_workflow_ids(log_files):
+    workflow_ids = []
+    for ii in log_files:
+        with open(ii, 'r') as f:
+            if Path(ii).name == RECORD_FILE:
+                # parent record of a sharded submission
+                ids = [jj for shard in json.load(f)["shards"] for jj in shard["workflow_ids"]]
+            else:
+                ids = [line.split()[0] for line in f if line.strip()]
+        workflow_ids += [jj for jj in ids if jj not in workflow_ids]
+    return workflow_ids
+
+
+def update_records(log_files, summary, output_directory):
+    phases = {ww["id"]: ww["phase"] for ww in summary["workflows"]}
+    for ii in log_files:
+        if Path(ii).name != RECORD_FILE:
+            continue
+        with open(ii, 'r') as f:
+            record = json.load(f)
+        for shard in record["shards"]:
+            shard["status"] = aggregate_status(phases.get(jj, "Unknown") for jj in shard["workflow_ids"])
+        record["status"] = aggregate_status(ss["status"] for ss in record["shards"])
+        with open(Path(output_directory)/RECORD_FILE, 'w') as f:
+            json.dump(record, f, indent=2)
+
+
+def new_state(workflow_id):
+    return {
+        "id": workflow_id,
+        "phase": "Unknown",
+        "progress": None,
+        "started_at": None,
+        "finished_at": None,
+        "message": None,
+        "etag": None,
+        "resource_version": None,
+        "polls": 0,
+        "errors": 0,
+    }
+
+
+class EventStream:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, 'w')
+        self.changed = asyncio.Event()
+
+    def emit(self, event, state, **extra):
+        record = {
+            "time": time.time(),
+            "event": event,
+            "id": state["id"],
+            "phase": state["phase"],
+            "progress": state["progress"],
+        }
+        record.update(extra)
+        self._f.write(json.dumps(record) + '\n')
+        self._f.flush()
+        self.changed.set()
+
+    def close(self):
+        self._f.close()
+
+
+def update_state(state, data):
+    metadata = data.get("metadata", {})
+    status = data.get("status", {})
+    state["resource_version"] = metadata.get("resourceVersion")
+    state["phase"] = status.get("phase") or "Pending"
+    state["progress"] = status.get("progress")
+    state["started_at"] = status.get("startedAt")
+    state["finished_at"] = status.get("finishedAt")
+    state["message"] = status.get("message")
+
+
+async def watch_workflow(session, url, state, events, poll_interval, max_poll_interval):
+    delay = poll_interval
+    while state["phase"] not in TERMINAL_PHASES:
+        headers = {"If-None-Match": state["etag"]} if state["etag"] else {}
+        changed = False
+        try:
+            async with session.get(url, headers=headers, params={"fields": STATUS_FIELDS}) as resp:
+                state["polls"] += 1
+                if resp.status == 304:
+                    pass
+                elif resp.status == 404:
+                    state["phase"] = "NotFound"
+                    changed = True
+                elif resp.status == 429 or resp.status >= 500:
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status)
+                elif resp.status >= 400:
+                    # a bad token or request fails the same way on every retry
+                    state["phase"] = "Error"
+                    state["message"] = f'HTTP {resp.status} {resp.reason}'
+                    state["errors"] += 1
+                    events.emit("error", state, error=state["message"])
+                    changed = True
+                else:
+                    resp.raise_for_status()
+                    data = await resp.json()
+                    state["etag"] = resp.headers.get("ETag")
+                    version = data.get("metadata", {}).get("resourceVersion")
+                    # fall back to resourceVersion when the server sends no ETag
+                    if version is None or version != state["resource_version"]:
+                        old_phase = state["phase"]
+                        update_state(state, data)
+                        changed = True
+                        if old_phase != state["phase"]:
+                            events.emit("phase", state, previous=old_phase)
+                        else:
+                            events.emit("progress", state)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            state["errors"] += 1
+            events.emit("error", state, error=str(e) or type(e).__name__)
+            delay = min(delay * 2, max_poll_interval)
+        else:
+            if changed:
+                delay = poll_interval
+            else:
+                delay = min(delay * 1.5, max_poll_interval)
+        if state["phase"] in TERMINAL_PHASES:
+            break
+        # jitter keeps many workflows from polling in lock-step
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+
+def format_table(states):
+    rows = [("WORKFLOW", "PHASE", "PROGRESS", "POLLS", "ERRORS")]
+    for ss in states:
+        rows.append((ss["id"], ss["phase"], ss["progress"] or "-", str(ss["polls"]), str(ss["errors"])))
+    widths = [max(len(row[ii]) for row in rows) for ii in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+async def report_status(states, events, min_interval=2.0):
+    while True:
+        await events.changed.wait()
+        events.changed.clear()
+        print(format_table(states), flush=True)
+        if all(ss["phase"] in TERMINAL_PHASES for ss in states):
+            return
+        await asyncio.sleep(min_interval)
+
+
+def summarize(states, start_time):
+    phases = {}
+    for ss in states:
+        phases.setdefault(ss["phase"], []).append(ss["id"])
+    return {
+        "total": len(states),
+        "phases": {k: len(v) for k, v in phases.items()},
+        "failed": phases.get("Failed", []) + phases.get("Error", []) + phases.get("NotFound", []),
+        "polls": sum(ss["polls"] for ss in states),
+        "errors": sum(ss["errors"] for ss in states),
+        "elapsed": time.time() - start_time,
+        "workflows": [{k: ss[k] for k in ("id", "phase", "progress", "started_at", "finished_at", "message")}
+                      for ss in states],
+    }
+
+
+async def monitor_workflows(host, token, workflow_ids, output_directory, namespace="argo",
+                            poll_interval=5, max_poll_interval=120, max_connections=16):
+    start_time = time.time()
+    states = [new_state(ii) for ii in workflow_ids]
+    events = EventStream(Path(output_directory) / 'monitor_events.jsonl')
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    connector = aiohttp.TCPConnector(limit=max_connections, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=60)
+    try:
+        async with aiohttp.ClientSession(connector=connector, headers=headers, timeout=timeout) as session:
+            reporter = asyncio.create_task(report_status(states, events))
+            await asyncio.gather(*[
+                watch_workflow(
+                    session,
+                    f"{host.rstrip('/')}/api/v1/workflows/{namespace}/{ss['id']}",
+                    ss, events, poll_interval, max_poll_interval
+                ) for ss in states
+            ])
+            events.changed.set()
+            await reporter
+    finally:
+        events.close()
+    return summarize(states, start_time)
+
+
+def monitor_runner(opts: MonitorModel):
+    workflow_ids = list(opts.workflow_ids or [])
+    if opts.workflow_logs:
+        workflow_ids += [ii for ii in read_workflow_ids(opts.workflow_logs) if ii not in workflow_ids]
+    if not workflow_ids:
+        raise RuntimeError('No workflow to monitor, specify `workflow_ids` or `workflow_logs`')
+    print(f'monitoring {len(workflow_ids)} workflows....')
+
+    summary = asyncio.run(monitor_workflows(
+        host=opts.dflow_argo_api_server,
+        token=opts.dflow_access_token,
+        workflow_ids=workflow_ids,
+        output_directory=opts.output_directory,
+        namespace=opts.namespace,
+        poll_interval=opts.poll_interval,
+        max_poll_interval=opts.max_poll_interval,
+        max_connections=opts.max_connections,
+    ))
+    with open(Path(opts.output_directory)/'monitor_summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    if opts.workflow_logs:
+        update_records(opts.workflow_logs, summary, opts.output_directory)
+    print(json.dumps({k: summary[k] for k in ("total", "phases", "failed", "elapsed")}, indent=2))
+    return summary
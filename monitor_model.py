@@ -0,0 +1,52 @@
+from dp.launching.typing import BaseModel, Field
+from dp.launching.typing import InputFilePath, OutputDirectory
+from dp.launching.typing import Int, Float, List, String
+from dp.launching.typing import DflowArgoAPIServer, DflowAccessToken
+
+
+class InjectConfig(BaseModel):
+    # dflow config
+    dflow_argo_api_server: DflowArgoAPIServer
+    dflow_access_token: DflowAccessToken
+
+
+class MonitorTargets(BaseModel):
+    workflow_ids: List[String] = Field(
+        default=None,
+        description='IDs of the submitted workflows to monitor'
+    )
+    workflow_logs: List[InputFilePath] = Field(
+        default=None,
+        description='(Optional) `.workflow.log` or `shards.json` files from previous submissions to collect workflow IDs from'
+    )
+
+
+class MonitorOptions(BaseModel):
+    namespace: String = Field(
+        default="argo",
+        description='Argo namespace of the workflows'
+    )
+    poll_interval: Float = Field(
+        default=5,
+        gt=0,
+        description='Initial polling interval per workflow in seconds'
+    )
+    max_poll_interval: Float = Field(
+        default=120,
+        gt=0,
+        description='Upper bound of the adaptive polling interval in seconds'
+    )
+    max_connections: Int = Field(
+        default=16,
+        ge=1,
+        description='Maximum number of concurrent HTTP connections to the Argo server'
+    )
+
+
+class MonitorModel(
+    InjectConfig,
+    MonitorTargets,
+    MonitorOptions,
+    BaseModel
+):
+    output_directory: OutputDirectory = Field(default='./outputs')
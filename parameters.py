@@ -0,0 +1,182 @@
+from functools import lru_cache
+import copy
+import json
+import os
+
+PROPERTY_TYPES = ("eos", "elastic", "surface", "interstitial", "vacancy", "gamma", "phonon")
+
+CAL_SETTING_SCHEMA = {"type": "object"}
+
+PARAMETER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "structures": {"type": "array", "items": {"type": "string"}},
+        "interaction": {
+            "type": "object",
+            "required": ["type"],
+            "properties": {
+                "type": {"type": "string"},
+                "type_map": {"type": "object"},
+                "potcars": {"type": "object"},
+                "orb_files": {"type": "object"},
+            },
+        },
+        "relaxation": {
+            "type": "object",
+            "properties": {
+                "cal_type": {"type": "string"},
+                "cal_setting": CAL_SETTING_SCHEMA,
+            },
+        },
+        "properties": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["type"],
+                "properties": {
+                    "type": {"enum": list(PROPERTY_TYPES)},
+                    "skip": {"type": "boolean"},
+                    "suffix": {"type": "string"},
+                    "cal_type": {"type": "string"},
+                    "cal_setting": CAL_SETTING_SCHEMA,
+                },
+            },
+        },
+    },
+}
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "number": (int, float),
+    "integer": int,
+}
+
+
+class ParameterError(ValueError):
+    def __init__(self, path, problems):
+        self.problems = problems
+        super().__init__(f'invalid parameter file {path}:\n  ' + '\n  '.join(problems))
+
+
+def _compile(schema):
+    checks = []
+    if "type" in schema:
+        expected = JSON_TYPES[schema["type"]]
+
+        def check_type(value, where, problems):
+            if not isinstance(value, expected) or (schema["type"] != "boolean" and isinstance(value, bool)):
+                problems.append(f'{where}: expected {schema["type"]}, got {type(value).__name__}')
+                return False
+            return True
+        checks.append(check_type)
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(value, where, problems):
+            if value not in allowed:
+                problems.append(f'{where}: {value!r} is not one of {allowed}')
+                return False
+            return True
+        checks.append(check_enum)
+    if "required" in schema:
+        required = schema["required"]
+
+        def check_required(value, where, problems):
+            for key in required:
+                if key not in value:
+                    problems.append(f'{where}: missing `{key}`')
+            return True
+        checks.append(check_required)
+    if "properties" in schema:
+        children = {k: _compile(v) for k, v in schema["properties"].items()}
+
+        def check_properties(value, where, problems):
+            for key, child in children.items():
+                if key in value:
+                    child(value[key], f'{where}.{key}', problems)
+            return True
+        checks.append(check_properties)
+    if "items" in schema:
+        item = _compile(schema["items"])
+
+        def check_items(value, where, problems):
+            for ii, vv in enumerate(value):
+                item(vv, f'{where}[{ii}]', problems)
+            return True
+        checks.append(check_items)
+
+    def validate(value, where, problems):
+        for check in checks:
+            # later checks assume the earlier ones (type first) passed
+            if not check(value, where, problems):
+                return
+    return validate
+
+
+@lru_cache(maxsize=None)
+def parameter_validator():
+    return _compile(PARAMETER_SCHEMA)
+
+
+def validate_parameters(parameters, path='<parameters>'):
+    problems = []
+    parameter_validator()(parameters, '$', problems)
+    if problems:
+        raise ParameterError(path, problems)
+    return parameters
+
+
+@lru_cache(maxsize=32)
+def _load(path, mtime_ns, size):
+    with open(path, 'r') as f:
+        return validate_parameters(json.load(f), path)
+
+
+def load_parameter_file(path):
+    # every caller within one run shares a single read and validation
+    st = os.stat(path)
+    return copy.deepcopy(_load(os.fspath(path), st.st_mtime_ns, st.st_size))
+
+
+def _property_key(prop):
+    return prop.get("type"), prop.get("suffix")
+
+
+def merge_parameters(base, override):
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if key == "properties" and isinstance(merged.get(key), list):
+            index = {_property_key(pp): ii for ii, pp in enumerate(merged[key])}
+            for prop in value:
+                if _property_key(prop) in index:
+                    ii = index[_property_key(prop)]
+                    merged[key][ii] = merge_parameters(merged[key][ii], prop)
+                else:
+                    merged[key].append(copy.deepcopy(prop))
+        elif key == "interaction" and value.get("type") != merged.get(key, {}).get("type"):
+            # settings of a different interaction type do not carry over
+            merged[key] = copy.deepcopy(value)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_parameters(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def layer_parameter_files(defaults, parameter_files, structures=("returns/conf.*",)):
+    merged = copy.deepcopy(defaults)
+    for ii in parameter_files or []:
+        merged = merge_parameters(merged, load_parameter_file(ii))
+    merged["structures"] = list(structures)
+    return validate_parameters(merged)
+
+
+def dump_parameters(parameters, path):
+    # one write; the JSON round trip turns enum members etc. into plain values
+    text = json.dumps(parameters, indent=2)
+    with open(path, 'w') as f:
+        f.write(text)
+    return json.loads(text)
@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+import mmap
+import re
+import warnings
+
+import numpy as np
+
+
+def _clean_symbol(symbol):
+    # POTCAR-style labels such as `Fe_pv` or `Fe/1a2b` in the species line
+    return re.split(r'[_/.]', symbol)[0]
+
+
+def _parse_species(header, path):
+    symbols = header[5].split()
+    if symbols and symbols[0][0].isdigit():
+        # VASP 4 format: no species line, counts directly after the lattice
+        counts = symbols
+        symbols = header[0].split()
+        has_species_line = False
+    else:
+        counts = header[6].split()
+        has_species_line = True
+    if not symbols or not counts or len(symbols) < len(counts):
+        raise ValueError(f'{path}: cannot read species from POSCAR header')
+    species = tuple(_clean_symbol(ii) for ii in symbols[:len(counts)])
+    return species, [int(ii) for ii in counts], has_species_line
+
+
+def read_species(path):
+    with open(path, 'r') as f:
+        header = [f.readline() for _ in range(7)]
+    return _parse_species(header, path)[0]
+
+
+class Structure:
+    __slots__ = ("title", "lattice", "species", "counts", "coords", "direct", "selective")
+
+    def __init__(self, title, lattice, species, counts, coords, direct=True, selective=None):
+        self.title = title
+        self.lattice = lattice
+        self.species = species
+        self.counts = counts
+        self.coords = coords
+        self.direct = direct
+        self.selective = selective
+
+    @property
+    def natoms(self):
+        return int(self.counts.sum())
+
+    @property
+    def symbols(self):
+        return np.repeat(np.array(self.species), self.counts)
+
+    @property
+    def volume(self):
+        return abs(float(np.linalg.det(self.lattice)))
+
+    def frac_coords(self):
+        if self.direct:
+            return self.coords
+        return np.linalg.solve(self.lattice.T, self.coords.T).T
+
+    def cart_coords(self):
+        if self.direct:
+            return self.coords @ self.lattice
+        return self.coords
+
+    def reciprocal_lattice(self):
+        # rows are reciprocal vectors, including the 2*pi factor
+        return 2 * np.pi * np.linalg.inv(self.lattice).T
+
+    def __repr__(self):
+        formula = ''.join(f'{s}{c}' for s, c in zip(self.species, self.counts))
+        return f'Structure({formula}, volume={self.volume:.3f})'
+
+
+def _next_lines(buf, pos, n):
+    lines = []
+    for _ in range(n):
+        end = buf.find(b'\n', pos)
+        if end < 0:
+            end = len(buf)
+        lines.append(buf[pos:end].decode())
+        pos = end + 1
+    return lines, pos
+
+
+def _parse_coords(block, natoms, path):
+    with warnings.catch_warnings():
+        # numpy only warns when trailing non-numeric tokens stop the parse
+        warnings.simplefilter('error')
+        try:
+            coords = np.fromstring(b' '.join(block), dtype=np.float64, sep=' ')
+        except (ValueError, DeprecationWarning):
+            coords = None
+    if coords is not None and coords.size == 3 * natoms:
+        return coords.reshape(natoms, 3), None
+    # selective dynamics flags and/or per-atom labels after the coordinates
+    tokens = [line.split() for line in block]
+    coords = np.array([ii[:3] for ii in tokens], dtype=np.float64)
+    selective = None
+    if all(len(ii) >= 6 for ii in tokens):
+        flags = np.array([ii[3:6] for ii in tokens])
+        if np.isin(flags, [b'T', b'F']).all():
+            selective = flags == b'T'
+    if coords.shape != (natoms, 3):
+        raise ValueError(f'{path}: expected {natoms} coordinate lines')
+    return coords, selective
+
+
+def parse_poscar(buf, path='<buffer>'):
+    header, pos = _next_lines(buf, 0, 7)
+    title = header[0].strip()
+    scale = float(header[1].split()[0])
+    lattice = np.array([ii.split()[:3] for ii in header[2:5]], dtype=np.float64)
+    species, counts, has_species_line = _parse_species(header, path)
+    if not has_species_line:
+        # the 7th header line already belongs to the coordinate section
+        pos = len(('\n'.join(header[:6]) + '\n').encode())
+    counts = np.array(counts, dtype=np.int64)
+    natoms = int(counts.sum())
+
+    mode, pos = _next_lines(buf, pos, 1)
+    selective_dynamics = mode[0].strip()[:1] in ('S', 's')
+    if selective_dynamics:
+        mode, pos = _next_lines(buf, pos, 1)
+    direct = mode[0].strip()[:1] not in ('C', 'c', 'K', 'k')
+
+    block = buf[pos:].split(b'\n', natoms)[:natoms]
+    coords, selective = _parse_coords(block, natoms, path)
+
+    if scale < 0:
+        # negative scale is the target cell volume
+        scale = (-scale / abs(np.linalg.det(lattice))) ** (1 / 3)
+    lattice *= scale
+    if not direct:
+        coords *= scale
+    return Structure(title, lattice, species, counts, coords, direct, selective)
+
+
+def read_poscar(path, use_mmap=False):
+    with open(path, 'rb') as f:
+        if use_mmap:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parse_poscar(buf, path)
+        return parse_poscar(f.read(), path)
+
+
+def read_poscars(paths, workers=8, use_mmap=False):
+    # file open/read latency dominates on network filesystems
+    if workers <= 1 or len(paths) < 2 * workers:
+        return [read_poscar(ii, use_mmap) for ii in paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda ii: read_poscar(ii, use_mmap), paths))
@@ -0,0 +1,219 @@
+from collections.abc import Mapping
+from functools import lru_cache
+
+BACKENDS = ("lammps", "vasp", "abacus")
+PROPERTY_ORDER = ("eos", "elastic", "surface", "interstitial", "vacancy", "gamma", "phonon")
+
+
+def _flags(*values):
+    return ["true" if ii else "false" for ii in values]
+
+
+# APEX parameter key <- model field (or fields and a transform), shared by every backend
+PROPERTY_FIELDS = {
+    "eos": [
+        ("vol_start", "vol_start"),
+        ("vol_end", "vol_end"),
+        ("vol_step", "vol_step"),
+        ("vol_abs", "vol_abs"),
+    ],
+    "elastic": [
+        ("norm_deform", "norm_deform"),
+        ("shear_deform", "shear_deform"),
+        ("conventional", "conventional"),
+        ("ieee", "ieee"),
+        ("modulus_type", "modulus_type"),
+    ],
+    "surface": [
+        ("max_miller", "max_miller"),
+        ("min_slab_size", "min_slab_size"),
+        ("min_vacuum_size", "min_vacuum_size"),
+        ("pert_xz", "pert_xz"),
+    ],
+    "interstitial": [
+        ("supercell_size", "interstitial_supercell_size"),
+        ("insert_ele", "insert_ele"),
+    ],
+    "vacancy": [
+        ("supercell_size", "vacancy_supercell_size"),
+    ],
+    "gamma": [
+        ("plane_miller", "plane_miller"),
+        ("slip_direction", "slip_direction"),
+        ("slip_length", "slip_length"),
+        ("plane_shift", "plane_shift"),
+        ("n_steps", "gamma_n_steps"),
+        ("supercell_size", "gamma_supercell_size"),
+        ("vacuum_size", "gamma_vacuum_size"),
+        ("add_fix", ("add_fix_x", "add_fix_y", "add_fix_z"), _flags),
+    ],
+    "phonon": [
+        ("primitive_cell", "primitive_cell"),
+        ("supercell_size", "phonon_supercell_size"),
+        ("seekpath_from_original", "seekpath_from_original"),
+        ("BAND", "band"),
+        ("BAND_LABELS", "band_labels"),
+        ("MESH", "mesh"),
+        ("PRIMITIVE_AXES", "primitive_axes"),
+        ("BAND_POINTS", "band_points"),
+        ("BAND_CONNECTION", "band_connection"),
+    ],
+}
+
+BACKEND_PROPERTY_FIELDS = {
+    "vasp": {"phonon": [("approach", "approach")]},
+}
+
+# phonon runs with the calculator defaults plus an optional input file
+NO_CUSTOM_CALC = ("phonon",)
+
+ALWAYS, IF_SET, MERGE = "always", "if_set", "merge"
+
+# cal_setting key <- field template, `{p}` is `eos_` etc. and empty for the relaxation,
+# `{name}` is `eos` etc. and `relax` for the relaxation
+CAL_SETTINGS = {
+    "lammps": [
+        ("etol", "{p}etol", ALWAYS),
+        ("ftol", "{p}ftol", ALWAYS),
+        ("maxiter", "{p}maxiter", ALWAYS),
+        ("maxeval", "{p}maxeval", ALWAYS),
+        ("relax_pos", "{p}relax_pos", ALWAYS),
+        ("relax_shape", "{p}relax_shape", ALWAYS),
+        ("relax_vol", "{p}relax_vol", ALWAYS),
+    ],
+    "vasp": [
+        ("kgamma", "{p}kgamma", ALWAYS),
+        ("relax_pos", "{p}relax_pos", ALWAYS),
+        ("relax_shape", "{p}relax_shape", ALWAYS),
+        ("relax_vol", "{p}relax_vol", ALWAYS),
+        ("ediff", "{p}ediff", IF_SET),
+        ("ediffg", "{p}ediffg", IF_SET),
+        ("encut", "{p}encut", IF_SET),
+        ("kspacing", "{p}kspacing", IF_SET),
+    ],
+    "abacus": [
+        ("relax_pos", "{p}relax_pos", ALWAYS),
+        ("relax_shape", "{p}relax_shape", ALWAYS),
+        ("relax_vol", "{p}relax_vol", ALWAYS),
+        ("K_POINTS", "{p}k_points", IF_SET),
+        (None, "specify_{name}_input", MERGE),
+    ],
+}
+
+# model field holding the text of a custom input file, and the file it is written to
+INPUT_FILES = {
+    "lammps": ("{name}_in_lmp", "custom_{name}_in.lammps"),
+    "vasp": ("{name}_incar", "INCAR.{name}"),
+    "abacus": ("{name}_input", "INPUT.{name}"),
+}
+
+
+def _cal_entries(backend, prefix, name):
+    return tuple((key, field.format(p=prefix, name=name), mode) for key, field, mode in CAL_SETTINGS[backend])
+
+
+@lru_cache(maxsize=None)
+def compile_registry(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown backend `{backend}`, choose from {", ".join(BACKENDS)}')
+    specs = []
+    input_field, input_file = INPUT_FILES[backend]
+    for name in PROPERTY_ORDER:
+        fields = PROPERTY_FIELDS[name] + BACKEND_PROPERTY_FIELDS.get(backend, {}).get(name, [])
+        custom = name not in NO_CUSTOM_CALC
+        specs.append({
+            "type": name,
+            "select": f'select_{name}',
+            "fields": tuple((ff[0], ff[1], ff[2] if len(ff) > 2 else None) for ff in fields),
+            "cal_type": f'{name}_cal_type' if custom else None,
+            "custom": f'custom_{name}_calc' if custom else None,
+            "cal_setting": _cal_entries(backend, f'{name}_', name) if custom else (),
+            "input": (input_field.format(name=name), input_file.format(name=name)),
+        })
+    return tuple(specs)
+
+
+def registry_fields(backend):
+    # every model field the registry reads, for checking it against the models
+    fields = set(ff for _, ff, _ in _cal_entries(backend, '', 'relax'))
+    for spec in compile_registry(backend):
+        fields.add(spec["select"])
+        for _, field, _ in spec["fields"]:
+            fields.update(field if isinstance(field, tuple) else [field])
+        fields.update(ii for ii in (spec["cal_type"], spec["custom"], spec["input"][0]) if ii)
+        fields.update(ff for _, ff, _ in spec["cal_setting"])
+    return fields
+
+
+def check_registry(model, backend):
+    missing = sorted(registry_fields(backend) - set(model.__fields__))
+    if missing:
+        raise ValueError(f'{model.__name__} lacks fields read by the {backend} property registry: {missing}')
+
+
+def _getter(opts):
+    if isinstance(opts, Mapping):
+        return opts.__getitem__
+    return lambda field: getattr(opts, field)
+
+
+def _cal_setting(get, entries):
+    cal_setting = {}
+    for key, field, mode in entries:
+        value = get(field)
+        if mode == ALWAYS:
+            cal_setting[key] = value
+        elif mode == IF_SET:
+            if value:
+                cal_setting[key] = value
+        elif value:
+            cal_setting.update(value)
+    return cal_setting
+
+
+def _input_file(get, spec, cal_setting, files):
+    field, filename = spec["input"]
+    text = get(field)
+    if text:
+        files[filename] = text
+        cal_setting["input_prop"] = filename
+
+
+def write_input_files(files):
+    for filename, text in files.items():
+        with open(filename, 'w') as f:
+            f.write(text)
+
+
+def build_relaxation(opts, backend):
+    get = _getter(opts)
+    return {"cal_setting": _cal_setting(get, _cal_entries(backend, '', 'relax'))}
+
+
+def build_properties(opts, backend, files=None):
+    """Build the APEX property list of `opts`, a model instance or a dict of its fields.
+
+    Custom input files go into `files` ({filename: text}) when given, otherwise
+    they are written to the current directory.
+    """
+    get = _getter(opts)
+    collected = {} if files is None else files
+    properties = []
+    for spec in compile_registry(backend):
+        if not get(spec["select"]):
+            continue
+        params = {"type": spec["type"], "skip": False}
+        for key, field, transform in spec["fields"]:
+            params[key] = transform(*map(get, field)) if transform else get(field)
+        if spec["custom"] is None:
+            params["cal_setting"] = {}
+            _input_file(get, spec, params["cal_setting"], collected)
+        else:
+            params["cal_type"] = get(spec["cal_type"])
+            if get(spec["custom"]):
+                params["cal_setting"] = _cal_setting(get, spec["cal_setting"])
+                _input_file(get, spec, params["cal_setting"], collected)
+        properties.append(params)
+    if files is None:
+        write_input_files(collected)
+    return properties
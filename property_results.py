@@ -0,0 +1,93 @@
+from pathlib import Path
+import json
+
+import numpy as np
+
+# eV/Angstrom^3 -> GPa
+EV_A3_TO_GPA = 160.21766
+ELASTIC_KEYS = ("C11", "C12", "C13", "C22", "C23", "C33", "C44", "C55", "C66")
+
+
+def _load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def eos_metrics(result):
+    # {volume per atom: energy per atom}
+    vols = np.array([float(ii) for ii in result], dtype=float)
+    energies = np.array([float(ii) for ii in result.values()], dtype=float)
+    order = np.argsort(vols)
+    vols, energies = vols[order], energies[order]
+    metrics = {"E0": float(energies.min()), "V0": float(vols[energies.argmin()])}
+    if len(vols) >= 4:
+        fit = np.polynomial.Polynomial.fit(vols, energies, 3).convert()
+        roots = [rr.real for rr in fit.deriv().roots() if abs(rr.imag) < 1e-12 and vols[0] <= rr.real <= vols[-1]]
+        if roots:
+            v0 = min(roots, key=fit)
+            metrics.update(E0=float(fit(v0)), V0=float(v0), B0=float(v0 * fit.deriv(2)(v0) * EV_A3_TO_GPA))
+    return metrics
+
+
+def elastic_metrics(result):
+    metrics = {}
+    tensor = result.get("elastic_tensor")
+    if tensor is not None:
+        tensor = np.asarray(tensor, dtype=float).reshape(6, 6)
+        for key in ELASTIC_KEYS:
+            metrics[key] = float(tensor[int(key[1]) - 1, int(key[2]) - 1])
+    for key in ("BV", "GV", "EV", "uV"):
+        if key in result:
+            metrics[key] = float(result[key])
+    return metrics
+
+
+def first_values(result):
+    # surface, vacancy and interstitial results map a task name to [formation energy, ...]
+    return {str(key): float(value[0]) for key, value in result.items() if isinstance(value, list) and value}
+
+
+def gamma_metrics(result):
+    energies = [float(value[0]) for value in result.values() if isinstance(value, list) and value]
+    return {"max_fault_energy": max(energies)} if energies else {}
+
+
+EXTRACTORS = {
+    "eos": eos_metrics,
+    "elastic": elastic_metrics,
+    "surface": first_values,
+    "vacancy": first_values,
+    "interstitial": first_values,
+    "gamma": gamma_metrics,
+}
+
+
+def collect_metrics(work_dir):
+    """Scalar property metrics of an APEX work dir, {"conf.000000/eos_00/B0": value}."""
+    metrics = {}
+    # a sharded work dir keeps its configurations in the shards
+    result_files = [ii for pattern in ('returns', 'shard.*/returns')
+                    for ii in Path(work_dir).glob(pattern + '/conf.*/*/result.json')]
+    for result_file in sorted(result_files, key=lambda ii: ii.parts[-3:]):
+        prop_dir = result_file.parent
+        extractor = EXTRACTORS.get(prop_dir.name.split('_')[0])
+        if extractor is None:
+            continue
+        try:
+            values = extractor(_load(result_file))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f'warning: cannot read {result_file}: {e}')
+            continue
+        for key, value in values.items():
+            metrics[f'{prop_dir.parent.name}/{prop_dir.name}/{key}'] = value
+    return metrics
+
+
+def format_table(columns):
+    """Side-by-side table of {column name: metrics}."""
+    keys = sorted(set(kk for metrics in columns.values() for kk in metrics))
+    rows = [["METRIC"] + list(columns)]
+    for key in keys:
+        rows.append([key] + ['%.6g' % columns[name][key] if key in columns[name] else '-' for name in columns])
+    widths = [max(len(row[ii]) for row in rows) for ii in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
@@ -0,0 +1,255 @@
+from fnmatch import fnmatch
+from pathlib import Path
+import argparse
+import copy
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+from parameters import dump_parameters, validate_parameters
+from property_results import collect_metrics
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'APEX_REGRESSION_CACHE', str(Path.home() / '.cache' / 'apex_bohr_app' / 'regression'))
+# applied when the reference set gives no tolerances, relative unless `abs` is set
+DEFAULT_TOLERANCES = {
+    "eos/B0": {"rel": 0.05},
+    "eos/V0": {"rel": 0.01},
+    "elastic/C*": {"rel": 0.05},
+    "elastic/BV": {"rel": 0.05},
+    "surface/*": {"abs": 0.05},
+    "vacancy/*": {"abs": 0.05},
+    "interstitial/*": {"abs": 0.1},
+}
+
+
+def _sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_reference(path):
+    """Pinned reference set: structures, APEX relaxation/properties and tolerances."""
+    path = Path(path)
+    with open(path, 'r') as f:
+        reference = json.load(f)
+    for key in ("structures", "type_map", "parameters"):
+        if key not in reference:
+            raise ValueError(f'reference set {path} lacks `{key}`')
+    reference["structures"] = [str(path.parent / ii) for ii in reference["structures"]]
+    validate_parameters(reference["parameters"], path)
+    return reference
+
+
+def reference_key(reference):
+    sha = hashlib.sha256()
+    for ii in reference["structures"]:
+        sha.update(_sha256(ii).encode())
+    core = {k: reference.get(k) for k in ("type_map", "inter_type", "interaction", "parameters")}
+    sha.update(json.dumps(core, sort_keys=True).encode())
+    return sha.hexdigest()[:16]
+
+
+def setup_key(reference, backend, config):
+    # results of one model differ between pair styles, backends, binaries and images
+    setup = {
+        "backend": backend,
+        "inter_type": reference.get("inter_type", "deepmd"),
+        "run_command": config.get("run_command"),
+        "run_image_name": config.get("run_image_name"),
+    }
+    return hashlib.sha256(json.dumps(setup, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def build_parameters(reference, model_names):
+    parameters = copy.deepcopy(reference["parameters"])
+    parameters["structures"] = ["returns/conf.*"]
+    interaction = {
+        "type": reference.get("inter_type", "deepmd"),
+        "model": model_names[0] if len(model_names) == 1 else model_names,
+        "type_map": reference["type_map"],
+    }
+    interaction.update(reference.get("interaction", {}))
+    parameters["interaction"] = interaction
+    return parameters
+
+
+def stage_reference(reference, models, workdir):
+    workdir = Path(workdir)
+    if workdir.exists():
+        shutil.rmtree(workdir)
+    for ii, conf in enumerate(reference["structures"]):
+        conf_dir = workdir / 'returns' / ('conf.%06d' % ii)
+        conf_dir.mkdir(parents=True)
+        shutil.copy(conf, conf_dir / 'POSCAR')
+    for ii in models:
+        shutil.copy(ii, workdir)
+    return dump_parameters(build_parameters(reference, [Path(ii).name for ii in models]),
+                           workdir / 'parameter_tmp.json')
+
+
+def local_config(run_command):
+    # dflow debug mode runs every step on this machine, no Bohrium or Argo involved
+    return {
+        "run_command": run_command,
+        "group_size": 1,
+        "pool_size": 1,
+        "is_bohrium_dflow": False,
+    }
+
+
+def submit(parameters, config, workdir, backend, labels=None):
+    from apex.submit import submit_workflow
+    cwd = Path.cwd()
+    os.chdir(workdir)
+    try:
+        submit_workflow(
+            parameter_dicts=[parameters],
+            config_dict=config,
+            work_dirs=['./'],
+            indicated_flow_type=None,
+            is_debug=backend == 'local',
+            labels=labels
+        )
+    finally:
+        os.chdir(cwd)
+
+
+def run_reference(reference, models, backend, config, work_root, cache_dir=DEFAULT_CACHE_DIR, labels=None):
+    """Metrics of `models` on the reference set, from the cache when this model was run before."""
+    key = '-'.join([_sha256(ii)[:16] for ii in models]
+                   + [reference_key(reference), setup_key(reference, backend, config)])
+    cache_file = Path(cache_dir) / f'{key}.json'
+    if cache_file.exists():
+        with open(cache_file, 'r') as f:
+            print(f'using cached results of {", ".join(Path(ii).name for ii in models)}')
+            return json.load(f)["metrics"]
+    workdir = Path(work_root) / key
+    parameters = stage_reference(reference, models, workdir)
+    submit(parameters, config, workdir, backend, labels)
+    metrics = collect_metrics(workdir)
+    if not metrics:
+        raise RuntimeError(f'no property results found in {workdir}')
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, 'w') as f:
+        json.dump({"models": [Path(ii).name for ii in models], "metrics": metrics}, f, indent=2)
+    return metrics
+
+
+def tolerance_for(key, tolerances):
+    # `conf.000000/eos_00/B0` -> `eos/B0`
+    _, prop_dir, metric = key.split('/', 2)
+    name = f'{prop_dir.split("_")[0]}/{metric}'
+    for pattern, tolerance in tolerances.items():
+        if fnmatch(name, pattern):
+            return tolerance
+    return None
+
+
+def compare_metrics(metrics, baseline, tolerances):
+    rows = []
+    for key in sorted(set(baseline) | set(metrics)):
+        old, new = baseline.get(key), metrics.get(key)
+        tolerance = tolerance_for(key, tolerances)
+        row = {"metric": key, "baseline": old, "value": new, "limit": None}
+        if old is None:
+            row["status"] = "new"
+        elif new is None:
+            row["status"] = "missing" if tolerance else "untracked"
+        elif tolerance is None:
+            row["status"] = "untracked"
+        else:
+            row["limit"] = max(tolerance.get("abs", 0.0), tolerance.get("rel", 0.0) * abs(old))
+            row["status"] = "ok" if abs(new - old) <= row["limit"] else "regressed"
+        rows.append(row)
+    return rows
+
+
+def format_rows(rows, structures):
+    names = {'conf.%06d' % ii: Path(ss).name for ii, ss in enumerate(structures)}
+    table = [("METRIC", "BASELINE", "VALUE", "LIMIT", "STATUS")]
+    for row in rows:
+        conf, rest = row["metric"].split('/', 1)
+        table.append((
+            f'{names.get(conf, conf)}/{rest}',
+            '-' if row["baseline"] is None else '%.6g' % row["baseline"],
+            '-' if row["value"] is None else '%.6g' % row["value"],
+            '-' if row["limit"] is None else '%.3g' % row["limit"],
+            row["status"],
+        ))
+    widths = [max(len(row[ii]) for row in table) for ii in range(len(table[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in table)
+
+
+def bohrium_config(options_file):
+    from backends import load_options
+    from submit_queue import load_spec
+    import lmp_runner
+    spec = load_spec(options_file)
+    opts = load_options('lammps', spec.get("options", spec))
+    return lmp_runner.get_global_config(opts), opts.dflow_labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='regression', description='Gate a new LAMMPS potential on a pinned APEX reference set')
+    parser.add_argument('reference', help='reference set JSON: structures, type_map, parameters, tolerances')
+    parser.add_argument('model', nargs='+', help='new potential file(s)')
+    parser.add_argument('--old-model', nargs='+', help='previous potential to compare against (results cached)')
+    parser.add_argument('--baseline', help='stored baseline metrics JSON, used instead of --old-model')
+    parser.add_argument('--update-baseline', action='store_true', help='store the new results as the baseline')
+    parser.add_argument('--backend', choices=['local', 'bohrium'], default='local',
+                        help='local: APEX debug mode on this machine; bohrium: submit with --options')
+    parser.add_argument('--run-command', default='lmp -i in.lammps', help='LAMMPS command of the local backend')
+    parser.add_argument('--options', help='LAMMPS job spec with Bohrium/dflow credentials for the bohrium backend')
+    parser.add_argument('--work-dir', default='regression', help='where reference runs are staged')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('-o', '--output', default='regression_report.json')
+    args = parser.parse_args(argv)
+    # argument errors before the expensive reference run
+    if args.update_baseline and not args.baseline:
+        parser.error('--update-baseline needs --baseline')
+    if not args.update_baseline and not args.baseline and not args.old_model:
+        parser.error('give --baseline or --old-model to compare against')
+    if args.backend == 'bohrium' and not args.options:
+        parser.error('--options is required for the bohrium backend')
+
+    reference = load_reference(args.reference)
+    tolerances = reference.get("tolerances") or DEFAULT_TOLERANCES
+    labels = None
+    if args.backend == 'bohrium':
+        config, labels = bohrium_config(args.options)
+    else:
+        config = local_config(args.run_command)
+
+    def run(models):
+        return run_reference(reference, models, args.backend, config, args.work_dir, args.cache_dir, labels)
+
+    metrics = run(args.model)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(metrics, f, indent=2)
+        print(f'baseline written to {args.baseline}')
+        return 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    else:
+        baseline = run(args.old_model)
+
+    rows = compare_metrics(metrics, baseline, tolerances)
+    regressions = [row for row in rows if row["status"] in ("regressed", "missing")]
+    with open(args.output, 'w') as f:
+        json.dump({"models": args.model, "rows": rows, "regressions": len(regressions)}, f, indent=2)
+    print(format_rows(rows, reference["structures"]))
+    print(f'{len(regressions)} regressions' if regressions else 'no regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
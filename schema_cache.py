@@ -0,0 +1,83 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import sys
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'APEX_SCHEMA_CACHE', str(Path.home() / '.cache' / 'apex_bohr_app' / 'schemas'))
+# pydantic v1 keys its schema cache by (by_alias, ref_template)
+DEFAULT_REF_TEMPLATE = '#/definitions/{model}'
+APP_DIR = str(Path(__file__).resolve().parent)
+
+
+def _version(name):
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return None
+
+
+def source_hash(model):
+    """Hash of every app module that defines a class of `model`, plus the library versions."""
+    sha = hashlib.sha256()
+    seen = set()
+    for cls in model.__mro__:
+        module = sys.modules.get(cls.__module__)
+        path = getattr(module, '__file__', None)
+        # library classes are covered by the version strings below
+        if not path or path in seen or not str(Path(path).resolve()).startswith(APP_DIR):
+            continue
+        seen.add(path)
+        sha.update(Path(path).read_bytes())
+    for name in ('pydantic', 'dp-launching'):
+        sha.update(str(_version(name)).encode())
+    return sha.hexdigest()[:16]
+
+
+def cache_path(model, cache_dir=DEFAULT_CACHE_DIR):
+    return Path(cache_dir) / f'{model.__name__}-{source_hash(model)}.json'
+
+
+def load_schema(model, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the JSON schema of `model`, from disk when the model source is unchanged.
+
+    The schema is put into the model's own schema cache, so the launching
+    framework's `model.schema()` calls skip generating it.
+    """
+    path = cache_path(model, cache_dir)
+    schema = None
+    if path.exists():
+        try:
+            with open(path, 'r') as f:
+                schema = json.load(f)
+        except (OSError, ValueError):
+            schema = None
+    if schema is None:
+        schema = model.schema()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(schema, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f'warning: cannot cache the schema of {model.__name__}: {e}')
+    if hasattr(model, '__schema_cache__'):
+        model.__schema_cache__[(True, DEFAULT_REF_TEMPLATE)] = schema
+    return schema
+
+
+def warm_models(models, cache_dir=DEFAULT_CACHE_DIR):
+    for model in models:
+        load_schema(model, cache_dir)
+
+
+def prune_cache(models, cache_dir=DEFAULT_CACHE_DIR):
+    # drop schemas of earlier model sources
+    keep = {cache_path(model, cache_dir).name for model in models}
+    names = {model.__name__ for model in models}
+    for path in Path(cache_dir).glob('*.json'):
+        if path.name not in keep and path.name.rsplit('-', 1)[0] in names:
+            path.unlink()
@@ -0,0 +1,183 @@
+from pathlib import Path
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+
+RECORD_FILE = 'shards.json'
+# rough number of tasks APEX generates per configuration for each property
+SURFACE_TASKS = {1: 3, 2: 9, 3: 19}
+INTERSTITIAL_TASKS = 10
+ELASTIC_TASKS = 24
+PHONON_TASKS = 6
+# properties whose tasks are slabs with a vacuum layer
+SLAB_PROPERTIES = ("surface",)
+# init, relaxation bookkeeping and result steps around the task slices
+NODES_PER_STEP = 3
+
+
+def estimate_property_tasks(prop):
+    prop_type = prop.get("type")
+    if prop.get("skip", False):
+        return 0
+    if prop_type == "eos":
+        return int((prop.get("vol_end", 1.2) - prop.get("vol_start", 0.8)) / prop.get("vol_step", 0.05)) + 1
+    if prop_type == "elastic":
+        return ELASTIC_TASKS
+    if prop_type == "surface":
+        max_miller = prop.get("max_miller", 2)
+        return SURFACE_TASKS.get(max_miller, max_miller ** 3 * 3)
+    if prop_type == "interstitial":
+        return INTERSTITIAL_TASKS
+    if prop_type == "vacancy":
+        return 1
+    if prop_type == "gamma":
+        return prop.get("n_steps", 10) + 1
+    if prop_type == "phonon":
+        return PHONON_TASKS
+    return 1
+
+
+def estimate_atoms(prop, natoms, cell_length):
+    """Rough atom count of the largest task of an APEX property, from the bulk cell."""
+    prop_type = prop.get("type", "relaxation")
+    if prop_type == "surface":
+        layers = math.ceil(prop.get("min_slab_size", 10) / cell_length)
+        return natoms * layers * prop.get("max_miller", 2)
+    if "supercell_size" in prop:
+        return natoms * int(np.prod(prop["supercell_size"]))
+    return natoms
+
+
+def has_vacuum(prop):
+    return prop.get("type") in SLAB_PROPERTIES or prop.get("vacuum_size", 0) > 0
+
+
+def estimate_nodes(parameter_dict, n_confs, group_size=1):
+    per_conf = 1 if "relaxation" in parameter_dict else 0
+    per_conf += sum(estimate_property_tasks(pp) for pp in parameter_dict.get("properties", []))
+    n_steps = 1 + len(parameter_dict.get("properties", []))
+    return math.ceil(per_conf * n_confs / max(group_size, 1)) + NODES_PER_STEP * n_steps
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def staged_confs(work_dirs=('./',)):
+    """POSCARs staged under `returns/conf.*` of `work_dirs`.
+
+    The runners change into the work dir before planning, so the resource estimates
+    read these copies rather than the uploaded `configurations` paths.
+    """
+    return sorted(ii for work_dir in work_dirs for ii in Path(work_dir).glob('returns/conf.*/POSCAR'))
+
+
+def stage_subdir(workdir, shared, sub_dir, conf_names):
+    """Move `conf_names` into `workdir/sub_dir/returns` next to hard links of the `shared` entries."""
+    sub_dir = Path(workdir) / sub_dir
+    (sub_dir / 'returns').mkdir(parents=True)
+    # models, inputs and parameter files are hard-linked, not copied
+    for src in shared:
+        if src.is_dir() and not src.is_symlink():
+            shutil.copytree(src, sub_dir / src.name, symlinks=True, copy_function=_link_or_copy)
+        else:
+            _link_or_copy(src, sub_dir / src.name)
+    for name in conf_names:
+        os.rename(Path(workdir) / 'returns' / name, sub_dir / 'returns' / name)
+    return sub_dir
+
+
+def split_workdir(workdir, conf_names, n_shards):
+    workdir = Path(workdir)
+    shared = [ii for ii in workdir.iterdir() if ii.name != 'returns']
+    chunk = math.ceil(len(conf_names) / n_shards)
+    shards = []
+    for ii in range(n_shards):
+        names = conf_names[ii * chunk:(ii + 1) * chunk]
+        if not names:
+            break
+        shard_dir = stage_subdir(workdir, shared, 'shard.%03d' % ii, names)
+        shards.append({
+            "work_dir": shard_dir.name,
+            "confs": [names[0], names[-1]],
+            "n_confs": len(names),
+            "workflow_ids": [],
+            "status": "staged",
+        })
+    os.rmdir(workdir / 'returns')
+    return shards
+
+
+def shard_workdir(workdir, parameter_dict, n_confs, max_nodes, group_size=1, min_shards=1):
+    nodes = estimate_nodes(parameter_dict, n_confs, group_size)
+    n_shards = max(math.ceil(nodes / max_nodes) if max_nodes else 1, min_shards)
+    n_shards = min(n_shards, n_confs)
+    if n_shards < 2:
+        return ['./'], nodes
+    conf_names = sorted(ii.name for ii in (Path(workdir) / 'returns').iterdir())
+    shards = split_workdir(workdir, conf_names, n_shards)
+    for shard in shards:
+        shard["estimated_nodes"] = estimate_nodes(parameter_dict, shard["n_confs"], group_size)
+    record = {
+        "estimated_nodes": nodes,
+        "max_workflow_nodes": max_nodes,
+        "status": "staged",
+        "shards": shards,
+    }
+    write_record(workdir, record)
+    print(f'split {n_confs} configurations into {len(shards)} workflows (~{nodes} nodes)')
+    return ['./' + ss["work_dir"] for ss in shards], nodes
+
+
+def write_record(workdir, record):
+    with open(Path(workdir) / RECORD_FILE, 'w') as f:
+        json.dump(record, f, indent=2)
+
+
+def read_record(workdir):
+    path = Path(workdir) / RECORD_FILE
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def read_workflow_log(work_dir):
+    log = Path(work_dir) / '.workflow.log'
+    if not log.exists():
+        return []
+    with open(log, 'r') as f:
+        return [line.split()[0] for line in f if line.strip()]
+
+
+def aggregate_status(statuses):
+    statuses = set(statuses)
+    for status in ("failed", "Failed", "Error", "Running", "Pending", "submitted", "staged"):
+        if status in statuses:
+            return status
+    return statuses.pop() if len(statuses) == 1 else "Unknown"
+
+
+def record_submission(workdir):
+    record = read_record(workdir)
+    if record is None:
+        return None
+    for shard in record["shards"]:
+        shard["workflow_ids"] = read_workflow_log(Path(workdir) / shard["work_dir"])
+        shard["status"] = "submitted" if shard["workflow_ids"] else "failed"
+    record["status"] = aggregate_status(ss["status"] for ss in record["shards"])
+    write_record(workdir, record)
+    return record
+
+
+def record_submissions(workdir, work_dirs):
+    # shards of a k-point group or a compared potential keep their record in that dir
+    for parent in sorted({Path(ii).parent for ii in work_dirs}):
+        record_submission(Path(workdir) / parent)
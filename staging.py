@@ -0,0 +1,25 @@
+from pathlib import Path
+import os
+
+
+def prune_files(files, mapping, elements):
+    # only a dict mapping tells which file belongs to which element
+    if not files or not isinstance(mapping, dict):
+        return list(files or []), 0
+    needed = {Path(fname).name for ele, fname in mapping.items() if ele in elements}
+    kept = []
+    saved = 0
+    for ii in files:
+        if Path(ii).name in needed:
+            kept.append(ii)
+        else:
+            saved += os.path.getsize(ii)
+    return kept, saved
+
+
+def format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
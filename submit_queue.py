@@ -0,0 +1,205 @@
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+from machine import parse_scass_type
+
+DEFAULT_DB = os.environ.get('APEX_QUEUE_DB', str(Path.home() / '.apex_bohr_app' / 'queue.db'))
+ACTIVE_STATES = ("queued", "running")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    backend TEXT NOT NULL,
+    options TEXT NOT NULL,
+    work_dir TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    cores INTEGER NOT NULL,
+    core_hours REAL NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    pid INTEGER,
+    exit_code INTEGER,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_order ON jobs (state, priority DESC, id);
+"""
+
+
+def load_spec(path):
+    with open(path, 'r') as f:
+        text = f.read()
+    if Path(path).suffix in ('.yaml', '.yml'):
+        import yaml
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+class SubmissionQueue:
+    def __init__(self, path=DEFAULT_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # short transactions; enqueue from the CLI while the daemon runs
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def enqueue(self, backend, options, work_dir, priority=0, node_hours=1.0, spec_dir='.'):
+        from backends import load_options, resolve_paths
+        # the daemon starts the runner in `work_dir`, file paths of the spec are relative to `spec_dir`
+        options = resolve_paths(backend, options, Path(spec_dir).resolve())
+        # reject a broken spec now rather than when the daemon picks it up
+        opts = load_options(backend, options)
+        cores = parse_scass_type(getattr(opts, 'scass_type', None))["cores"]
+        cur = self.db.execute(
+            'INSERT INTO jobs (backend, options, work_dir, priority, cores, core_hours, enqueued_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (backend, json.dumps(options), str(Path(work_dir).resolve()), priority,
+             cores, cores * node_hours, time.time())
+        )
+        return cur.lastrowid
+
+    def jobs(self, states=None):
+        query = 'SELECT * FROM jobs'
+        args = ()
+        if states:
+            query += ' WHERE state IN (%s)' % ','.join('?' * len(states))
+            args = tuple(states)
+        return [dict(row) for row in self.db.execute(query + ' ORDER BY priority DESC, id', args)]
+
+    def update(self, job_id, **fields):
+        keys = ', '.join(f'{k} = ?' for k in fields)
+        self.db.execute(f'UPDATE jobs SET {keys} WHERE id = ?', (*fields.values(), job_id))
+
+    def cancel(self, job_id):
+        cur = self.db.execute(
+            "UPDATE jobs SET state = 'cancelled', finished_at = ? WHERE id = ? AND state IN (?, ?)",
+            (time.time(), job_id, *ACTIVE_STATES)
+        )
+        return cur.rowcount > 0
+
+    def admit(self, concurrency, core_hour_budget):
+        running = self.jobs(["running"])
+        in_flight = sum(jj["core_hours"] for jj in running)
+        admitted = []
+        for job in self.jobs(["queued"]):
+            if len(running) + len(admitted) >= concurrency:
+                break
+            fits = not core_hour_budget or in_flight + job["core_hours"] <= core_hour_budget
+            # an oversized job still runs once nothing else holds the budget
+            if not fits and (running or admitted):
+                break
+            admitted.append(job)
+            in_flight += job["core_hours"]
+        return admitted
+
+    def recover(self):
+        # jobs of a daemon that died cannot be re-attached to
+        for job in self.jobs(["running"]):
+            self.update(job["id"], state="interrupted", finished_at=time.time())
+
+
+def run_job(job):
+    from backends import get_backend, load_options
+    os.makedirs(job["work_dir"], exist_ok=True)
+    os.chdir(job["work_dir"])
+    with open('queue_job.log', 'a') as log:
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+        _, runner = get_backend(job["backend"])
+        runner(load_options(job["backend"], json.loads(job["options"])))
+
+
+def serve(queue, concurrency=2, core_hour_budget=None, poll_interval=5.0, once=False):
+    # fork keeps the runner modules imported by the daemon warm in every worker
+    ctx = multiprocessing.get_context('fork')
+    workers = {}
+    queue.recover()
+    print(f'queue daemon on {queue.path}: concurrency {concurrency}, '
+          f'core-hour budget {core_hour_budget or "unlimited"}', flush=True)
+    while True:
+        for job_id, proc in list(workers.items()):
+            state = queue.db.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+            if state == "cancelled" and proc.is_alive():
+                proc.terminate()
+            if proc.is_alive():
+                continue
+            proc.join()
+            if state != "cancelled":
+                queue.update(job_id, state="succeeded" if proc.exitcode == 0 else "failed",
+                             exit_code=proc.exitcode, finished_at=time.time())
+            print(f'job {job_id} finished with exit code {proc.exitcode}', flush=True)
+            del workers[job_id]
+        for job in queue.admit(concurrency, core_hour_budget):
+            proc = ctx.Process(target=run_job, args=(job,), name=f'apex-job-{job["id"]}')
+            proc.start()
+            workers[job["id"]] = proc
+            queue.update(job["id"], state="running", pid=proc.pid, started_at=time.time())
+            print(f'job {job["id"]} ({job["backend"]}, priority {job["priority"]}, '
+                  f'{job["core_hours"]:g} core-hours) started in {job["work_dir"]}', flush=True)
+        if once and not workers and not queue.jobs(["queued"]):
+            return
+        time.sleep(poll_interval)
+
+
+def format_jobs(jobs):
+    rows = [("ID", "BACKEND", "PRIORITY", "CORE-HOURS", "STATE", "WORK DIR")]
+    for jj in jobs:
+        rows.append((str(jj["id"]), jj["backend"], str(jj["priority"]),
+                     f'{jj["core_hours"]:g}', jj["state"], jj["work_dir"]))
+    widths = [max(len(row[ii]) for row in rows) for ii in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='queue', description='Local APEX submission queue')
+    parser.add_argument('--db', default=DEFAULT_DB, help='queue database (default: %(default)s)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = sub.add_parser('enqueue', help='queue a submission')
+    enqueue.add_argument('backend', help='lammps, vasp or abacus')
+    enqueue.add_argument('spec', help='JSON/YAML file with the model fields of the submission')
+    enqueue.add_argument('--priority', type=int, default=0, help='higher runs first')
+    enqueue.add_argument('--node-hours', type=float, default=1.0,
+                         help='estimated machine hours of the workflow, for the core-hour budget')
+    enqueue.add_argument('--work-dir', default='.', help='directory the runner is started in')
+
+    status = sub.add_parser('status', help='list jobs')
+    status.add_argument('--all', action='store_true', help='include finished jobs')
+
+    cancel = sub.add_parser('cancel', help='cancel a queued or running job')
+    cancel.add_argument('job_id', type=int)
+
+    daemon = sub.add_parser('serve', help='run the queue daemon')
+    daemon.add_argument('--concurrency', type=int, default=2, help='submissions running at once')
+    daemon.add_argument('--core-hour-budget', type=float, default=None,
+                        help='upper bound on the core-hours of running submissions')
+    daemon.add_argument('--poll-interval', type=float, default=5.0)
+    daemon.add_argument('--once', action='store_true', help='exit when the queue is drained')
+
+    args = parser.parse_args(argv)
+    queue = SubmissionQueue(args.db)
+    if args.command == 'enqueue':
+        job_id = queue.enqueue(args.backend, load_spec(args.spec), args.work_dir,
+                               args.priority, args.node_hours, Path(args.spec).parent)
+        print(f'queued job {job_id}')
+    elif args.command == 'status':
+        print(format_jobs(queue.jobs(None if args.all else ACTIVE_STATES)))
+    elif args.command == 'cancel':
+        if not queue.cancel(args.job_id):
+            print(f'job {args.job_id} is not queued or running')
+            return 1
+    elif args.command == 'serve':
+        serve(queue, args.concurrency, args.core_hour_budget, args.poll_interval, args.once)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+from functools import lru_cache
+import itertools
+import json
+
+from property_registry import _cal_entries, build_properties, compile_registry, write_input_files
+
+SWEEP_INDEX = 'sweep_index.json'
+
+
+def parse_sweep(sweep):
+    grid = {}
+    for field, values in (sweep or {}).items():
+        try:
+            values = json.loads(values) if isinstance(values, str) else values
+        except json.JSONDecodeError:
+            raise ValueError(f'sweep values of `{field}` must be a JSON list, got {values!r}')
+        if not isinstance(values, list) or not values:
+            raise ValueError(f'sweep values of `{field}` must be a non-empty JSON list, got {values!r}')
+        grid[field] = values
+    return grid
+
+
+@lru_cache(maxsize=None)
+def property_fields(backend, prop_type):
+    for spec in compile_registry(backend):
+        if spec["type"] == prop_type:
+            fields = {spec["select"], spec["input"][0]}
+            for _, field, _ in spec["fields"]:
+                fields.update(field if isinstance(field, tuple) else [field])
+            fields.update(ii for ii in (spec["cal_type"], spec["custom"]) if ii)
+            fields.update(ff for _, ff, _ in spec["cal_setting"])
+            return frozenset(fields)
+    raise ValueError(f'unknown property type `{prop_type}`')
+
+
+def check_sweep(grid, base, backend):
+    relaxation = set(ff for _, ff, _ in _cal_entries(backend, '', 'relax'))
+    for field in grid:
+        if field not in base:
+            raise ValueError(f'cannot sweep `{field}`, no such field')
+        if field in relaxation:
+            raise ValueError(f'cannot sweep relaxation setting `{field}`, the relaxation is shared by the sweep')
+
+
+def sweep_properties(opts, backend, sweep, files=None, index_file=SWEEP_INDEX):
+    """Expand `sweep` ({field: [values]}) into one property list over a shared relaxation.
+
+    Every distinct setting of a property becomes a variant with its own `suffix`;
+    combinations differing only in fields a property does not read are merged.
+    """
+    grid = parse_sweep(sweep)
+    base = opts if isinstance(opts, dict) else opts.dict()
+    check_sweep(grid, base, backend)
+    variants = {}
+    for combo in itertools.product(*grid.values()):
+        values = dict(zip(grid, combo))
+        variant_files = {}
+        for prop in build_properties(dict(base, **values), backend, variant_files):
+            key = json.dumps(prop, sort_keys=True, default=str)
+            if key not in variants.setdefault(prop["type"], {}):
+                swept = {k: v for k, v in values.items() if k in property_fields(backend, prop["type"])}
+                variants[prop["type"]][key] = (prop, swept, variant_files)
+
+    collected = {} if files is None else files
+    properties = []
+    index = {}
+    for prop_type, entries in variants.items():
+        for ii, (prop, swept, variant_files) in enumerate(entries.values()):
+            filename = prop.get("cal_setting", {}).get("input_prop")
+            if len(entries) > 1:
+                prop["suffix"] = 'sweep%03d' % ii
+                index[f'{prop_type}_{prop["suffix"]}'] = swept
+                if filename:
+                    # variants may differ in their input file text
+                    prop["cal_setting"]["input_prop"] = f'{filename}.{prop["suffix"]}'
+            if filename:
+                collected[prop["cal_setting"]["input_prop"]] = variant_files[filename]
+            properties.append(prop)
+    if files is None:
+        write_input_files(collected)
+    if index_file:
+        with open(index_file, 'w') as f:
+            json.dump(index, f, indent=2, default=str)
+    print(f'sweep over {", ".join(grid)}: {len(properties)} property variants')
+    return properties
@@ -0,0 +1,143 @@
+from pathlib import Path
+import copy
+import json
+import math
+
+from sharding import read_record, shard_workdir, write_record
+
+# the updated ledger, written to the work dir and so copied out with the results
+LEDGER_FILE = 'quota_ledger.json'
+
+
+def parse_target(spec):
+    parts = spec.strip().split(':')
+    if len(parts) < 3:
+        raise ValueError(f'invalid submission target `{spec}`, expect `project_id:platform:scass_type[:weight]`')
+    weight = 1.0
+    if len(parts) > 3:
+        try:
+            weight = float(parts[-1])
+            parts = parts[:-1]
+        except ValueError:
+            pass
+    if weight <= 0:
+        raise ValueError(f'invalid submission target `{spec}`, weight must be positive')
+    return {
+        "project_id": parts[0],
+        "platform": parts[1],
+        "scass_type": ':'.join(parts[2:]),
+        "weight": weight,
+    }
+
+
+def parse_targets(specs):
+    return [parse_target(ii) for ii in specs or []]
+
+
+class QuotaLedger:
+    # local stand-in for per-project quota, {"projects": {"<id>": {"remaining": n}}}
+    def __init__(self, path=None, out_path=None):
+        self.path = Path(path) if path else None
+        # the uploaded ledger is a run input and part of the checkpoint hash, never rewrite it
+        self.out_path = Path(out_path) if out_path else None
+        self.projects = {}
+        if self.path and self.path.exists():
+            with open(self.path, 'r') as f:
+                self.projects = json.load(f).get("projects", {})
+
+    def remaining(self, project_id):
+        entry = self.projects.get(str(project_id))
+        return math.inf if entry is None else entry.get("remaining", 0)
+
+    def reserve(self, project_id, amount):
+        entry = self.projects.get(str(project_id))
+        if entry is not None:
+            entry["remaining"] = entry.get("remaining", 0) - amount
+            entry["reserved"] = entry.get("reserved", 0) + amount
+
+    def save(self):
+        if self.path and self.out_path:
+            with open(self.out_path, 'w') as f:
+                json.dump({"projects": self.projects}, f, indent=2)
+
+
+def assign_shards(shards, targets, ledger):
+    load = [0] * len(targets)
+    assignment = {}
+    # largest shards first so the greedy fill stays balanced
+    for shard in sorted(shards, key=lambda ss: -ss["estimated_nodes"]):
+        cost = shard["estimated_nodes"]
+        best = None
+        for ii, target in enumerate(targets):
+            remaining = ledger.remaining(target["project_id"]) - load[ii]
+            fits = remaining >= cost
+            capacity = target["weight"] * (remaining if math.isfinite(remaining) else 1.0)
+            score = (load[ii] + cost) / capacity if capacity > 0 else math.inf
+            key = (not fits, score)
+            if best is None or key < best[0]:
+                best = (key, ii)
+        if best[0][0]:
+            print(f'warning: no target has quota left for {shard["work_dir"]}, '
+                  f'using project {targets[best[1]]["project_id"]}')
+        load[best[1]] += cost
+        assignment[shard["work_dir"]] = best[1]
+    return assignment
+
+
+def target_config(config_dict, target):
+    if not target:
+        return config_dict
+    config = copy.deepcopy(config_dict)
+    config["bohrium_config"]["projectId"] = target["project_id"]
+    config["bohrium_config"]["project_id"] = target["project_id"]
+    remote_profile = config["machine"]["remote_profile"]
+    remote_profile["program_id"] = int(target["project_id"])
+    remote_profile["input_data"]["platform"] = target["platform"]
+    remote_profile["input_data"]["scass_type"] = target["scass_type"]
+    return config
+
+
+def plan_submissions(workdir, work_dirs, config_dict, targets, ledger=None):
+    """[(target, config, work_dirs)] of the shards of `workdir` spread over `targets`.
+
+    Pass the same `ledger` to every call planning one run, so each sees the quota reserved before.
+    """
+    if not targets:
+        return [(None, config_dict, work_dirs)]
+    record = read_record(workdir)
+    # an unsharded study still goes to the best target
+    shards = record["shards"] if record else [{"work_dir": '.', "estimated_nodes": 0}]
+    ledger = ledger or QuotaLedger()
+    assignment = assign_shards(shards, targets, ledger)
+    groups = {}
+    for shard, work_dir in zip(shards, work_dirs):
+        ii = assignment[shard["work_dir"]]
+        shard["target"] = {k: v for k, v in targets[ii].items() if k != "weight"}
+        ledger.reserve(targets[ii]["project_id"], shard["estimated_nodes"])
+        groups.setdefault(ii, []).append(work_dir)
+    ledger.save()
+    if record:
+        write_record(workdir, record)
+    return [(targets[ii], target_config(config_dict, targets[ii]), dirs) for ii, dirs in sorted(groups.items())]
+
+
+def plan_subdirs(workdir, groups, config_dict, targets, ledger=None, max_nodes=None, group_size=1):
+    """Shard and plan every `(sub_dir, parameter_dict)` of `groups` like a work dir of its own.
+
+    Returns the submissions `(target, config, work_dirs, [parameter_dict])`, paths relative
+    to `workdir`, the number of work dirs and the estimated nodes.
+    """
+    submissions = []
+    n_dirs = 0
+    nodes = 0
+    for sub_dir, parameters in groups:
+        root = Path(workdir) / sub_dir
+        n_confs = len(list((root / 'returns').iterdir()))
+        work_dirs, sub_nodes = shard_workdir(
+            root, parameters, n_confs, max_nodes, group_size, min_shards=len(targets))
+        n_dirs += len(work_dirs)
+        nodes += sub_nodes
+        for target, config, dirs in plan_submissions(root, work_dirs, config_dict, targets, ledger):
+            dirs = ['./' + (Path(sub_dir) / ii).as_posix() for ii in dirs]
+            submissions.append((target, config, dirs, [parameters]))
+    return submissions, n_dirs, nodes
@@ -0,0 +1,71 @@
+from pathlib import Path
+import json
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# the app modules live flat in the repository root
+sys.path.insert(0, str(ROOT))
+
+FCC_POSCAR = """Al fcc
+{scale}
+{a} 0.0 0.0
+0.0 {a} 0.0
+0.0 0.0 {c}
+Al
+4
+Direct
+0.0 0.0 0.0
+0.0 0.5 0.5
+0.5 0.0 0.5
+0.5 0.5 0.0
+"""
+
+
+def write_poscar(path, a=4.04, c=None, scale=1.0):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(FCC_POSCAR.format(a=a, c=a if c is None else c, scale=scale))
+    return path
+
+
+def stage_confs(workdir, n_confs, a=4.04):
+    """`workdir/returns/conf.NNNNNN/POSCAR` for `n_confs` configurations."""
+    return [write_poscar(Path(workdir) / 'returns' / ('conf.%06d' % ii) / 'POSCAR', a=a)
+            for ii in range(n_confs)]
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('apex benchmarks')
+    group.addoption('--baseline', default=None, help='baseline file, `benchmark_baseline.json` by default')
+    group.addoption('--update-baseline', action='store_true', help='record the benchmark results as the baseline')
+    group.addoption('--quick', action='store_true', help='skip the largest benchmark cases')
+
+
+@pytest.fixture(scope='session')
+def baseline(request):
+    from benchmark import BASELINE_FILE
+    path = Path(request.config.getoption('--baseline') or BASELINE_FILE)
+    data = json.loads(path.read_text()) if path.exists() else {}
+    yield data
+    if request.config.getoption('--update-baseline'):
+        path.write_text(json.dumps(data, indent=2))
+
+
+@pytest.fixture
+def gate(request, baseline):
+    """Compare a benchmark result with the stored baseline, or record it with `--update-baseline`."""
+    from benchmark import MIN_WALL, TOLERANCE, check_regressions
+
+    def check(name, result):
+        result = {k: v for k, v in result.items() if isinstance(v, (int, float))}
+        if request.config.getoption('--update-baseline'):
+            baseline[name] = result
+            return
+        if name not in baseline:
+            pytest.skip(f'no baseline for {name}, run with --update-baseline to record it')
+        regressions = check_regressions({name: result}, baseline, TOLERANCE, MIN_WALL)
+        if regressions:
+            pytest.fail('\n'.join(f'REGRESSION {ii}' for ii in regressions))
+    return check
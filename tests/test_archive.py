@@ -0,0 +1,68 @@
+import os
+import tarfile
+import time
+
+import pytest
+
+import archive
+from archive import archive_suffix, copy_unpacked, extract_members, load_index, pack_directory, pack_workdir
+from conftest import stage_confs
+
+
+@pytest.fixture(params=['zstd', 'gzip'])
+def codec(request, monkeypatch):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    else:
+        monkeypatch.setattr(archive, 'zstandard', None)
+    return request.param
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    workdir = tmp_path / 'workdir'
+    stage_confs(workdir, 20)
+    (workdir / 'frozen_model.pb').write_bytes(os.urandom(3 * 2**16))
+    return workdir
+
+
+def test_pack_and_extract_members(tmp_path, workdir, codec):
+    path = tmp_path / ('workdir' + archive_suffix())
+    index = pack_directory(workdir, path, frame_size=2**12)
+    assert index["codec"] == codec
+    assert load_index(path) == index
+    assert index["raw_bytes"] == sum(ii.stat().st_size for ii in workdir.rglob('*') if ii.is_file())
+    assert len(index["frames"]) > 2
+    extracted = extract_members(path, ['returns/conf.000007/*', 'frozen_model.pb'], tmp_path / 'task')
+    assert sorted(extracted) == ['frozen_model.pb', 'returns/conf.000007/POSCAR']
+    for name in extracted:
+        assert (tmp_path / 'task' / name).read_bytes() == (workdir / name).read_bytes()
+    assert not (tmp_path / 'task' / 'returns' / 'conf.000006').exists()
+
+
+def test_large_member_gets_its_own_frame(tmp_path, workdir, codec):
+    path = tmp_path / ('workdir' + archive_suffix())
+    index = pack_directory(workdir, path, frame_size=2**16)
+    frame = index["members"]["frozen_model.pb"]
+    assert frame not in {ii for name, ii in index["members"].items() if name != 'frozen_model.pb'}
+    assert extract_members(path, ['frozen_model.pb'], tmp_path / 'task') == ['frozen_model.pb']
+
+
+def test_frames_form_one_stream(tmp_path, workdir, monkeypatch):
+    monkeypatch.setattr(archive, 'zstandard', None)
+    path = tmp_path / 'workdir.tar.gz'
+    pack_directory(workdir, path, frame_size=2**12)
+    with tarfile.open(path, 'r:gz', ignore_zeros=True) as tar:
+        names = tar.getnames()
+    assert sorted(names) == sorted(ii.relative_to(workdir).as_posix() for ii in workdir.rglob('*'))
+
+
+def test_copy_unpacked(tmp_path, workdir):
+    archive_path, index = pack_workdir(workdir, tmp_path / 'outputs')
+    assert archive_path.parent == tmp_path / 'outputs'
+    time.sleep(0.01)
+    (workdir / '.workflow.log').write_text('relax-abc\n')
+    (workdir / 'returns' / 'conf.000001' / 'POSCAR').write_text('changed')
+    copied = copy_unpacked(workdir, tmp_path / 'outputs' / 'workdir', index)
+    assert sorted(copied) == ['.workflow.log', 'returns/conf.000001/POSCAR']
+    assert (tmp_path / 'outputs' / 'workdir' / '.workflow.log').read_text() == 'relax-abc\n'
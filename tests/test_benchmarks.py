@@ -0,0 +1,69 @@
+from argparse import Namespace
+import importlib
+import tempfile
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import benchmark as bench  # noqa: E402
+from benchmark import (QUICK_RUNNER_CASES, RUNNER_CASES, RUNNERS, bench_upload, make_inputs,  # noqa: E402
+                       run_isolated, run_runner_case, write_large_poscar)
+
+
+def best(benchmark):
+    if benchmark.disabled:
+        pytest.skip('benchmarks are disabled')
+    return benchmark.stats.stats.min
+
+
+@pytest.mark.parametrize('n_confs, model_size', RUNNER_CASES)
+@pytest.mark.parametrize('backend', list(RUNNERS))
+def test_runner(benchmark, gate, request, backend, n_confs, model_size):
+    if request.config.getoption('--quick') and (n_confs, model_size) not in QUICK_RUNNER_CASES:
+        pytest.skip('largest case, run without --quick')
+    # the runners need the Bohrium launching SDK and APEX, the case itself stubs `submit_workflow`
+    pytest.importorskip(RUNNERS[backend][0])
+    name = f'runner/{backend}/confs={n_confs}/model={model_size // 2**20}MiB'
+    result = benchmark.pedantic(run_isolated, args=(run_runner_case, backend, n_confs, model_size),
+                                rounds=1, iterations=1)
+    benchmark.extra_info.update(result)
+    best(benchmark)
+    gate(name, result)
+
+
+def test_poscar_large(benchmark, gate, tmp_path):
+    from poscar import read_poscar
+    path = tmp_path / 'POSCAR.large'
+    write_large_poscar(path, 100000)
+    structure = benchmark(read_poscar, path)
+    assert structure.natoms == 100000
+    gate('poscar/large_100k_atoms', {"numpy": best(benchmark)})
+
+
+def test_poscar_batch(benchmark, gate, request, tmp_path):
+    from poscar import read_poscars
+    n_files = 1000 if request.config.getoption('--quick') else 10000
+    confs, _, _ = make_inputs(tmp_path, n_files, 0)
+    assert len(benchmark(read_poscars, confs)) == n_files
+    gate(f'poscar/batch_{n_files}_files', {"numpy": best(benchmark)})
+
+
+def test_upload(benchmark, gate, request):
+    args = Namespace(quick=request.config.getoption('--quick'), store_latency=0.005)
+    results = benchmark.pedantic(bench_upload, args=(args,), rounds=1, iterations=1)
+    best(benchmark)
+    for name, result in results.items():
+        benchmark.extra_info.update(result)
+        assert result["extracted"] == 2
+        gate(name, result)
+
+
+@pytest.mark.parametrize('backend', list(bench.MODELS))
+def test_models(benchmark, gate, backend):
+    pytest.importorskip(bench.MODELS[backend][0])
+    result = benchmark.pedantic(run_isolated, args=(bench.run_models_case, backend), rounds=1, iterations=1)
+    benchmark.extra_info.update(result)
+    best(benchmark)
+    gate(f'models/{backend}', result)
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from checkpoint import CHECKPOINT_FILE, Checkpoint, input_hash, manifest_hash
+
+
+class Options:
+    # the `dict()` of a launching model is all `input_hash` reads
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def dict(self):
+        return dict(self.fields)
+
+
+def stage(workdir):
+    checkpoint = Checkpoint.resume(workdir, 'inputs')
+    (workdir / 'returns' / 'conf.000000').mkdir()
+    (workdir / 'returns' / 'conf.000000' / 'POSCAR').write_text('Al\n')
+    (workdir / 'frozen_model.pb').write_bytes(b'model')
+    checkpoint.complete('staged')
+    return checkpoint
+
+
+def test_input_hash_follows_content(tmp_path):
+    model = tmp_path / 'model.pb'
+    model.write_bytes(b'model')
+    opts = Options(potential_models=[str(model)], vol_step=0.05, bohrium_ticket='a', dflow_access_token='a')
+    digest = input_hash(opts)
+    # a relaunch downloads the inputs again, and credentials are injected afresh
+    os.utime(model, ns=(1, 1))
+    assert input_hash(Options(**dict(opts.dict(), bohrium_ticket='b', dflow_access_token='b'))) == digest
+    model.write_bytes(b'other')
+    assert input_hash(opts) != digest
+    assert input_hash(Options(**dict(opts.dict(), vol_step=0.1))) != input_hash(opts)
+
+
+def test_fresh_start(tmp_path):
+    (tmp_path / 'workdir').mkdir()
+    (tmp_path / 'workdir' / 'stale').write_text('')
+    checkpoint = Checkpoint.resume(tmp_path / 'workdir', 'inputs')
+    assert checkpoint.phase is None
+    assert os.listdir(tmp_path / 'workdir') == ['returns']
+
+
+def test_resume_staged_discards_planning(tmp_path):
+    workdir = tmp_path / 'workdir'
+    stage(workdir)
+    # written by the runner before planning was interrupted
+    (workdir / 'global_config_tmp.json').write_text('{}')
+    (workdir / 'parameter_tmp.json').write_text('{}')
+    (workdir / 'pot.000').mkdir()
+    checkpoint = Checkpoint.resume(workdir, 'inputs')
+    assert checkpoint.phase == 'staged'
+    assert sorted(os.listdir(workdir)) == [CHECKPOINT_FILE, 'frozen_model.pb', 'global_config_tmp.json', 'returns']
+
+
+def test_changed_staging_restages(tmp_path):
+    workdir = tmp_path / 'workdir'
+    stage(workdir)
+    (workdir / 'returns' / 'conf.000000').rename(workdir / 'conf.000000')
+    assert Checkpoint.resume(workdir, 'inputs').phase is None
+    stage(workdir)
+    assert Checkpoint.resume(workdir, 'other inputs').phase is None
+
+
+def test_submitted_work_dirs(tmp_path):
+    workdir = tmp_path / 'workdir'
+    checkpoint = stage(workdir)
+    checkpoint.plan([{"properties": []}], {"machine": {}}, [(None, {}, ['./'])])
+    assert manifest_hash(workdir) == checkpoint.data["phases"]["planned"]["manifest"]
+    assert not checkpoint.config_changed({"machine": {}})
+    (workdir / '.workflow.log').write_text('relax-abc submit\n')
+    assert checkpoint.pending(['./']) == []
+    checkpoint.record(checkpoint.data["groups"][0])
+    checkpoint.complete('submitted')
+
+    resumed = Checkpoint.resume(workdir, 'inputs')
+    assert resumed.phase == 'submitted'
+    assert resumed.data["groups"][0]["workflow_ids"] == {"./": ["relax-abc"]}
+    # never restage work dirs with accepted workflows
+    with pytest.raises(RuntimeError):
+        Checkpoint.resume(workdir, 'other inputs')
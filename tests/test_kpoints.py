@@ -0,0 +1,83 @@
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+
+from conftest import stage_confs, write_poscar
+from kpoints import (RECORD_FILE, assign_kpoints, group_by_grid, irreducible_count, kpoint_grids,
+                     miller_indices, reciprocal_lengths, stage_kpoint_groups, vacuum_axes)
+from poscar import read_poscar
+
+
+def test_reciprocal_lengths_cubic():
+    lengths = reciprocal_lengths(np.eye(3) * 4.0)
+    assert lengths.shape == (1, 3)
+    assert lengths[0] == pytest.approx([math.pi / 2] * 3)
+
+
+def test_miller_indices_one_of_each_pair():
+    indices = miller_indices(1)
+    assert len(indices) == 13
+    assert not any((-ii == indices).all(axis=1).any() for ii in indices)
+
+
+def test_bulk_and_supercell_grids(tmp_path):
+    structure = read_poscar(write_poscar(tmp_path / 'POSCAR', a=4.0))
+    props = [{"type": "relaxation"}, {"type": "vacancy", "supercell_size": [2, 2, 2]}]
+    grids = kpoint_grids([structure], props, 0.5)
+    # |b| = pi / 2 = 1.57 -> 4 points, halved in the doubled supercell
+    assert grids.tolist() == [[[4, 4, 4], [2, 2, 2]]]
+    assert irreducible_count(grids).tolist() == [[32, 4]]
+
+
+def test_vacuum_gets_one_point(tmp_path):
+    # four atoms in the lower 2 Angstrom of a 20 Angstrom cell
+    path = write_poscar(tmp_path / 'POSCAR', a=4.0, c=20.0)
+    path.write_text(path.read_text().replace('0.5 0.0 0.5', '0.5 0.0 0.1').replace('0.0 0.5 0.5', '0.0 0.5 0.1'))
+    structure = read_poscar(path)
+    assert vacuum_axes(structure).tolist() == [False, False, True]
+    assert kpoint_grids([structure], [{"type": "relaxation"}], 0.5)[0, 0, 2] == 1
+
+
+def test_slab_in_plane_grid(tmp_path):
+    structure = read_poscar(write_poscar(tmp_path / 'POSCAR', a=4.0))
+    grids = kpoint_grids([structure], [{"type": "surface", "max_miller": 1}], 0.5)
+    assert grids[0, 0, 2] == 1
+    assert grids[0, 0, 0] == grids[0, 0, 1] >= 4
+
+
+def test_group_and_assign():
+    grids = np.array([[[4, 4, 4]], [[2, 2, 2]], [[4, 4, 4]]])
+    assert list(group_by_grid(grids).values()) == [[0, 2], [1]]
+    parameters = {"relaxation": {"cal_setting": {"K_POINTS": [1, 1, 1, 0, 0, 0]}},
+                  "properties": [{"type": "eos"}]}
+    assigned = assign_kpoints(parameters, [[4, 4, 4], [2, 2, 2]])
+    # explicit grids are kept, the original is left alone
+    assert assigned["relaxation"]["cal_setting"]["K_POINTS"] == [1, 1, 1, 0, 0, 0]
+    assert assigned["properties"][0]["cal_setting"]["K_POINTS"] == [2, 2, 2, 0, 0, 0]
+    assert "cal_setting" not in parameters["properties"][0]
+
+
+def test_single_group_stays_in_place(tmp_path):
+    stage_confs(tmp_path, 3)
+    staged = stage_kpoint_groups(tmp_path, {"properties": []}, 0.3)
+    assert [ii[0] for ii in staged] == ['./']
+    assert (tmp_path / 'returns').is_dir()
+    assert not (tmp_path / RECORD_FILE).exists()
+
+
+def test_groups_move_to_work_dirs(tmp_path):
+    stage_confs(tmp_path, 2, a=4.0)
+    write_poscar(tmp_path / 'returns' / 'conf.000002' / 'POSCAR', a=8.0)
+    (tmp_path / 'INCAR').write_text('ENCUT = 520\n')
+    staged = stage_kpoint_groups(tmp_path, {"properties": [{"type": "eos"}]}, 0.3)
+    assert [ii[0] for ii in staged] == ['./kgrid.000', './kgrid.001']
+    assert not (tmp_path / 'returns').exists()
+    assert sorted(os.listdir(tmp_path / 'kgrid.000' / 'returns')) == ['conf.000000', 'conf.000001']
+    # shared inputs are hard-linked into every group
+    assert os.path.samefile(tmp_path / 'INCAR', tmp_path / 'kgrid.001' / 'INCAR')
+    record = json.loads((tmp_path / RECORD_FILE).read_text())
+    assert record["groups"][1]["confs"] == ['conf.000002']
+    assert set(record["groups"][0]["k_points"]) == {"relaxation", "eos"}
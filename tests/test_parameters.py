@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from parameters import (PROPERTY_TYPES, ParameterError, dump_parameters, layer_parameter_files,
+                        load_parameter_file, merge_parameters, validate_parameters)
+
+DEFAULTS = {
+    "interaction": {"type": "deepmd", "model": "frozen_model.pb", "type_map": {"Al": 0}},
+    "relaxation": {"cal_setting": {"etol": 0, "ftol": 1e-10}},
+    "properties": [{"type": "eos", "vol_step": 0.05}, {"type": "elastic"}],
+}
+
+
+def test_validate():
+    assert validate_parameters(DEFAULTS) is DEFAULTS
+    with pytest.raises(ParameterError) as info:
+        validate_parameters({"structures": "returns/*", "properties": [{"type": "melting"}, {"skip": 1}]})
+    assert info.value.problems == [
+        "$.structures: expected array, got str",
+        f"$.properties[0].type: 'melting' is not one of {list(PROPERTY_TYPES)}",
+        "$.properties[1]: missing `type`",
+        "$.properties[1].skip: expected boolean, got int",
+    ]
+
+
+def test_wrong_scalar_types():
+    with pytest.raises(ParameterError):
+        validate_parameters({"properties": [{"type": "eos", "skip": "yes"}]})
+    with pytest.raises(ParameterError):
+        validate_parameters({"interaction": {"type": True}})
+
+
+def test_merge_properties_by_type_and_suffix():
+    merged = merge_parameters(DEFAULTS, {
+        "relaxation": {"cal_setting": {"etol": 1e-6}},
+        "properties": [{"type": "eos", "vol_step": 0.02}, {"type": "eos", "suffix": "fine", "vol_step": 0.01}],
+    })
+    assert merged["relaxation"]["cal_setting"] == {"etol": 1e-6, "ftol": 1e-10}
+    assert [(ii["type"], ii.get("vol_step")) for ii in merged["properties"]] == [
+        ("eos", 0.02), ("elastic", None), ("eos", 0.01)]
+    assert DEFAULTS["properties"][0]["vol_step"] == 0.05
+
+
+def test_other_interaction_replaces():
+    merged = merge_parameters(DEFAULTS, {"interaction": {"type": "eam_alloy", "model": "Al.eam.alloy"}})
+    assert merged["interaction"] == {"type": "eam_alloy", "model": "Al.eam.alloy"}
+    merged = merge_parameters(DEFAULTS, {"interaction": {"type": "deepmd", "model": "new.pb"}})
+    assert merged["interaction"]["type_map"] == {"Al": 0}
+
+
+def test_layer_parameter_files(tmp_path):
+    first, second = tmp_path / 'first.json', tmp_path / 'second.json'
+    first.write_text(json.dumps({"properties": [{"type": "elastic", "norm_deform": 0.02}]}))
+    second.write_text(json.dumps({"properties": [{"type": "elastic", "shear_deform": 0.02}]}))
+    layered = layer_parameter_files(DEFAULTS, [first, second])
+    assert layered["structures"] == ["returns/conf.*"]
+    assert layered["properties"][1] == {"type": "elastic", "norm_deform": 0.02, "shear_deform": 0.02}
+    second.write_text(json.dumps({"properties": [{"type": "plasticity"}]}))
+    with pytest.raises(ParameterError):
+        layer_parameter_files(DEFAULTS, [second])
+
+
+def test_loaded_files_are_copies(tmp_path):
+    path = tmp_path / 'parameters.json'
+    path.write_text(json.dumps({"relaxation": {"cal_setting": {"etol": 0}}}))
+    load_parameter_file(path)["relaxation"]["cal_setting"]["etol"] = 1
+    assert load_parameter_file(path)["relaxation"]["cal_setting"]["etol"] == 0
+    # a rewritten file is read again
+    path.write_text(json.dumps({"relaxation": {"cal_setting": {"etol": 10}}}))
+    os.utime(path, ns=(1, 1))
+    assert load_parameter_file(path)["relaxation"]["cal_setting"]["etol"] == 10
+
+
+def test_dump_parameters(tmp_path):
+    path = tmp_path / 'parameter_tmp.json'
+    dumped = dump_parameters({"properties": ({"type": "eos"},)}, path)
+    assert dumped == {"properties": [{"type": "eos"}]}
+    assert json.loads(path.read_text()) == dumped
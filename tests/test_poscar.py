@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from conftest import write_poscar
+from poscar import parse_poscar, read_poscar, read_poscars, read_species
+
+
+def test_read_fcc(tmp_path):
+    structure = read_poscar(write_poscar(tmp_path / 'POSCAR', a=4.0))
+    assert structure.species == ('Al',)
+    assert structure.natoms == 4
+    assert structure.volume == pytest.approx(64.0)
+    assert structure.frac_coords().shape == (4, 3)
+    assert structure.selective is None
+
+
+def test_mmap_matches_read(tmp_path):
+    path = write_poscar(tmp_path / 'POSCAR')
+    plain, mapped = read_poscar(path), read_poscar(path, use_mmap=True)
+    assert np.array_equal(plain.lattice, mapped.lattice)
+    assert np.array_equal(plain.coords, mapped.coords)
+
+
+def test_negative_scale_is_volume(tmp_path):
+    structure = read_poscar(write_poscar(tmp_path / 'POSCAR', a=1.0, scale=-27.0))
+    assert structure.volume == pytest.approx(27.0)
+    assert structure.lattice[0, 0] == pytest.approx(3.0)
+
+
+def test_cartesian_and_selective_dynamics():
+    buf = b"""Fe_pv bcc
+2.0
+1.0 0.0 0.0
+0.0 1.0 0.0
+0.0 0.0 1.0
+Fe_pv
+2
+Selective dynamics
+Cartesian
+0.0 0.0 0.0 T T F
+0.5 0.5 0.5 F F F
+"""
+    structure = parse_poscar(buf)
+    assert structure.species == ('Fe',)
+    assert not structure.direct
+    assert np.allclose(structure.cart_coords()[1], [1.0, 1.0, 1.0])
+    assert np.allclose(structure.frac_coords()[1], [0.5, 0.5, 0.5])
+    assert structure.selective.tolist() == [[True, True, False], [False, False, False]]
+
+
+def test_vasp4_species_from_title(tmp_path):
+    path = tmp_path / 'POSCAR'
+    path.write_text('Cu Zn\n1.0\n3 0 0\n0 3 0\n0 0 3\n1 1\nDirect\n0 0 0\n0.5 0.5 0.5\n')
+    assert read_species(path) == ('Cu', 'Zn')
+    structure = read_poscar(path)
+    assert structure.counts.tolist() == [1, 1]
+    assert structure.symbols.tolist() == ['Cu', 'Zn']
+
+
+def test_missing_coordinates(tmp_path):
+    path = tmp_path / 'POSCAR'
+    path.write_text(write_poscar(tmp_path / 'full').read_text().rsplit('\n', 3)[0] + '\n')
+    with pytest.raises(ValueError):
+        read_poscar(path)
+
+
+def test_read_poscars_keeps_order(tmp_path):
+    paths = [write_poscar(tmp_path / f'POSCAR.{ii}', a=3.0 + ii / 10) for ii in range(40)]
+    structures = read_poscars(paths, workers=4)
+    assert [ii.lattice[0, 0] for ii in structures] == pytest.approx([3.0 + ii / 10 for ii in range(40)])
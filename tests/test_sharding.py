@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from conftest import stage_confs
+from sharding import (RECORD_FILE, aggregate_status, estimate_atoms, estimate_nodes, estimate_property_tasks,
+                      read_record, read_workflow_log, record_submission, shard_workdir, staged_confs)
+
+PARAMETERS = {"relaxation": {}, "properties": [{"type": "vacancy"}]}
+
+
+@pytest.mark.parametrize('prop, tasks', [
+    ({"type": "eos", "vol_start": 0.9, "vol_end": 1.1, "vol_step": 0.1}, 3),
+    ({"type": "elastic"}, 24),
+    ({"type": "surface", "max_miller": 2}, 9),
+    ({"type": "surface", "max_miller": 4}, 192),
+    ({"type": "gamma", "n_steps": 4}, 5),
+    ({"type": "elastic", "skip": True}, 0),
+])
+def test_estimate_property_tasks(prop, tasks):
+    assert estimate_property_tasks(prop) == tasks
+
+
+def test_estimate_atoms():
+    assert estimate_atoms({"type": "vacancy", "supercell_size": [2, 2, 3]}, 4, 4.0) == 48
+    # 10 Angstrom of slab over a 4 Angstrom cell takes three layers
+    assert estimate_atoms({"type": "surface", "min_slab_size": 10, "max_miller": 2}, 4, 4.0) == 24
+
+
+def test_estimate_nodes():
+    # relaxation and vacancy per configuration, plus the steps around them
+    assert estimate_nodes(PARAMETERS, 10) == 26
+    assert estimate_nodes(PARAMETERS, 10, group_size=4) == 11
+
+
+def test_small_study_is_not_sharded(tmp_path):
+    stage_confs(tmp_path, 4)
+    assert shard_workdir(tmp_path, PARAMETERS, 4, max_nodes=100) == (['./'], 14)
+    assert not (tmp_path / RECORD_FILE).exists()
+
+
+def test_shard_workdir(tmp_path):
+    stage_confs(tmp_path, 10)
+    (tmp_path / 'frozen_model.pb').write_bytes(b'model')
+    work_dirs, nodes = shard_workdir(tmp_path, PARAMETERS, 10, max_nodes=10)
+    assert nodes == 26
+    assert work_dirs == ['./shard.000', './shard.001', './shard.002']
+    assert not (tmp_path / 'returns').exists()
+    assert [len(os.listdir(tmp_path / ii / 'returns')) for ii in work_dirs] == [4, 4, 2]
+    assert os.path.samefile(tmp_path / 'frozen_model.pb', tmp_path / 'shard.002' / 'frozen_model.pb')
+    record = read_record(tmp_path)
+    assert record["shards"][0]["confs"] == ['conf.000000', 'conf.000003']
+    assert [ii["estimated_nodes"] for ii in record["shards"]] == [14, 14, 10]
+    assert len(staged_confs([tmp_path / ii for ii in work_dirs])) == 10
+
+
+def test_min_shards_spreads_small_studies(tmp_path):
+    stage_confs(tmp_path, 3)
+    work_dirs, _ = shard_workdir(tmp_path, PARAMETERS, 3, max_nodes=None, min_shards=2)
+    assert len(work_dirs) == 2
+
+
+def test_record_submission(tmp_path):
+    stage_confs(tmp_path, 4)
+    shard_workdir(tmp_path, PARAMETERS, 4, max_nodes=None, min_shards=2)
+    (tmp_path / 'shard.000' / '.workflow.log').write_text('relax-abc submit\n\n')
+    assert read_workflow_log(tmp_path / 'shard.000') == ['relax-abc']
+    record = record_submission(tmp_path)
+    assert [ii["status"] for ii in record["shards"]] == ["submitted", "failed"]
+    assert record["status"] == "failed"
+    assert json.loads((tmp_path / RECORD_FILE).read_text()) == record
+
+
+def test_aggregate_status():
+    assert aggregate_status(["Succeeded", "Running"]) == "Running"
+    assert aggregate_status(["Succeeded", "Succeeded"]) == "Succeeded"
+    assert aggregate_status(["Succeeded", "Skipped"]) == "Unknown"
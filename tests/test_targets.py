@@ -0,0 +1,90 @@
+import json
+import math
+
+import pytest
+
+from conftest import stage_confs
+from sharding import read_record
+from targets import (QuotaLedger, assign_shards, parse_target, parse_targets, plan_submissions, plan_subdirs,
+                     target_config)
+
+PARAMETERS = {"relaxation": {}, "properties": [{"type": "vacancy"}]}
+
+
+def config_dict():
+    return {
+        "bohrium_config": {"projectId": "0", "project_id": "0"},
+        "machine": {"remote_profile": {"program_id": 0, "input_data": {"platform": "ali", "scass_type": "c8"}}},
+    }
+
+
+def test_parse_target():
+    assert parse_target('123:ali:c32_m64_cpu:2') == {
+        "project_id": "123", "platform": "ali", "scass_type": "c32_m64_cpu", "weight": 2.0}
+    # a machine type containing colons has no weight
+    assert parse_target('123:ali:1 * NVIDIA:V100')["scass_type"] == '1 * NVIDIA:V100'
+    assert parse_targets(None) == []
+    for spec in ('123:ali', '123:ali:c8:0'):
+        with pytest.raises(ValueError):
+            parse_target(spec)
+
+
+def test_ledger(tmp_path):
+    path = tmp_path / 'ledger.json'
+    path.write_text(json.dumps({"projects": {"1": {"remaining": 100}}}))
+    ledger = QuotaLedger(path, tmp_path / 'out.json')
+    assert ledger.remaining(2) == math.inf
+    ledger.reserve(1, 30)
+    ledger.reserve(2, 30)
+    ledger.save()
+    # the uploaded ledger is never rewritten
+    assert json.loads(path.read_text())["projects"]["1"]["remaining"] == 100
+    assert json.loads((tmp_path / 'out.json').read_text()) == {
+        "projects": {"1": {"remaining": 70, "reserved": 30}}}
+
+
+def test_assign_shards_by_weight_and_quota(tmp_path):
+    shards = [{"work_dir": f'shard.{ii}', "estimated_nodes": 10} for ii in range(4)]
+    targets = parse_targets(['1:ali:c8:3', '2:ali:c8:1'])
+    assignment = assign_shards(shards, targets, QuotaLedger())
+    assert sorted(assignment.values()) == [0, 0, 0, 1]
+
+    path = tmp_path / 'ledger.json'
+    path.write_text(json.dumps({"projects": {"1": {"remaining": 5}, "2": {"remaining": 100}}}))
+    assignment = assign_shards(shards, targets, QuotaLedger(path))
+    assert set(assignment.values()) == {1}
+
+
+def test_target_config():
+    config = config_dict()
+    targeted = target_config(config, parse_target('42:sugon:c16'))
+    assert targeted["bohrium_config"]["project_id"] == "42"
+    assert targeted["machine"]["remote_profile"]["program_id"] == 42
+    assert targeted["machine"]["remote_profile"]["input_data"]["scass_type"] == "c16"
+    assert config == config_dict()
+    assert target_config(config, None) is config
+
+
+def test_plan_without_targets(tmp_path):
+    config = config_dict()
+    assert plan_submissions(tmp_path, ['./'], config, []) == [(None, config, ['./'])]
+
+
+def test_plan_submissions(tmp_path):
+    from sharding import shard_workdir
+    stage_confs(tmp_path, 4)
+    work_dirs, _ = shard_workdir(tmp_path, PARAMETERS, 4, max_nodes=None, min_shards=2)
+    submissions = plan_submissions(tmp_path, work_dirs, config_dict(), parse_targets(['1:ali:c8', '2:ali:c8']))
+    assert sorted(dirs[0] for _, _, dirs in submissions) == work_dirs
+    assert [ii["target"]["project_id"] for ii in read_record(tmp_path)["shards"]] == ["1", "2"]
+
+
+def test_plan_subdirs(tmp_path):
+    for sub_dir in ('kgrid.000', 'kgrid.001'):
+        stage_confs(tmp_path / sub_dir, 2)
+    groups = [('./kgrid.000', PARAMETERS), ('./kgrid.001', PARAMETERS)]
+    submissions, n_dirs, nodes = plan_subdirs(tmp_path, groups, config_dict(), [])
+    assert n_dirs == 2
+    assert nodes == 2 * 10
+    assert [(dirs, parameters) for _, _, dirs, parameters in submissions] == [
+        (['./kgrid.000'], [PARAMETERS]), (['./kgrid.001'], [PARAMETERS])]
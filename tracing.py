@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class Span:
+    __slots__ = ("args",)
+
+    def __init__(self, **args):
+        self.args = dict(args)
+        self.args.setdefault("files", 0)
+        self.args.setdefault("bytes", 0)
+
+    def count(self, path):
+        self.args["files"] += 1
+        self.args["bytes"] += os.path.getsize(path)
+
+    def copy(self, src, dst, **kwargs):
+        # usable as `copy_function` of shutil.copytree
+        res = shutil.copy2(src, dst, **kwargs)
+        self.count(res)
+        return res
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+
+class Tracer:
+    def __init__(self, category):
+        self.category = category
+        self.events = []
+        self.pid = os.getpid()
+        self._t0 = time.perf_counter_ns()
+        self._wall0 = time.time()
+
+    @contextmanager
+    def span(self, name, **args):
+        span = Span(**args)
+        start = time.perf_counter_ns()
+        try:
+            yield span
+        finally:
+            end = time.perf_counter_ns()
+            self.events.append({
+                "name": name,
+                "cat": self.category,
+                "ph": "X",
+                "ts": (start - self._t0) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": span.args,
+            })
+
+    def summary(self):
+        return {ee["name"]: round(ee["dur"] / 1000, 1) for ee in self.events}
+
+    def dump(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        trace = {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"category": self.category, "start_time": self._wall0},
+        }
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=1)
+        return path
@@ -0,0 +1,104 @@
+from pathlib import Path
+import re
+
+from poscar import read_species
+from parameters import load_parameter_file
+
+
+class ConsistencyError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__('pre-submission check failed:\n  ' + '\n  '.join(problems))
+
+
+def collect_species(configurations, problems):
+    elements = set()
+    # many uploads share a few species orderings, keep only distinct ones
+    orderings = {}
+    for ii in configurations:
+        try:
+            species = read_species(ii)
+        except (OSError, ValueError, IndexError) as e:
+            problems.append(str(e))
+            continue
+        orderings.setdefault(species, Path(ii).name)
+    for ii in orderings:
+        elements.update(ii)
+    return elements, orderings
+
+
+def split_elements(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(ii) for ii in value]
+    return [ii for ii in re.split(r'[\s,]+', str(value)) if ii]
+
+
+def parameter_overrides(parameter_files):
+    interaction = {}
+    insert_eles = []
+    for ii in parameter_files or []:
+        j = load_parameter_file(ii)
+        interaction.update(j.get("interaction", {}))
+        for prop in j.get("properties", []):
+            if prop.get("type") == "interstitial" and not prop.get("skip", False):
+                insert_eles += split_elements(prop.get("insert_ele"))
+    return interaction, insert_eles
+
+
+def check_map(name, mapping, elements, problems):
+    if not mapping:
+        problems.append(f'`{name}` is empty')
+        return
+    for ele in sorted(elements - set(mapping)):
+        problems.append(f'element {ele} has no entry in `{name}`')
+
+
+def check_files(name, mapping, uploaded, problems):
+    uploaded = {Path(ii).name for ii in uploaded or []}
+    for ele, fname in (mapping or {}).items():
+        if Path(fname).name not in uploaded:
+            problems.append(f'`{name}` maps {ele} to {fname}, which was not uploaded')
+
+
+def check_consistency(opts, backend):
+    problems = []
+    elements, orderings = collect_species(opts.configurations, problems)
+
+    insert_eles = split_elements(opts.insert_ele) if opts.select_interstitial else []
+    interaction = {}
+    if opts.parameter_files:
+        interaction, file_insert_eles = parameter_overrides(opts.parameter_files)
+        insert_eles += file_insert_eles
+    all_elements = elements | set(insert_eles)
+
+    maps = {}
+    if backend == 'lammps':
+        maps["type_map"] = interaction.get("type_map", opts.type_map)
+        check_map('type_map', maps["type_map"], all_elements, problems)
+    elif backend == 'vasp':
+        maps["potcar_map"] = interaction.get("potcars", opts.potcar_map)
+        check_map('potcar_map', maps["potcar_map"], all_elements, problems)
+        check_files('potcar_map', maps["potcar_map"], opts.potcar, problems)
+    elif backend == 'abacus':
+        maps["potential_map"] = interaction.get("potcars", opts.potential_map)
+        maps["orbfile_map"] = interaction.get("orb_files", opts.orbfile_map)
+        maps["deepks_map"] = interaction.get("deepks_desc", opts.deepks_map)
+        check_map('potential_map', maps["potential_map"], all_elements, problems)
+        check_files('potential_map', maps["potential_map"], opts.potentials, problems)
+        if maps["orbfile_map"]:
+            check_map('orbfile_map', maps["orbfile_map"], all_elements, problems)
+            check_files('orbfile_map', maps["orbfile_map"], opts.orbfiles, problems)
+        if maps["deepks_map"] and isinstance(maps["deepks_map"], dict):
+            check_files('deepks_map', maps["deepks_map"], opts.deepks, problems)
+    else:
+        raise ValueError(f'unknown backend {backend}')
+
+    if problems:
+        raise ConsistencyError(problems)
+    return {
+        "elements": all_elements,
+        "orderings": orderings,
+        "maps": maps,
+    }
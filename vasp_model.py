@@ -31,6 +31,7 @@ interstitial_group = ui.Group('Interstitial Formation Energy', 'Interstitial For
 vacancy_group = ui.Group('Vacancy Formation Energy', 'Vacancy Formation Energy')
 gamma_group = ui.Group('GSFE Curve (Gamma Line)', 'GSFE Curve (Gamma Line)')
 phonon_group = ui.Group('Phonon Spectra', 'Phonon Spectra')
+sweep_group = ui.Group('Parameter Sweep', 'Evaluate properties over a grid of settings')
 
 
 class InjectConfig(BaseModel):
@@ -59,9 +60,9 @@ class UploadFiles(BaseModel):
     potcar: List[InputFilePath] = \
         Field(..., description='VASP POSCAR list (name differently for multiple element types)', )
     parameter_files: List[InputFilePath] = \
-        Field(None, ftypes=['json'], max_file_count=2,
-            description='(Optional) Specify parameter `JSON` files for APEX to override the default settings,\
-               (Do not upload if want to do setting manually in the later UI page)',
+        Field(None, ftypes=['json'],
+            description='(Optional) Specify parameter `JSON` files for APEX to override the settings of the later UI page,\
+               (files are merged in upload order, later files take precedence)',
         )
 
 
@@ -82,6 +83,10 @@ class GlobalConfig(BaseModel):
         default="c16_m32_cpu", 
         description='Bohrium machine node type for VASP calculation'
     )
+    auto_parallel: Boolean = Field(
+        default=False,
+        description='Set the MPI rank count of `vasp_run_command` from `scass_type` and write KPAR/NCORE/NSIM into the INCAR of each property from its k-points and bands'
+    )
     group_size: Int = Field(
         default=1,
         ge=1,
@@ -92,6 +97,23 @@ class GlobalConfig(BaseModel):
         ge=1,
         description='For multi tasks per parallel group, the pool size of multiprocessing pool to handle each task (1 for serial, -1 for infinity)'
     )
+    pack_workdir: Boolean = Field(
+        default=False,
+        description='Pack the staged workdir into one compressed archive with an index before submission, and copy out only the files written after it'
+    )
+    max_workflow_nodes: Int = Field(
+        default=5000,
+        ge=0,
+        description='Split configurations into several concurrently submitted workflows once the estimated node count of one workflow exceeds this (0 to disable)'
+    )
+    submission_targets: List[String] = Field(
+        default=None,
+        description='(Optional) Spread workflows over several Bohrium targets, one `project_id:platform:scass_type[:weight]` per entry'
+    )
+    quota_ledger: InputFilePath = Field(
+        default=None,
+        description='(Optional) JSON ledger of remaining quota per Bohrium project to balance `submission_targets` against, the updated ledger is written to `workdir/quota_ledger.json`'
+    )
 
 
 
@@ -693,6 +715,14 @@ class PhononAdvance(BaseModel):
     )
 
 
+@sweep_group
+class SweepOptions(BaseModel):
+    sweep: Dict[String, String] = Field(
+        default=None,
+        description='(Optional) Property fields to sweep, field name -> JSON list of values, e.g. `vol_step`: `[0.02, 0.05]`; the relaxation runs once and every combination becomes a property variant of the same workflow'
+    )
+
+
 class VaspModel(
     InjectConfig, 
     UploadFiles, 
@@ -720,6 +750,7 @@ class VaspModel(
     PhononOptions,
     PhononParameters,
     PhononAdvance,
+    SweepOptions,
     BaseModel
 ):
     output_directory: OutputDirectory = Field(default='./outputs')
@@ -0,0 +1,155 @@
+from pathlib import Path
+import json
+import math
+import re
+
+from poscar import read_poscars
+from kpoints import kpoint_grids, irreducible_count
+from sharding import estimate_atoms, staged_confs
+
+REPORT_FILE = 'parallel_settings.json'
+# VASP applies this when neither INCAR nor the property sets KSPACING
+DEFAULT_KSPACING = 0.5
+# fewer bands than this per band group and the FFT communication dominates
+MIN_BANDS_PER_GROUP = 8
+# blocked RMM-DIIS pays off once there are many bands
+NSIM_LARGE, LARGE_BANDS = 8, 256
+ZVAL = re.compile(r'ZVAL\s*=\s*([-+.\dEe]+)')
+
+
+def read_incar(text):
+    tags = {}
+    for line in text.splitlines():
+        for statement in re.split(r'[!#]', line, 1)[0].split(';'):
+            if '=' in statement:
+                key, value = statement.split('=', 1)
+                tags[key.strip().upper()] = value.strip()
+    return tags
+
+
+def read_zval(path):
+    # the first ZVAL of the POTCAR header, valence electrons per atom
+    with open(path, 'r') as f:
+        for line in f:
+            match = ZVAL.search(line)
+            if match:
+                return float(match.group(1))
+    raise ValueError(f'{path}: no ZVAL in POTCAR header')
+
+
+def estimate_bands(nelect, nions):
+    # VASP's default NBANDS for a non-spin-polarized run
+    return max(math.ceil((nelect + 2) / 2) + max(nions // 2, 3), math.ceil(0.6 * nelect))
+
+
+def _divisors(n):
+    return [ii for ii in range(1, n + 1) if n % ii == 0]
+
+
+def decompose(ranks, nkpts, nbands):
+    """KPAR, NCORE and NSIM for `ranks` MPI ranks, `nkpts` irreducible k-points and `nbands` bands."""
+    kpar = max(ii for ii in _divisors(ranks) if ii <= nkpts)
+    per_kgroup = ranks // kpar
+    candidates = _divisors(per_kgroup)
+    # NCORE near the square root balances FFT and band parallelism ...
+    ncore = min(candidates, key=lambda ii: abs(ii - math.sqrt(per_kgroup)))
+    # ... unless that leaves band groups with too few bands
+    max_groups = max(1, nbands // MIN_BANDS_PER_GROUP)
+    ncore = max(ncore, min(ii for ii in candidates if per_kgroup // ii <= max_groups))
+    return {
+        "KPAR": kpar,
+        "NCORE": ncore,
+        "NSIM": NSIM_LARGE if nbands >= LARGE_BANDS else 4,
+    }
+
+
+class CellSummary:
+    """Electrons, ions and reciprocal lengths of the largest configuration, the one sizing the settings."""
+
+    def __init__(self, conf_files, potcar_map, potcar_dir='.'):
+        structures = read_poscars(list(conf_files))
+        zvals = {}
+        largest = max(structures, key=lambda ii: ii.natoms)
+        nelect = 0.0
+        for ele, count in zip(largest.species, largest.counts):
+            if ele not in zvals:
+                zvals[ele] = read_zval(Path(potcar_dir) / Path(potcar_map[ele]).name)
+            nelect += zvals[ele] * int(count)
+        self.natoms = largest.natoms
+        self.nelect = nelect
+        self.cell_length = largest.volume ** (1 / 3)
+        self.structure = largest
+
+    def settings(self, prop, base, ranks):
+        cal_setting = prop.get("cal_setting", {})
+        kspacing = float(cal_setting.get("kspacing") or base.get("KSPACING") or DEFAULT_KSPACING)
+        atoms = estimate_atoms(prop, self.natoms, self.cell_length)
+        grid = kpoint_grids([self.structure], [prop], kspacing)[0, 0]
+        nkpts = int(irreducible_count(grid))
+        nbands = estimate_bands(self.nelect * atoms / self.natoms, atoms)
+        tags = decompose(ranks, nkpts, nbands)
+        report = {"atoms": atoms, "kpoints": nkpts, "grid": grid.tolist(), "bands": nbands}
+        return tags, report
+
+
+def format_tags(tags):
+    return '\n'.join(f'{key} = {value}' for key, value in tags.items()) + '\n'
+
+
+def apply_parallel_settings(parameter_dict, opts, ranks):
+    """Write KPAR/NCORE/NSIM into the interaction INCAR and into the INCARs of the properties.
+
+    Only INCARs the user supplied through `input_prop` are edited, a property without one runs
+    with the interaction INCAR and APEX's own ISIF/NSW/KSPACING handling. The interaction INCAR
+    (`INCAR.relax`) is shared by the relaxation and those properties, so its tags fit the one
+    with the fewest k-points and bands. Tags already set in an INCAR are kept.
+    Returns {"relaxation" or "<type>[_<suffix>]": settings} for the log.
+    """
+    interaction = parameter_dict["interaction"]
+    base_text = Path(interaction["incar"]).read_text()
+    base = read_incar(base_text)
+    cells = CellSummary(staged_confs(), interaction.get("potcars", opts.potcar_map))
+    report = {}
+
+    def keep_given(tags, given):
+        if any(tag in given for tag in ("NCORE", "NPAR")):
+            tags.pop("NCORE")
+        return {key: value for key, value in tags.items() if key not in given}
+
+    tasks = [('relaxation', dict(parameter_dict.get("relaxation", {}), type="relaxation"))]
+    for prop in parameter_dict.get("properties", []):
+        tasks.append((prop["type"] + (f'_{prop["suffix"]}' if prop.get("suffix") else ''), prop))
+    inherit = {name: cells.settings(prop, base, ranks)[1] for name, prop in tasks
+               if name == 'relaxation' or not prop.get("cal_setting", {}).get("input_prop")}
+    shared = keep_given(decompose(ranks, min(ii["kpoints"] for ii in inherit.values()),
+                                  min(ii["bands"] for ii in inherit.values())), base)
+    Path('INCAR.relax').write_text(base_text.rstrip('\n') + '\n' + format_tags(shared))
+    interaction["incar"] = 'INCAR.relax'
+
+    for name, prop in tasks:
+        if name in inherit:
+            report[name] = dict(inherit[name], incar='INCAR.relax', **shared)
+            continue
+        filename = prop["cal_setting"]["input_prop"]
+        if not Path(filename).exists():
+            print(f'warning: {name} INCAR {filename} not found, parallel settings not applied')
+            continue
+        text = Path(filename).read_text()
+        given = read_incar(text)
+        tags, info = cells.settings(prop, given, ranks)
+        tags = keep_given(tags, given)
+        Path(filename).write_text(text.rstrip('\n') + '\n' + format_tags(tags))
+        report[name] = dict(info, **tags)
+    with open(REPORT_FILE, 'w') as f:
+        json.dump({"ranks": ranks, "tasks": report}, f, indent=2)
+    return report
+
+
+def format_report(report, ranks):
+    lines = []
+    for name, entry in report.items():
+        tags = ', '.join(f'{key} = {entry[key]}' for key in ("KPAR", "NCORE", "NSIM") if key in entry)
+        shared = f' (shared {entry["incar"]})' if "incar" in entry else ''
+        lines.append(f'{name}: ~{entry["atoms"]} atoms, {entry["kpoints"]} k-points, '
+                     f'{entry["bands"]} bands on {ranks} ranks -> {tags or "set in INCAR"}{shared}')
+    return '\n'.join(lines)
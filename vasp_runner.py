@@ -4,6 +4,18 @@ import shutil
 import json
 from monty.serialization import loadfn
 from apex.submit import submit_workflow
+from tracing import Tracer
+from parameters import layer_parameter_files, dump_parameters
+from sharding import shard_workdir, record_submission
+from targets import LEDGER_FILE, QuotaLedger, parse_targets, plan_submissions, target_config
+from checkpoint import Checkpoint, input_hash
+from archive import pack_workdir, copy_unpacked
+from validation import check_consistency
+from property_registry import build_relaxation, build_properties
+from sweep import sweep_properties
+from staging import prune_files, format_bytes
+from machine import node_cores, set_mpi_ranks
+from vasp_resources import apply_parallel_settings, format_report
 from vasp_model import VaspModel
 
 
@@ -43,7 +55,8 @@ def get_global_config(opts: VaspModel):
         "run_image_name": opts.vasp_image_name,
         "group_size": opts.group_size,
         "pool_size": opts.pool_size,
-        "run_command": opts.vasp_run_command,
+        "run_command": set_mpi_ranks(opts.vasp_run_command, node_cores(opts.scass_type, opts.submission_targets)) \
+            if opts.auto_parallel else opts.vasp_run_command,
         "is_bohrium_dflow": True,
     }
     json.dump(global_config, open('global_config_tmp.json', 'w'), indent=2)
@@ -63,252 +76,13 @@ def get_interaction(opts: VaspModel):
 
 
 def get_relaxation(opts: VaspModel):
-    relaxation = {}
-    relaxation["cal_setting"] = {
-        "kgamma": opts.kgamma,
-        "relax_pos": opts.relax_pos,
-        "relax_shape": opts.relax_shape,
-        "relax_vol": opts.relax_vol,
-    }
-    if opts.ediff:
-        relaxation["cal_setting"]["ediff"] = opts.ediff
-    if opts.ediffg:
-        relaxation["cal_setting"]["ediffg"] = opts.ediffg
-    if opts.encut:
-        relaxation["cal_setting"]["encut"] = opts.encut
-    if opts.kspacing:
-        relaxation["cal_setting"]["kspacing"] = opts.kspacing
-    return relaxation
+    return build_relaxation(opts, 'vasp')
 
 
 def get_properties(opts: VaspModel):
-    properties = []
-
-    #EOS
-    if opts.select_eos:
-        eos_params = {
-            "type": "eos",
-            "skip": False,
-            "vol_start": opts.vol_start,
-            "vol_end": opts.vol_end,
-            "vol_step": opts.vol_step,
-            "vol_abs": opts.vol_abs,
-            "cal_type": opts.eos_cal_type
-        }
-        if opts.custom_eos_calc:
-            eos_params["cal_setting"] = {
-                "kgamma": opts.eos_kgamma,
-                "relax_pos": opts.eos_relax_pos,
-                "relax_shape": opts.eos_relax_shape,
-                "relax_vol": opts.eos_relax_vol,
-            }
-            if opts.eos_ediff:
-                eos_params["cal_setting"]["ediff"] = opts.eos_ediff
-            if opts.eos_ediffg:
-                eos_params["cal_setting"]["ediffg"] = opts.eos_ediffg
-            if opts.eos_encut:
-                eos_params["cal_setting"]["encut"] = opts.eos_encut
-            if opts.eos_kspacing:
-                eos_params["cal_setting"]["kspacing"] = opts.eos_kspacing
-
-            if opts.eos_incar:
-                with open('INCAR.eos', 'w') as f:
-                    f.write(opts.eos_incar)
-                eos_params["cal_setting"]["input_prop"] = "INCAR.eos"
-        properties.append(eos_params)
-
-    # Elasitc
-    if opts.select_elastic:
-        elastic_params = {
-            "type": "elastic",
-            "skip": False,
-            "norm_deform": opts.norm_deform,
-            "shear_deform": opts.shear_deform,
-            "cal_type": opts.elastic_cal_type,
-            "conventional": opts.conventional,
-            "ieee": opts.ieee,
-            "modulus_type": opts.modulus_type
-        }
-        if opts.custom_elastic_calc:
-            elastic_params["cal_setting"] = {
-                "kgamma": opts.eos_kgamma,
-                "relax_pos": opts.eos_relax_pos,
-                "relax_shape": opts.eos_relax_shape,
-                "relax_vol": opts.eos_relax_vol,
-            }
-            if opts.elastic_ediff:
-                elastic_params["cal_setting"]["ediff"] = opts.elastic_ediff
-            if opts.elastic_ediffg:
-                elastic_params["cal_setting"]["ediffg"] = opts.elastic_ediffg
-            if opts.elastic_encut:
-                elastic_params["cal_setting"]["encut"] = opts.elastic_encut
-            if opts.elastic_kspacing:
-                elastic_params["cal_setting"]["kspacing"] = opts.elastic_kspacing
-            
-            if opts.elastic_incar:
-                with open('INCAR.elastic', 'w') as f:
-                    f.write(opts.elastic_incar)
-                elastic_params["cal_setting"]["input_prop"] = "INCAR.elastic"
-        properties.append(elastic_params)
-    
-    # Surface
-    if opts.select_surface:
-        surface_params = {
-            "type": "surface",
-            "skip": False,
-            "max_miller": opts.max_miller,
-            "min_slab_size": opts.min_slab_size,
-            "min_vacuum_size": opts.min_vacuum_size,
-            "pert_xz": opts.pert_xz,
-            "cal_type": opts.surface_cal_type,
-        }
-        if opts.custom_surface_calc:
-            surface_params["cal_setting"] = {
-                "kgamma": opts.surface_kgamma,
-                "relax_pos": opts.surface_relax_pos,
-                "relax_shape": opts.surface_relax_shape,
-                "relax_vol": opts.surface_relax_vol,
-            }
-            if opts.surface_ediff:
-                surface_params["cal_setting"]["ediff"] = opts.surface_ediff
-            if opts.surface_ediffg:
-                surface_params["cal_setting"]["ediffg"] = opts.surface_ediffg
-            if opts.surface_encut:
-                surface_params["cal_setting"]["encut"] = opts.surface_encut
-            if opts.surface_kspacing:
-                surface_params["cal_setting"]["kspacing"] = opts.surface_kspacing
-            
-            if opts.surface_incar:
-                with open('INCAR.surface', 'w') as f:
-                    f.write(opts.surface_incar)
-                surface_params["cal_setting"]["input_prop"] = "INCAR.surface"
-        properties.append(surface_params)
-
-    # Interstitial
-    if opts.select_interstitial:
-        interstitial_params = {
-            "type": "interstitial",
-            "skip": False,
-            "supercell_size": opts.interstitial_supercell_size,
-            "insert_ele": opts.insert_ele,
-            "cal_type": opts.interstitial_cal_type,
-        }
-        if opts.custom_interstitial_calc:
-            interstitial_params["cal_setting"] = {
-                "kgamma": opts.interstitial_kgamma,
-                "relax_pos": opts.interstitial_relax_pos,
-                "relax_shape": opts.interstitial_relax_shape,
-                "relax_vol": opts.interstitial_relax_vol,
-            }
-            if opts.interstitial_ediff:
-                interstitial_params["cal_setting"]["ediff"] = opts.interstitial_ediff
-            if opts.interstitial_ediffg:
-                interstitial_params["cal_setting"]["ediffg"] = opts.interstitial_ediffg
-            if opts.interstitial_encut:
-                interstitial_params["cal_setting"]["encut"] = opts.interstitial_encut
-            if opts.interstitial_kspacing:
-                interstitial_params["cal_setting"]["kspacing"] = opts.interstitial_kspacing
-            
-            if opts.interstitial_incar:
-                with open('INCAR.interstitial', 'w') as f:
-                    f.write(opts.interstitial_incar)
-                interstitial_params["cal_setting"]["input_prop"] = "INCAR.interstitial"
-        properties.append(interstitial_params)
-
-    # Vacancy
-    if opts.select_vacancy:
-        vacancy_params = {
-            "type": "vacancy",
-            "skip": False,
-            "supercell_size": opts.vacancy_supercell_size,
-            "cal_type": opts.vacancy_cal_type,
-        }
-        if opts.custom_vacancy_calc:
-            vacancy_params["cal_setting"] = {
-                "kgamma": opts.vacancy_kgamma,
-                "relax_pos": opts.vacancy_relax_pos,
-                "relax_shape": opts.vacancy_relax_shape,
-                "relax_vol": opts.vacancy_relax_vol,
-            }
-            if opts.vacancy_ediff:
-                vacancy_params["cal_setting"]["ediff"] = opts.vacancy_ediff
-            if opts.vacancy_ediffg:
-                vacancy_params["cal_setting"]["ediffg"] = opts.vacancy_ediffg
-            if opts.vacancy_encut:
-                vacancy_params["cal_setting"]["encut"] = opts.vacancy_encut
-            if opts.vacancy_kspacing:
-                vacancy_params["cal_setting"]["kspacing"] = opts.vacancy_kspacing
-            
-            if opts.vacancy_incar:
-                with open('INCAR.vacancy', 'w') as f:
-                    f.write(opts.vacancy_incar)
-                vacancy_params["cal_setting"]["input_prop"] = "INCAR.vacancy"  
-        properties.append(vacancy_params)
-    
-    # Vacancy
-    if opts.select_gamma:
-        gamma_params = {
-            "type": "gamma",
-            "skip": False,
-            "plane_miller": opts.plane_miller,
-            "slip_direction": opts.slip_direction,
-            "slip_length": opts.slip_length,
-            "plane_shift": opts.plane_shift,
-            "n_steps": opts.gamma_n_steps,
-            "supercell_size": opts.gamma_supercell_size,
-            "vacuum_size": opts.gamma_vacuum_size,
-            "add_fix": [
-                "true" if opts.add_fix_x else "false", 
-                "true" if opts.add_fix_y else "false", 
-                "true" if opts.add_fix_z else "false"
-                ],
-            "cal_type": opts.gamma_cal_type,
-        }
-        if opts.custom_gamma_calc:
-            gamma_params["cal_setting"] = {
-                "kgamma": opts.gamma_kgamma,
-                "relax_pos": opts.gamma_relax_pos,
-                "relax_shape": opts.gamma_relax_shape,
-                "relax_vol": opts.gamma_relax_vol,
-            }
-            if opts.gamma_ediff:
-                gamma_params["cal_setting"]["ediff"] = opts.gamma_ediff
-            if opts.gamma_ediffg:
-                gamma_params["cal_setting"]["ediffg"] = opts.gamma_ediffg
-            if opts.gamma_encut:
-                gamma_params["cal_setting"]["encut"] = opts.gamma_encut
-            if opts.gamma_kspacing:
-                gamma_params["cal_setting"]["kspacing"] = opts.gamma_kspacing
-            
-            if opts.gamma_incar:
-                with open('INCAR.gamma', 'w') as f:
-                    f.write(opts.gamma_incar)
-                gamma_params["cal_setting"]["input_prop"] = "INCAR.gamma"
-        properties.append(gamma_params)
-        
-    if opts.select_phonon:
-        phonon_params = {
-            "type": "phonon",
-            "skip": False,
-            "primitive_cell": opts.primitive_cell,
-            "approach": opts.approach,
-            "supercell_size": opts.phonon_supercell_size,
-            "seekpath_from_original": opts.seekpath_from_original,
-            "BAND": opts.band,
-            "BAND_LABELS": opts.band_labels,
-            "MESH": opts.mesh,
-            "PRIMITIVE_AXES": opts.primitive_axes,
-            "BAND_POINTS": opts.band_points,
-            "BAND_CONNECTION": opts.band_connection,
-            "cal_setting": {}
-        }
-        if opts.phonon_incar:
-            with open('INCAR.phonon', 'w') as f:
-                f.write(opts.phonon_incar)
-            phonon_params["cal_setting"]["input_prop"] = "INCAR.phonon"
-        properties.append(phonon_params)
-
-    return properties
+    if opts.sweep:
+        return sweep_properties(opts, 'vasp', opts.sweep)
+    return build_properties(opts, 'vasp')
 
 
 def get_parameter_dict(opts: VaspModel):
@@ -317,9 +91,9 @@ def get_parameter_dict(opts: VaspModel):
         "interaction": get_interaction(opts),
         "relaxation": get_relaxation(opts)
     }
-    if get_properties(opts):
-        parameter_dict["properties"] = get_properties(opts)
-        
+    properties = get_properties(opts)
+    if properties:
+        parameter_dict["properties"] = properties
     return parameter_dict
 
 
@@ -327,60 +101,119 @@ def vasp_runner(opts: VaspModel):
     cwd = Path.cwd()
     parameter_dicts = []
     print('start running....')
+    tracer = Tracer('vasp_runner')
+    trace_file = cwd / opts.output_directory / 'runner_trace.json'
+
+    # fail fast on inconsistent inputs before anything is staged or submitted
+    with tracer.span('consistency_check', files=len(opts.configurations)):
+        species_report = check_consistency(opts, 'vasp')
+
     workdir = cwd / 'workdir'
     returns_dir = workdir / 'returns'
-    if os.path.exists(workdir):
-        shutil.rmtree(workdir)
-    workdir.mkdir()
-    returns_dir.mkdir()
+    # a retry picks up after the last completed phase instead of restaging
+    checkpoint = Checkpoint.resume(workdir, input_hash(opts))
+    count = len(opts.configurations)
+
+    try:
+        if not checkpoint.reached('staged'):
+            # papare input POSCAR
+            with tracer.span('input_staging') as span:
+                count = 0
+                for ii in opts.configurations:
+                    conf_dir = returns_dir / ("conf.%06d" % count)
+                    conf_dir.mkdir()
+                    span.copy(ii, conf_dir/'POSCAR')
+                    count += 1
+
+            # papare INCAR and POTCAR
+            with tracer.span('model_staging') as span:
+                span.copy(opts.incar, workdir)
+                # only stage POTCARs of elements present in the configurations
+                potcars, saved = prune_files(
+                    opts.potcar, species_report["maps"]["potcar_map"], species_report["elements"])
+                for ii in potcars:
+                    span.copy(ii, workdir)
+                span.set(pruned_files=len(opts.potcar) - len(potcars), pruned_bytes=saved)
+                print(f'skip {len(opts.potcar) - len(potcars)} unused POTCAR files ({format_bytes(saved)})')
+
+            checkpoint.complete('staged')
 
-    # papare input POSCAR
-    count = 0
-    for ii in opts.configurations:
         os.chdir(workdir)
-        conf_dir = returns_dir / ("conf.%06d" % count)
-        conf_dir.mkdir()
-        os.chdir(cwd)
-        shutil.copy(ii, conf_dir/'POSCAR')
-        count += 1
-
-    # papare INCAR
-    shutil.copy(opts.incar, workdir)
-
-    # papare POTCAR
-    for ii in opts.potcar:
-        shutil.copy(ii, workdir)
+        # papare global config
+        with tracer.span('config_build'):
+            config_dict = get_global_config(opts)
+
+        if not checkpoint.reached('planned'):
+            # papare parameter files, uploaded files are layered over the UI settings
+            with tracer.span('property_build'):
+                parameter_dict = get_parameter_dict(opts)
+            with tracer.span('parameter_files') as span:
+                parameter_files = [cwd / ii for ii in opts.parameter_files or []]
+                parameter_dict = layer_parameter_files(parameter_dict, parameter_files)
+                parameter_dicts.append(dump_parameters(parameter_dict, 'parameter_tmp.json'))
+                span.set(layers=len(parameter_files))
+                span.count('parameter_tmp.json')
+
+            if opts.auto_parallel:
+                # after layering, uploaded files may change KSPACING or the property INCARs
+                with tracer.span('parallel_settings') as span:
+                    ranks = node_cores(opts.scass_type, opts.submission_targets)
+                    report = apply_parallel_settings(parameter_dicts[0], opts, ranks)
+                    parameter_dicts[0] = dump_parameters(parameter_dicts[0], 'parameter_tmp.json')
+                    print(format_report(report, ranks))
+                    span.set(ranks=ranks, incars=len(report))
+
+            # split oversized studies into concurrently submitted workflows,
+            # spread over the submission targets if there are several
+            targets = parse_targets(opts.submission_targets)
+            with tracer.span('sharding') as span:
+                work_dirs, nodes = shard_workdir(
+                    workdir, parameter_dicts[0], count, opts.max_workflow_nodes, opts.group_size,
+                    min_shards=len(targets))
+                ledger = QuotaLedger(cwd / opts.quota_ledger if opts.quota_ledger else None, workdir / LEDGER_FILE)
+                submissions = plan_submissions(workdir, work_dirs, config_dict, targets, ledger)
+                span.set(shards=len(work_dirs), estimated_nodes=nodes, targets=len(submissions))
+            checkpoint.plan(parameter_dicts, config_dict, submissions)
+        else:
+            parameter_dicts = checkpoint.data["parameters"]
+            if checkpoint.config_changed(config_dict):
+                print('global config changed since the checkpoint, pending workflows use the new one')
+
+        if opts.pack_workdir:
+            # the staged and planned tree, packed before APEX adds its records to the work dirs
+            with tracer.span('pack_workdir') as span:
+                archive, index = pack_workdir(workdir, cwd / opts.output_directory)
+                span.set(files=len(index["members"]), bytes=index["archive_bytes"], raw_bytes=index["raw_bytes"])
+                print(f'staged workdir packed into {archive}')
+
+        # submit APEX workflow, work dirs Argo already accepted are never resubmitted
+        with tracer.span('submit_workflow') as span:
+            submitted = 0
+            for group in checkpoint.data["groups"]:
+                pending = checkpoint.pending(group["work_dirs"])
+                if pending:
+                    submit_workflow(
+                        parameter_dicts=group.get("parameters", parameter_dicts),
+                        config_dict=target_config(config_dict, group["target"]),
+                        work_dirs=pending,
+                        indicated_flow_type=None,
+                        labels=opts.dflow_labels
+                    )
+                    submitted += len(pending)
+                checkpoint.record(group)
+            record_submission(workdir)
+            checkpoint.complete('submitted')
+            span.set(workflows=submitted)
 
-    os.chdir(workdir)
-    # papare global config
-    config_dict = get_global_config(opts)
-    
-    # papare parameter files
-    if opts.parameter_files:
-        for ii in opts.parameter_files:
-            os.chdir(cwd)
-            with open(ii, 'r') as f:
-                j = json.load(f)
-                j["structures"] = ["returns/conf.*"]
-            with open(ii, 'w') as r:
-                json.dump(j, r, indent=2)
-            shutil.copy(ii, workdir)
-            parameter_dicts.append(loadfn(ii))
-            os.chdir(workdir)
-    else:
-        parsed_parameter_dict = get_parameter_dict(opts)
-        json.dump(parsed_parameter_dict, open('parameter_tmp.json', 'w'), indent=2)
-        parsed_parameter_dict = loadfn('parameter_tmp.json')
-        parameter_dicts.append(parsed_parameter_dict)
-    
-    # submit APEX workflow
-    submit_workflow(
-        parameter_dicts=parameter_dicts,
-        config_dict=config_dict,
-        work_dirs=['./'],
-        indicated_flow_type=None,
-        labels=opts.dflow_labels
-    )
-
-    os.chdir(cwd)
-    shutil.copytree(workdir, Path(opts.output_directory)/'workdir', dirs_exist_ok = True)
\ No newline at end of file
+        os.chdir(cwd)
+        with tracer.span('copy_out') as span:
+            if opts.pack_workdir:
+                copied = copy_unpacked(workdir, Path(opts.output_directory)/'workdir', index, copy_function=span.copy)
+                span.set(files=len(copied))
+            else:
+                shutil.copytree(workdir, Path(opts.output_directory)/'workdir',
+                                copy_function=span.copy, dirs_exist_ok=True)
+    finally:
+        os.chdir(cwd)
+        tracer.dump(trace_file)
+        print(f'phase timings (ms): {tracer.summary()}')